@@ -0,0 +1,550 @@
+#!/usr/bin/env python3
+"""
+Claude Token Counter Benchmark
+Generates a synthetic Claude projects tree and times each stage of the
+claude-token-counter pipeline against a stored baseline.
+"""
+
+import argparse
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
+from claude_token_counter import core as counter
+
+try:
+    import resource
+except ImportError:  # Not available on Windows; peak RSS is then unknown
+    resource = None
+
+DEFAULT_MODELS = (
+    "claude-sonnet-4-5-20250929=0.6,"
+    "claude-haiku-4-5-20251001=0.25,"
+    "claude-opus-4-5-20250514=0.1,"
+    "glm-4.6=0.05"
+)
+
+# Share of duplicate requestIds copied from an earlier file, as when a
+# session is resumed; the rest repeat the previous request in the same file
+CROSS_FILE_DUPLICATES = 0.1
+
+# Every Nth file is a sub-agent log inside its session's directory
+SUBAGENT_EVERY = 5
+
+BASELINE_VERSION = 1
+
+STAGES = ("discover", "parse", "aggregate", "cost")
+
+
+def parse_models(value):
+    """argparse type for --models: ``name=weight,...``."""
+    models = []
+    for item in value.split(","):
+        name, _, weight = item.partition("=")
+        try:
+            models.append((name.strip(), float(weight) if weight else 1.0))
+        except ValueError:
+            raise argparse.ArgumentTypeError(f"invalid model weight: {item!r}")
+    if not models or any(not name or weight < 0 for name, weight in models):
+        raise argparse.ArgumentTypeError(f"invalid model mix: {value!r}")
+    return models
+
+
+def parse_ratio(value):
+    """argparse type for options that take a fraction between 0 and 1."""
+    ratio = float(value)
+    if not 0 <= ratio <= 1:
+        raise argparse.ArgumentTypeError(f"{value} is not between 0 and 1")
+    return ratio
+
+
+def iso_timestamp(moment):
+    """Format a UTC datetime the way Claude Code logs it."""
+    return moment.strftime("%Y-%m-%dT%H:%M:%S.") + f"{moment.microsecond // 1000:03d}Z"
+
+
+def generate_tree(root, config):
+    """Write a deterministic synthetic ``~/.claude/projects`` tree to ``root``.
+
+    Lines mimic Claude Code logs: user turns carrying tool results,
+    assistant turns with usage, and the occasional summary line.  A streamed
+    response is logged once per content block, so duplicate requestIds
+    mostly repeat the previous assistant line, with a few copied from
+    earlier files.  Returns the total bytes written.
+    """
+    rng = random.Random(config["seed"])
+    names = [name for name, _ in config["models"]]
+    weights = [weight for _, weight in config["models"]]
+    start = datetime(2025, 10, 1, tzinfo=timezone.utc)
+    earlier = []
+    written = 0
+
+    root = Path(root)
+    for file_number in range(config["files"]):
+        project = root / f"-home-user-proj{file_number % config['projects']}"
+        session = str(uuid.UUID(int=rng.getrandbits(128)))
+        if file_number % SUBAGENT_EVERY == SUBAGENT_EVERY - 1:
+            directory = project / session / "subagents"
+            file_path = directory / f"agent-{rng.getrandbits(32):08x}.jsonl"
+        else:
+            directory = project
+            file_path = directory / f"{session}.jsonl"
+        directory.mkdir(parents=True, exist_ok=True)
+
+        moment = start + timedelta(seconds=rng.randrange(30 * 24 * 3600))
+        cwd = f"/home/user/proj{file_number % config['projects']}"
+        branch = rng.choice(("main", "main", "dev", "feature/bench"))
+        previous = None
+        requests = []
+        lines = []
+        for _ in range(max(1, int(config["lines"] * rng.uniform(0.5, 1.5)))):
+            moment += timedelta(milliseconds=rng.randrange(200, 20000))
+            payload = "x" * int(config["payload"] * rng.uniform(0.5, 1.5))
+            common = {
+                "parentUuid": str(uuid.UUID(int=rng.getrandbits(128))),
+                "isSidechain": directory != project,
+                "userType": "external",
+                "cwd": cwd,
+                "sessionId": session,
+                "version": "2.0.14",
+                "gitBranch": branch,
+                "uuid": str(uuid.UUID(int=rng.getrandbits(128))),
+            }
+            if rng.random() >= config["assistant_ratio"]:
+                if rng.random() < 0.02:
+                    record = {"type": "summary", "summary": payload[:80]}
+                else:
+                    record = dict(
+                        common,
+                        type="user",
+                        timestamp=iso_timestamp(moment),
+                        message={
+                            "role": "user",
+                            "content": [
+                                {
+                                    "tool_use_id": f"toolu_{rng.getrandbits(64):016x}",
+                                    "type": "tool_result",
+                                    "content": payload,
+                                }
+                            ],
+                        },
+                    )
+                lines.append(json.dumps(record))
+                continue
+
+            if rng.random() < config["duplicate_rate"] and (previous or earlier):
+                if previous is None or (
+                    earlier and rng.random() < CROSS_FILE_DUPLICATES
+                ):
+                    request = rng.choice(earlier)
+                else:
+                    request = previous
+            else:
+                request = {
+                    "requestId": f"req_{rng.getrandbits(96):024x}",
+                    "id": f"msg_{rng.getrandbits(96):024x}",
+                    "model": rng.choices(names, weights)[0],
+                    "timestamp": iso_timestamp(moment),
+                    "usage": {
+                        "input_tokens": rng.randrange(1, 50),
+                        "cache_creation_input_tokens": rng.randrange(0, 20000),
+                        "cache_read_input_tokens": rng.randrange(0, 150000),
+                        "output_tokens": rng.randrange(1, 4000),
+                        "service_tier": "standard",
+                    },
+                }
+                requests.append(request)
+            previous = request
+            record = dict(
+                common,
+                type="assistant",
+                timestamp=request["timestamp"],
+                requestId=request["requestId"],
+                message={
+                    "id": request["id"],
+                    "type": "message",
+                    "role": "assistant",
+                    "model": request["model"],
+                    "content": [{"type": "text", "text": payload}],
+                    "stop_reason": None,
+                    "usage": request["usage"],
+                },
+            )
+            lines.append(json.dumps(record))
+
+        data = ("\n".join(lines) + "\n").encode("utf-8")
+        file_path.write_bytes(data)
+        written += len(data)
+        earlier.extend(rng.sample(requests, min(len(requests), 20)))
+    return written
+
+
+def prepare_tree(tree, config):
+    """Generate the tree unless ``tree`` already holds one for ``config``."""
+    marker = Path(tree) / ".bench.json"
+    try:
+        with open(marker, "r", encoding="utf-8") as f:
+            if json.load(f) == config:
+                print(f"Reusing benchmark tree {tree}", file=sys.stderr)
+                return
+    except (OSError, ValueError):
+        pass
+
+    shutil.rmtree(tree, ignore_errors=True)
+    print(f"Generating benchmark tree in {tree}...", file=sys.stderr)
+    started = time.perf_counter()
+    written = generate_tree(tree, config)
+    print(
+        f"Generated {config['files']} files ({written / 1_000_000:.1f} MB) in "
+        f"{time.perf_counter() - started:.2f}s",
+        file=sys.stderr,
+    )
+    with open(marker, "w", encoding="utf-8") as f:
+        json.dump(config, f)
+
+
+def reset_peak_rss():
+    """Reset the kernel's peak RSS mark; return False where unsupported."""
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+
+def peak_rss():
+    """Return the peak resident set size of this process in bytes."""
+    try:
+        with open("/proc/self/status", "r") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    if resource is None:
+        return 0
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in kilobytes elsewhere
+    return maxrss if sys.platform == "darwin" else maxrss * 1024
+
+
+def run_pipeline(tree, options, pricing):
+    """Run every pipeline stage once; return ``{stage: measurements}``.
+
+    The stages are the ones main() chains together, but each runs to
+    completion before the next starts, so the per-file partials are all
+    held at once rather than folded as they arrive.
+    """
+    results = {}
+    resettable = True
+
+    def measure(stage, work):
+        nonlocal resettable
+        resettable = reset_peak_rss() and resettable
+        started = time.perf_counter()
+        value = work()
+        results[stage] = {
+            "seconds": time.perf_counter() - started,
+            "peak_rss": peak_rss(),
+        }
+        return value
+
+    claude_dir = Path(tree)
+    jsonl_files = measure(
+        "discover", lambda: list(counter.scan_claude_projects(claude_dir))
+    )
+    partials = measure(
+        "parse",
+        lambda: list(
+            counter.analyze_files(jsonl_files, options=options, claude_dir=claude_dir)
+        ),
+    )
+    aggregated = measure(
+        "aggregate",
+        lambda: counter.aggregate_stats(
+            partials, counter.DedupIndex(options["policy"])
+        ),
+    )
+    measure("cost", lambda: counter.calculate_stats_costs(aggregated, pricing))
+
+    scan = aggregated["scan"]
+    parse = results["parse"]
+    parse["lines"] = scan["lines"]
+    parse["bytes"] = scan["bytes"]
+    for stage in STAGES:
+        results[stage]["peak_rss_exact"] = resettable
+    return results
+
+
+def best_of(runs):
+    """Keep the fastest time and the highest peak RSS of each stage."""
+    best = {}
+    for stage in STAGES:
+        samples = [run[stage] for run in runs]
+        best[stage] = dict(min(samples, key=lambda sample: sample["seconds"]))
+        best[stage]["peak_rss"] = max(sample["peak_rss"] for sample in samples)
+    return best
+
+
+def default_baseline_path():
+    """Return the default location of the stored benchmark baseline."""
+    cache_home = os.environ.get("XDG_CACHE_HOME") or Path.home() / ".cache"
+    return Path(cache_home) / "claude-token-counter" / "bench-baseline.json"
+
+
+def load_baseline(path, config):
+    """Return the stored stage results for ``config``, or None."""
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError) as e:
+        print(f"Ignoring unreadable baseline {path}: {e}", file=sys.stderr)
+        return None
+
+    if baseline.get("version") != BASELINE_VERSION:
+        return None
+    if baseline.get("config") != config:
+        print(
+            f"Baseline {path} was recorded with different settings; not comparing",
+            file=sys.stderr,
+        )
+        return None
+    return baseline["stages"]
+
+
+def save_baseline(path, config, stages):
+    """Write the stage results as the new baseline."""
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(
+            {"version": BASELINE_VERSION, "config": config, "stages": stages},
+            f,
+            indent=2,
+        )
+    print(f"Saved baseline to {path}", file=sys.stderr)
+
+
+def compare(stages, baseline, threshold):
+    """Return ``{stage: [regressed metric names]}`` against the baseline."""
+    regressions = {}
+    for stage in STAGES:
+        if stage not in baseline:
+            continue
+        regressed = [
+            metric
+            for metric in ("seconds", "peak_rss")
+            if stages[stage][metric] > baseline[stage][metric] * (1 + threshold)
+        ]
+        if regressed:
+            regressions[stage] = regressed
+    return regressions
+
+
+def change(value, base):
+    """Format the relative change of ``value`` from ``base``."""
+    if not base:
+        return ""
+    return f"{(value - base) / base * 100:+.1f}%"
+
+
+def print_results(stages, baseline=None, regressions=None):
+    """Print the per-stage measurements, with changes from the baseline."""
+    regressions = regressions or {}
+    print("\n" + "=" * 80)
+    print("Benchmark Results")
+    print("=" * 80)
+    print(
+        f"{'Stage':<12} {'Time (s)':>10} {'Change':>9} {'Peak RSS (MB)':>14} "
+        f"{'Change':>9} {'Throughput':>22}"
+    )
+    print("-" * 80)
+    total = 0.0
+    for stage in STAGES:
+        result = stages[stage]
+        total += result["seconds"]
+        base = (baseline or {}).get(stage, {})
+        throughput = ""
+        if "lines" in result:
+            seconds = max(result["seconds"], 1e-9)
+            throughput = (
+                f"{result['lines'] / seconds:,.0f} lines/s "
+                f"{result['bytes'] / 1_000_000 / seconds:.1f} MB/s"
+            )
+        rss = result["peak_rss"] / 1_000_000
+        flag = " !" if stage in regressions else ""
+        print(
+            f"{stage:<12} {result['seconds']:>10.3f} "
+            f"{change(result['seconds'], base.get('seconds')):>9} "
+            f"{rss:>14.1f}{'' if result['peak_rss_exact'] else '*'} "
+            f"{change(result['peak_rss'], base.get('peak_rss')):>8} "
+            f"{throughput:>22}{flag}"
+        )
+    print("-" * 80)
+    print(f"{'total':<12} {total:>10.3f}")
+    if not all(stages[stage]["peak_rss_exact"] for stage in STAGES):
+        print("* peak RSS of the whole process; it cannot be reset per stage here")
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmark claude-token-counter on a synthetic log tree"
+    )
+    parser.add_argument(
+        "--files", type=int, default=200, help="Number of log files (default: 200)"
+    )
+    parser.add_argument(
+        "--lines",
+        type=int,
+        default=2000,
+        help="Average lines per file (default: 2000)",
+    )
+    parser.add_argument(
+        "--projects", type=int, default=8, help="Number of projects (default: 8)"
+    )
+    parser.add_argument(
+        "--assistant-ratio",
+        type=parse_ratio,
+        default=0.5,
+        help="Share of lines that are assistant turns (default: 0.5)",
+    )
+    parser.add_argument(
+        "--duplicate-rate",
+        type=parse_ratio,
+        default=0.3,
+        help="Share of assistant lines repeating a requestId (default: 0.3)",
+    )
+    parser.add_argument(
+        "--models",
+        type=parse_models,
+        default=DEFAULT_MODELS,
+        help=f"Model mix as name=weight,... (default: {DEFAULT_MODELS})",
+    )
+    parser.add_argument(
+        "--payload",
+        type=int,
+        default=600,
+        help="Average message content size in bytes (default: 600)",
+    )
+    parser.add_argument(
+        "--seed", type=int, default=0, help="Generator seed (default: 0)"
+    )
+    parser.add_argument(
+        "--tree",
+        help="Directory for the generated tree, reused while the generator "
+        "settings match (default: a temporary directory)",
+    )
+    parser.add_argument(
+        "--repeat",
+        type=int,
+        default=3,
+        help="Runs per stage; the fastest is reported (default: 3)",
+    )
+    parser.add_argument(
+        "--decoder",
+        default="auto",
+        help="JSON decoder backend to benchmark (default: auto)",
+    )
+    parser.add_argument(
+        "--reader",
+        choices=counter.READERS,
+        default="auto",
+        help="Line reader to benchmark (default: auto)",
+    )
+    parser.add_argument(
+        "--baseline",
+        help="Baseline file (default: ~/.cache/claude-token-counter/bench-baseline.json)",
+    )
+    parser.add_argument(
+        "--save-baseline",
+        action="store_true",
+        help="Store this run as the new baseline",
+    )
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=0.1,
+        help="Relative slowdown or growth reported as a regression (default: 0.1)",
+    )
+    parser.add_argument("--json", action="store_true", help="Output results as JSON")
+
+    args = parser.parse_args()
+    if args.files < 1 or args.lines < 1 or args.projects < 1 or args.repeat < 1:
+        parser.error("--files, --lines, --projects and --repeat must be positive")
+    try:
+        args.decoder = counter.get_decoder(args.decoder)[0]
+    except (ImportError, ValueError) as e:
+        parser.error(f"JSON decoder {args.decoder!r} is not available: {e}")
+
+    config = {
+        "files": args.files,
+        "lines": args.lines,
+        "projects": args.projects,
+        "assistant_ratio": args.assistant_ratio,
+        "duplicate_rate": args.duplicate_rate,
+        "models": [list(model) for model in args.models],
+        "payload": args.payload,
+        "seed": args.seed,
+    }
+    options = {"decoder": args.decoder, "reader": args.reader, "policy": "first"}
+
+    tree = args.tree or tempfile.mkdtemp(prefix="claude-token-bench-")
+    try:
+        prepare_tree(tree, config)
+        pricing = counter.load_pricing()
+        runs = []
+        for run in range(args.repeat):
+            print(f"Run {run + 1}/{args.repeat}...", file=sys.stderr)
+            runs.append(run_pipeline(tree, options, pricing))
+    finally:
+        if args.tree is None:
+            shutil.rmtree(tree, ignore_errors=True)
+    stages = best_of(runs)
+
+    baseline_path = Path(args.baseline) if args.baseline else default_baseline_path()
+    # The decoder and reader are part of what a baseline measured
+    baseline_config = dict(config, decoder=args.decoder, reader=args.reader)
+    baseline = load_baseline(baseline_path, baseline_config)
+    regressions = compare(stages, baseline, args.threshold) if baseline else {}
+
+    if args.json:
+        print(
+            json.dumps(
+                {
+                    "config": baseline_config,
+                    "stages": stages,
+                    "baseline": baseline,
+                    "regressions": regressions,
+                },
+                indent=2,
+            )
+        )
+    else:
+        print_results(stages, baseline, regressions)
+        for stage, metrics in regressions.items():
+            print(
+                f"Regression in {stage}: "
+                + ", ".join(
+                    f"{metric} {change(stages[stage][metric], baseline[stage][metric])}"
+                    for metric in metrics
+                ),
+                file=sys.stderr,
+            )
+
+    if args.save_baseline:
+        save_baseline(baseline_path, baseline_config, stages)
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
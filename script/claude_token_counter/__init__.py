@@ -0,0 +1,18 @@
+"""
+Claude Token Counter
+Analyzes Claude conversation logs to count token usage and costs.
+
+claude-token-counter.py runs cli.main().  The modules, from the bottom up:
+
+- core: parsing, deduplication, pricing and aggregation of usage logs
+- inotify: inotify(7) bindings for following the logs
+- report: text and JSON reports
+- watch: the live view (--watch)
+- ingest: the SQLite database (ingest, query)
+- approx: sampled approximate totals (--approx)
+- export: per-request records (--export)
+- archive: summary logs replacing old ones (archive)
+- snapshot: aggregate snapshots (export-snapshot, merge)
+- serve: the HTTP metrics server (serve)
+- cli: the command line
+"""
@@ -0,0 +1,657 @@
+"""Sampled approximate totals with confidence intervals (--approx)."""
+
+import argparse
+import math
+import os
+import random
+import sys
+import time
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from operator import itemgetter
+
+from .core import (
+    COST_SCALE,
+    EXCLUDED_ROW,
+    PARALLEL_TASKS_PER_CHUNK,
+    SCAN_COUNTERS,
+    USAGE_COLUMNS,
+    UsageStore,
+    _analyze_range,
+    analyze_jsonl_file,
+    log_opener,
+    merge_partial,
+    new_file_stats,
+    price_cells,
+    project_name,
+    replaces,
+    resolve_claude_dir,
+    rollup_store,
+    scan_claude_projects,
+)
+from .report import format_number, print_dedup_summary, print_scan_rate
+
+
+# Relative error, as half a 95% confidence interval, --approx stops at
+APPROX_ERROR = 0.05
+
+# Normal quantile of the 95% confidence intervals reported by --approx
+APPROX_Z = 1.96
+
+# Size of the byte ranges --approx samples the plain logs in
+APPROX_BLOCK_BYTES = 1024 * 1024
+
+# Groups the sampled blocks are dealt into for the --approx intervals
+APPROX_GROUPS = 20
+
+# Blocks read before the first estimate, and the fewest a later round reads;
+# each later round at most doubles the sample
+APPROX_MIN_BLOCKS = 8
+
+# The sample is drawn from a fixed seed by default, so repeated estimates agree
+APPROX_SEED = 0
+
+
+def t_quantile(df):
+    """Return the Student t quantile matching APPROX_Z for ``df`` degrees of freedom.
+
+    Uses the Cornish-Fisher expansion around the normal quantile, within
+    0.001 of the exact value from 7 degrees of freedom on, so intervals from
+    the first few blocks are not too narrow.
+    """
+    z = APPROX_Z
+    return (
+        z
+        + (z**3 + z) / (4 * df)
+        + (5 * z**5 + 16 * z**3 + 3 * z) / (96 * df**2)
+        + (3 * z**7 + 19 * z**5 + 17 * z**3 - 15 * z) / (384 * df**3)
+    )
+
+
+def parse_error_bound(value):
+    """argparse type for --approx: a relative error below 1."""
+    try:
+        error = float(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid error bound: {value!r}")
+    if not 0 <= error < 1:
+        raise argparse.ArgumentTypeError(f"{value} is not between 0 and 1")
+    return error
+
+
+def line_boundary(f, offset):
+    """Return the start of the first line at or after ``offset`` in ``f``."""
+    if offset == 0:
+        return 0
+    f.seek(offset - 1)
+    f.readline()
+    return f.tell()
+
+
+def split_blocks(jsonl_files, block_bytes=APPROX_BLOCK_BYTES):
+    """Split logs into the sampling units of --approx.
+
+    Returns ``(blocks, whole_files, total_bytes)``: ``blocks`` lists
+    ``(file_path, start, end, file_blocks)`` byte ranges of the plain logs,
+    ``file_blocks`` being the number of blocks of that file, and
+    ``total_bytes`` their summed size.  Compressed logs cannot be entered
+    mid-stream; they are listed in ``whole_files`` to be read in full.
+    """
+    blocks = []
+    whole_files = []
+    total_bytes = 0
+    for file_path in jsonl_files:
+        if log_opener(file_path) is not open:
+            whole_files.append(file_path)
+            continue
+        try:
+            size = os.path.getsize(file_path)
+        except OSError:
+            continue
+        file_blocks = -(-size // block_bytes)
+        for start in range(0, size, block_bytes):
+            blocks.append(
+                (file_path, start, min(start + block_bytes, size), file_blocks)
+            )
+        total_bytes += size
+    return blocks, whole_files, total_bytes
+
+
+def _analyze_block(task):
+    """Worker entry point: parse the lines starting in one sampled block."""
+    file_path, start, end, project, options = task
+    try:
+        with open(file_path, "rb") as f:
+            start = line_boundary(f, start)
+            end = line_boundary(f, end)
+    except OSError as e:
+        stats = new_file_stats(start)
+        stats["error"] = str(e)
+        return stats
+    if start >= end:
+        return new_file_stats(start)
+    return analyze_jsonl_file(file_path, start, end, project=project, **options)
+
+
+class BlockSample:
+    """Running --approx estimate from a simple random sample of log blocks.
+
+    Sampled totals are scaled up as ratio estimates against the block sizes:
+    by the logs' total size over the sampled bytes, which is known from the
+    file sizes without reading them.  Logs read in full (see split_blocks())
+    are counted exactly, in ``exact``.
+
+    Copies of a request within a block are resolved while it is parsed;
+    copies in other blocks mostly go unseen, so requests are not scaled up
+    one by one.  Instead the number of distinct requests is estimated from
+    the blocks the sampled ones were seen in (see distinct_requests()), and
+    the sampled requests, counted once each, are scaled to it.  The
+    intervals come from a jackknife over groups of the sampled blocks (see
+    replicates()), which covers the error of both.  Only the requests of the sample are
+    remembered, so memory grows with the sample, not with the history.
+    Distinct sessions are estimated from the sampled ones and the blocks of
+    the files they were seen in (see session_estimate()).
+    """
+
+    QUANTITIES = ("tokens", "messages", "cost")
+
+    def __init__(self, population, total_bytes, pricing=None, policy="first"):
+        self.population = population
+        self.total_bytes = total_bytes
+        self.pricing = pricing
+        self.policy = policy
+        self.exact = new_file_stats()
+        self.whole_files = 0
+        self.blocks = 0
+        self.bytes = 0
+        # Per group of sampled blocks (see replicates()): their bytes, and the
+        # (tokens, messages, cost) of their records without a requestId
+        self.group_bytes = [0] * APPROX_GROUPS
+        self.group_unkeyed = [[0, 0, 0.0] for _ in range(APPROX_GROUPS)]
+        # requestId hash -> [cell key (None when it fails the filters), tokens
+        # of the counted copy, blocks it was seen in, whether a fully read log
+        # has it, log position of the counted copy, groups of those blocks]
+        self.seen = {}
+        # requestId hash -> log position of the copy counted in ``exact``
+        self.exact_positions = {}
+        # Sampled records without a requestId
+        self.unkeyed = UsageStore()
+        # Sampled session -> {file: blocks of the file}
+        self.sessions = {}
+        self.exact_sessions = set()
+        self.scan = dict.fromkeys(("files",) + SCAN_COUNTERS, 0)
+        self.duplicates = 0
+        # replicates() of the sample as it stands, until a block is added
+        self._replicates = None
+
+    def quantities(self, store):
+        """Return the ``(tokens, messages, cost)`` totals of a store."""
+        tokens = sum(sum(column) for column in store.columns[:4])
+        messages = sum(store.columns[4])
+        cost = 0.0
+        if self.pricing:
+            cost = sum(price_cells(store, self.pricing)) / COST_SCALE
+        return tokens, messages, cost
+
+    def _count_scan(self, partial):
+        self.scan["files"] += 1
+        for counter in SCAN_COUNTERS:
+            self.scan[counter] += partial[counter]
+        self.duplicates += partial["duplicates"]
+
+    def add_exact(self, partial, position):
+        """Count the partial of a fully read log.
+
+        ``position`` orders the log among the blocks, as ``(file index,
+        offset)`` in scan order, so copies are resolved as a full scan would.
+        """
+        self._count_scan(partial)
+        requests = self.exact["requests"]
+        counted = {key: requests.get(key) for key in partial["requests"]}
+        merge_partial(self.exact, partial, self.policy)
+        for key, contribution in counted.items():
+            if requests[key] is not contribution:
+                self.exact_positions[key] = position
+        self.whole_files += 1
+        self._replicates = None
+
+    def _displaces(self, entry, tokens, position):
+        """Return True when a copy at ``position`` displaces ``entry``'s."""
+        if self.policy == "first":
+            return position < entry[4]
+        if self.policy == "last":
+            return position > entry[4]
+        old, new = (None, *entry[1]), (None, *tokens)
+        if replaces(self.policy, old, new):
+            return True
+        # Ties go to the earlier copy, as in a full scan
+        return not replaces(self.policy, new, old) and position < entry[4]
+
+    def add_block(self, partial, file_path, size, file_blocks, position):
+        """Add a sampled block's partial; ``size`` is the block's nominal size.
+
+        ``position`` is the block's place in scan order (see add_exact()).
+        """
+        if not self.blocks:
+            # Fully read logs come first; their requests are known for sure,
+            # and sampled copies only move them to another cell
+            store = self.exact["store"]
+            for key, (row, *tokens) in self.exact["requests"].items():
+                cell = store.key(row) if row != EXCLUDED_ROW else None
+                self.seen[key] = [
+                    cell,
+                    tokens,
+                    0,
+                    True,
+                    self.exact_positions[key],
+                    [],
+                ]
+            self.exact_sessions = store.distinct("session") - {None, ""}
+        self._count_scan(partial)
+        block = partial["store"]
+
+        # Blocks are drawn in random order, so dealing them out in turn
+        # gives random groups
+        group = self.blocks % APPROX_GROUPS
+        self.blocks += 1
+        self.bytes += size
+        self.group_bytes[group] += size
+        self._replicates = None
+
+        unkeyed = [list(column) for column in block.columns]
+        for key, (row, *tokens) in partial["requests"].items():
+            # Requests whose copy fails the filters are counted in no cell
+            cell = None
+            if row != EXCLUDED_ROW:
+                cell = block.key(row)
+                for column, value in zip(unkeyed, (*tokens, 1)):
+                    column[row] -= value
+            entry = self.seen.get(key)
+            if entry is None:
+                self.seen[key] = [cell, tokens, 1, False, position, [group]]
+                continue
+            entry[2] += 1
+            entry[5].append(group)
+            self.duplicates += 1
+            if not self._displaces(entry, tokens, position):
+                continue
+            if entry[3]:
+                exact = self.exact["store"]
+                if entry[0] is not None:
+                    exact.add(
+                        exact.row(*entry[0]),
+                        *(-value for value in entry[1]),
+                        messages=-1,
+                    )
+                if cell is not None:
+                    exact.add(exact.row(*cell), *tokens)
+            entry[0] = cell
+            entry[1] = tokens
+            entry[4] = position
+        residual = UsageStore()
+        for row, *counters in zip(range(len(block)), *unkeyed):
+            if counters[-1]:
+                *tokens, messages = counters
+                key = block.key(row)
+                self.unkeyed.add(self.unkeyed.row(*key), *tokens, messages=messages)
+                residual.add(residual.row(*key), *tokens, messages=messages)
+        group_unkeyed = self.group_unkeyed[group]
+        for index, value in enumerate(self.quantities(residual)):
+            group_unkeyed[index] += value
+
+        for session in block.distinct("session") - {None, ""}:
+            if session not in self.exact_sessions:
+                self.sessions.setdefault(session, {})[file_path] = file_blocks
+
+    def weight(self):
+        """Return the factor scaling the sampled bytes up to every byte."""
+        return self.total_bytes / self.bytes if self.bytes else 0.0
+
+    def _distinct(self, frequencies, sampled_bytes):
+        """Return ``(sampled, estimated)`` distinct requests of sampled blocks.
+
+        With ``f[j]`` the requests seen in ``j`` of the ``n`` sampled blocks
+        out of ``N``, every request seen once stands for ``(N - n) / n``
+        unseen ones, as in the plain ratio estimate, less those that were
+        copies of requests logged in several blocks: ``f[2]`` times
+        ``(N - n) * (N - n + 1) / (n * (n - 1)) * 2 / k``, ``k`` being the
+        copies of the requests seen twice, ``2 + 3 * (N - n) * f[3] /
+        ((n - 2) * f[2])`` on average.  This is unbiased while no request
+        has more than two copies, and exact once every block is read.
+        ``n`` is counted in blocks of the average size, from
+        ``sampled_bytes``.
+        """
+        sampled = sum(frequencies.values())
+        if not sampled:
+            return 0, 0.0
+        population = self.population
+        n = population * sampled_bytes / self.total_bytes
+        estimated = sampled + frequencies[1] * (population - n) / n
+        twice, thrice = frequencies[2], frequencies[3]
+        if n <= 2 or not twice:
+            return sampled, estimated
+        pairs = (population - n) * (population - n + 1) / (n * (n - 1))
+        spread = 3 * (population - n) / (n - 2)
+        correction = 2 * pairs * twice * twice / (2 * twice + spread * thrice)
+        return sampled, estimated - correction
+
+    def distinct_requests(self):
+        """Return ``(sampled, estimated)`` distinct requests of the sampled logs.
+
+        See _distinct().
+        """
+        frequencies = defaultdict(int)
+        for _, _, blocks, exact, _, _ in self.seen.values():
+            if not exact:
+                frequencies[blocks] += 1
+        return self._distinct(frequencies, self.bytes)
+
+    def requests_store(self):
+        """Return the cells of the sampled requests, each counted once."""
+        store = UsageStore()
+        for cell, tokens, _, exact, _, _ in self.seen.values():
+            if not exact and cell is not None:
+                store.add(store.row(*cell), *tokens)
+        return store
+
+    def replicates(self):
+        """Return ``(estimates, replicates)`` of the QUANTITIES totals.
+
+        The sampled blocks are dealt into APPROX_GROUPS groups, and every
+        replicate estimates the totals again without one group (a
+        delete-a-group jackknife): without its bytes, its records lacking a
+        requestId and its copies of the sampled requests, so the distinct
+        requests are estimated again as well.  A request seen only in the
+        group left out drops out, and any other keeps its counted copy.
+        """
+        if self._replicates is not None:
+            return self._replicates
+        exact = self.quantities(self.exact["store"])
+        groups = min(self.blocks, APPROX_GROUPS)
+        frequencies = defaultdict(int)
+        counted = UsageStore()
+        # Per group: how frequencies change without it, and the requests
+        # only it has
+        shifts = [defaultdict(int) for _ in range(groups)]
+        dropped = [UsageStore() for _ in range(groups)]
+        for cell, tokens, blocks, known, _, seen_groups in self.seen.values():
+            if known:
+                continue
+            frequencies[blocks] += 1
+            if cell is not None:
+                counted.add(counted.row(*cell), *tokens)
+            for group in set(seen_groups):
+                left = blocks - seen_groups.count(group)
+                shift = shifts[group]
+                shift[blocks] -= 1
+                if left:
+                    shift[left] += 1
+                elif cell is not None:
+                    dropped[group].add(dropped[group].row(*cell), *tokens)
+
+        def totals(frequencies, sampled_bytes, requests, unkeyed):
+            weight = self.total_bytes / sampled_bytes if sampled_bytes else 0.0
+            sampled, estimated = self._distinct(frequencies, sampled_bytes)
+            scale = estimated / sampled if sampled else 0.0
+            return tuple(
+                known + scale * sampled_value + weight * unkeyed_value
+                for known, sampled_value, unkeyed_value in zip(
+                    exact, requests, unkeyed
+                )
+            )
+
+        requests = self.quantities(counted)
+        unkeyed = [sum(values) for values in zip(*self.group_unkeyed)]
+        estimates = totals(frequencies, self.bytes, requests, unkeyed)
+        replicates = []
+        for group in range(groups):
+            shifted = frequencies.copy()
+            for blocks, change in shifts[group].items():
+                shifted[blocks] += change
+            replicates.append(
+                totals(
+                    shifted,
+                    self.bytes - self.group_bytes[group],
+                    [
+                        value - gone
+                        for value, gone in zip(
+                            requests, self.quantities(dropped[group])
+                        )
+                    ],
+                    [
+                        value - gone
+                        for value, gone in zip(unkeyed, self.group_unkeyed[group])
+                    ],
+                )
+            )
+        self._replicates = estimates, replicates
+        return self._replicates
+
+    def estimate(self, quantity):
+        """Return ``(estimate, margin)``: a total and half its 95% interval.
+
+        The margin is the jackknife variance of the replicates (see
+        replicates()), with the finite population correction, times the t
+        quantile for one degree of freedom fewer than there are groups.
+        """
+        estimates, replicates = self.replicates()
+        position = self.QUANTITIES.index(quantity)
+        estimate = estimates[position]
+        n, population, groups = self.blocks, self.population, len(replicates)
+        if groups < 2 or n >= population:
+            return estimate, 0.0
+        values = [replicate[position] for replicate in replicates]
+        mean = sum(values) / groups
+        variance = (
+            (1 - n / population)
+            * (groups - 1)
+            / groups
+            * sum((value - mean) ** 2 for value in values)
+        )
+        return estimate, t_quantile(groups - 1) * math.sqrt(variance)
+
+    def session_estimate(self):
+        """Estimate the distinct sessions of the sampled logs.
+
+        Every sampled session with a counted request counts once over the
+        chance that a block of the files it was seen in was sampled
+        (Horvitz-Thompson).  Sessions of the fully read logs count once.
+        """
+        n, population = self.blocks, self.population
+        counted = self.requests_store().distinct("session")
+        counted |= self.unkeyed.distinct("session")
+        total = len(self.exact_sessions)
+        for session, files in self.sessions.items():
+            if session not in counted:
+                continue
+            # Chance that none of the session's blocks was sampled
+            missed = 1.0
+            for i in range(min(sum(files.values()), population)):
+                if population - n - i <= 0:
+                    missed = 0.0
+                    break
+                missed *= (population - n - i) / (population - i)
+            total += 1 / (1 - missed)
+        return round(total)
+
+    def report_store(self):
+        """Return the estimated cells: the fully read logs plus the scaled sample.
+
+        Scaled cells are rounded on their running totals, so each column
+        adds up to its rounded estimate however small the cells are.
+        """
+        sampled, estimated = self.distinct_requests()
+        scale = estimated / sampled if sampled else 0.0
+        weight = self.weight()
+        store = UsageStore()
+        store.merge(self.exact["store"])
+        for sample, factor in ((self.requests_store(), scale), (self.unkeyed, weight)):
+            running = [0] * len(USAGE_COLUMNS)
+            for row in range(len(sample)):
+                cell = []
+                for position, column in enumerate(sample.columns):
+                    before = round(running[position] * factor)
+                    running[position] += column[row]
+                    cell.append(round(running[position] * factor) - before)
+                *tokens, messages = cell
+                store.add(store.row(*sample.key(row)), *tokens, messages=messages)
+        return store
+
+    def summary(self, error):
+        """Return the --approx section of the report."""
+        margins = {}
+        for quantity in self.QUANTITIES:
+            if quantity == "cost" and not self.pricing:
+                continue
+            estimate, margin = self.estimate(quantity)
+            margins[quantity] = margin / estimate if estimate else 0.0
+        return {
+            "error": error,
+            "confidence": 0.95,
+            "blocks": self.blocks,
+            "population": self.population,
+            "sampled_bytes": self.bytes,
+            "total_bytes": self.total_bytes,
+            "whole_files": self.whole_files,
+            "sessions": self.session_estimate(),
+            "margins": margins,
+        }
+
+
+def approx_command(args, pricing=None):
+    """Estimate the report from a random sample of the logs, for --approx.
+
+    The plain logs are split into APPROX_BLOCK_BYTES blocks (see
+    split_blocks()), shuffled, and read in rounds until the 95% confidence
+    interval of the total tokens, and of the cost when priced, is within
+    ``args.approx`` of the estimate, or every block was read.  Each round is
+    sized from the last interval to reach the bound, up to twice the sample
+    so far.  Returns the aggregate of the estimated cells (see
+    BlockSample.report_store()), with the interval widths under
+    ``aggregated["approx"]``, or None when there are no logs.
+    """
+    claude_dir = resolve_claude_dir(args.claude_dir)
+    jobs = args.jobs if args.jobs > 0 else os.cpu_count() or 1
+    timer = args.timer
+    options = {
+        "decoder": args.decoder,
+        "reader": args.reader,
+        "policy": args.dedup,
+        "filters": args.filters,
+        "tz": args.tz,
+        "granularity": args.cell_granularity,
+        "profile": timer.enabled,
+    }
+
+    walk = scan_claude_projects(claude_dir, args.filters, policy=args.dedup)
+    jsonl_files = list(timer.iterate(walk, "discover"))
+    if not jsonl_files:
+        print("No JSONL files found.", file=sys.stderr)
+        return None
+    blocks, whole_files, total_bytes = split_blocks(jsonl_files)
+    # Copies of a request are resolved by where they sit in scan order
+    file_order = {file_path: index for index, file_path in enumerate(jsonl_files)}
+    random.Random(args.approx_seed).shuffle(blocks)
+    print(
+        f"Sampling {format_number(len(blocks))} blocks of "
+        f"{len(jsonl_files)} conversation files "
+        f"({total_bytes / 1_000_000:.1f} MB) to within "
+        f"{args.approx:.1%}...",
+        file=sys.stderr,
+    )
+
+    sample = BlockSample(len(blocks), total_bytes, pricing, args.dedup)
+    executor = ProcessPoolExecutor(max_workers=jobs) if jobs > 1 else None
+
+    def analyze(worker, tasks):
+        if executor is None:
+            return map(worker, tasks)
+        return executor.map(worker, tasks, chunksize=PARALLEL_TASKS_PER_CHUNK)
+
+    parse_started = time.perf_counter()
+    try:
+        for file_path, partial in zip(
+            whole_files,
+            analyze(
+                _analyze_range,
+                [
+                    (file_path, 0, None, project_name(file_path, claude_dir), options)
+                    for file_path in whole_files
+                ],
+            ),
+        ):
+            timer.add_file(file_path, partial)
+            sample.add_exact(partial, (file_order[file_path], 0))
+
+        taken = 0
+        size = APPROX_MIN_BLOCKS
+        while taken < len(blocks):
+            # Each round is read in file order
+            batch = sorted(blocks[taken : taken + size], key=itemgetter(0, 1))
+            taken += len(batch)
+            tasks = [
+                (file_path, start, end, project_name(file_path, claude_dir), options)
+                for file_path, start, end, _ in batch
+            ]
+            for (file_path, start, end, file_blocks), partial in zip(
+                batch, analyze(_analyze_block, tasks)
+            ):
+                timer.add_file(file_path, partial)
+                sample.add_block(
+                    partial,
+                    file_path,
+                    end - start,
+                    file_blocks,
+                    (file_order[file_path], start),
+                )
+
+            # The bound is met once every checked interval is narrow enough;
+            # the next round aims for the widest one
+            shortfall = 0.0
+            for quantity in ("tokens", "cost") if pricing else ("tokens",):
+                estimate, margin = sample.estimate(quantity)
+                if quantity == "cost" and not estimate:
+                    continue
+                if not estimate:
+                    shortfall = math.inf
+                elif margin > args.approx * estimate:
+                    shortfall = max(
+                        shortfall,
+                        (margin / (args.approx * estimate)) ** 2
+                        if args.approx
+                        else math.inf,
+                    )
+            if not shortfall:
+                break
+            # The margin shrinks with sqrt(1/n - 1/N)
+            n, population = sample.blocks, sample.population
+            needed = population
+            if shortfall < math.inf:
+                needed = 1 / (shortfall * (1 / n - 1 / population) + 1 / population)
+            size = min(max(math.ceil(needed) - n, APPROX_MIN_BLOCKS), n)
+    finally:
+        if executor is not None:
+            executor.shutdown()
+
+    with timer.phase("rollup"):
+        aggregated = rollup_store(sample.report_store(), args.date_label)
+    aggregated["spans"] = {}
+    aggregated["recent"] = {}
+    aggregated["scan"] = sample.scan
+    aggregated["dedup"] = {
+        "policy": args.dedup,
+        "requests": len(sample.seen),
+        "duplicates": sample.duplicates,
+        "replaced": 0,
+        "spilled": 0,
+    }
+    aggregated["approx"] = sample.summary(args.approx)
+
+    print_scan_rate(
+        sample.scan,
+        time.perf_counter() - parse_started,
+        f"{args.decoder}, {args.reader} reader, "
+        f"{sample.blocks / max(sample.population, 1):.1%} of blocks",
+    )
+    print_dedup_summary(aggregated["dedup"])
+    return aggregated
@@ -0,0 +1,252 @@
+"""Archiving of old logs as summary logs (archive)."""
+
+import gzip
+import json
+import lzma
+import os
+import shutil
+import sys
+import time
+from datetime import datetime
+from pathlib import Path
+
+from .core import (
+    analyze_jsonl_file,
+    log_opener,
+    project_name,
+    resolve_claude_dir,
+    scan_claude_projects,
+)
+from .report import format_number
+
+
+# Logs untouched for this many days are archived by default
+ARCHIVE_DAYS = 30
+
+# Name prefix of the summaries written by archive
+ARCHIVE_PREFIX = "usage-archive-"
+
+# Directory, next to the projects directory, archive moves the originals to
+ARCHIVE_KEEP_DIR = "archived-logs"
+
+
+class SummaryCopies:
+    """record_counter() sink keeping every copy of every request, for archive.
+
+    Copies are kept in the order they are parsed, each as the fields a scan
+    reads: ``(key, timestamp, model, session, branch, cwd, input, output,
+    cache_write, cache_read)``.  Nothing is deduplicated, so a summary of
+    them scans to the same totals under every dedup policy.
+    """
+
+    def __init__(self):
+        self.copies = []
+
+    def __call__(
+        self,
+        key,
+        hour,
+        timestamp_str,
+        model,
+        project,
+        session_id,
+        branch,
+        cwd,
+        *tokens_matched,
+    ):
+        self.copies.append(
+            (key, timestamp_str, model, session_id, branch, cwd, *tokens_matched[:4])
+        )
+
+
+def summary_records(copies):
+    """Yield the copies gathered by a SummaryCopies sink as minimal log records.
+
+    A record keeps only what a scan reads: timestamp, session, branch, cwd,
+    model and usage, plus the requestId hash as ``requestKey``.  The copies
+    must have been parsed with ``timestamps``, so that records without a
+    requestId carry their position_key() and are not counted again by an
+    ingest that already loaded them.  A summary therefore scans to the same
+    totals and still deduplicates against other copies of its requests.
+    """
+    for key, timestamp_str, model, session, branch, cwd, *tokens in copies:
+        record = {"type": "assistant", "requestKey": key, "timestamp": timestamp_str}
+        for field, value in (
+            ("sessionId", session),
+            ("gitBranch", branch),
+            ("cwd", cwd),
+        ):
+            if value is not None:
+                record[field] = value
+        input_tokens, output_tokens, cache_write_tokens, cache_read_tokens = tokens
+        record["message"] = {
+            "model": model,
+            "usage": {
+                "input_tokens": input_tokens,
+                "output_tokens": output_tokens,
+                "cache_creation_input_tokens": cache_write_tokens,
+                "cache_read_input_tokens": cache_read_tokens,
+            },
+        }
+        yield record
+
+
+def log_consumed(file_path, offset, st):
+    """Return whether a parse that stopped at ``offset`` read the whole log.
+
+    Compressed logs are decompressed again up to ``offset``, as only the end
+    of the stream tells whether it is complete.
+    """
+    opener = log_opener(file_path)
+    if opener is open:
+        return offset == st.st_size
+    try:
+        with opener(file_path, "rb") as f:
+            f.seek(offset)
+            return not f.read(1)
+    except (OSError, EOFError, lzma.LZMAError):
+        return False
+
+
+def write_summary(summary_path, copies, mtime_ns):
+    """Write the summary_records() of some copies to a gzip log, atomically.
+
+    The summary gets ``mtime_ns``, the newest mtime of the logs it
+    replaces, so --since still skips it when all of them would be skipped.
+    Returns its size in bytes.
+    """
+    temp_path = summary_path + ".tmp"
+    try:
+        with open(temp_path, "wb") as raw:
+            with gzip.GzipFile(fileobj=raw, mode="wb", mtime=0) as f:
+                for record in summary_records(copies):
+                    f.write(json.dumps(record, separators=(",", ":")).encode())
+                    f.write(b"\n")
+            raw.flush()
+            os.fsync(raw.fileno())
+        os.utime(temp_path, ns=(mtime_ns, mtime_ns))
+        os.replace(temp_path, summary_path)
+    except BaseException:
+        try:
+            os.remove(temp_path)
+        except OSError:
+            pass
+        raise
+    return os.path.getsize(summary_path)
+
+
+def archive_command(args):
+    """Run the ``archive`` subcommand.
+
+    The logs of each directory that were last modified more than
+    ``args.older_than`` days ago are parsed together and replaced by one
+    gzip summary (see summary_records()).  Message content is dropped, so
+    later scans read a few bytes per request.  The summary keeps every copy
+    of a request, in scan order, rather than the one a dedup policy would
+    count, so no policy is frozen into it and reports under every --dedup
+    stay the same.  A directory is left alone when one of its logs cannot
+    be read completely.
+
+    The archived logs are moved, under the same relative paths, to
+    ``args.keep_dir`` (ARCHIVE_KEEP_DIR next to the projects directory by
+    default), where scans do not read them; with ``args.delete`` they are
+    deleted instead.
+    """
+    claude_dir = resolve_claude_dir(args.claude_dir)
+    keep_dir = None
+    if not args.delete:
+        keep_dir = Path(args.keep_dir or claude_dir.parent / ARCHIVE_KEEP_DIR)
+        if keep_dir.resolve().is_relative_to(claude_dir.resolve()):
+            print(
+                f"Cannot keep the archived logs in {keep_dir}: it is inside "
+                f"{claude_dir}, where they would be counted again",
+                file=sys.stderr,
+            )
+            return 1
+    cutoff = time.time() - args.older_than * 86400
+    directories = {}
+    for file_path in scan_claude_projects(claude_dir):
+        try:
+            st = os.stat(file_path)
+        except OSError:
+            continue
+        if st.st_mtime < cutoff:
+            directories.setdefault(os.path.dirname(file_path), []).append(
+                (str(file_path), st)
+            )
+
+    options = {"decoder": args.decoder, "reader": args.reader, "timestamps": True}
+    stamp = datetime.now().strftime("%Y%m%dT%H%M%S")
+    archived = 0
+    for directory, logs in sorted(directories.items()):
+        if len(logs) == 1 and os.path.basename(logs[0][0]).startswith(ARCHIVE_PREFIX):
+            # Already as compact as it gets
+            continue
+        size = sum(st.st_size for _, st in logs)
+        if args.dry_run:
+            print(
+                f"Would archive {len(logs)} logs in {directory} "
+                f"({size / 1_000_000:.1f} MB)",
+                file=sys.stderr,
+            )
+            continue
+
+        copies = SummaryCopies()
+        problem = None
+        for file_path, st in logs:
+            stats = analyze_jsonl_file(
+                file_path,
+                project=project_name(file_path, claude_dir),
+                sink=copies,
+                **options,
+            )
+            if stats["error"] is not None:
+                problem = f"{file_path}: {stats['error']}"
+            elif not log_consumed(file_path, stats["offset"], st):
+                # An unterminated last line or a truncated stream would be lost
+                problem = f"{file_path} does not end with a complete line"
+            if problem:
+                break
+        if problem:
+            print(f"Skipping {directory}: {problem}", file=sys.stderr)
+            continue
+
+        summary_path = os.path.join(directory, f"{ARCHIVE_PREFIX}{stamp}.jsonl.gz")
+        try:
+            summary_size = write_summary(
+                summary_path, copies.copies, max(st.st_mtime_ns for _, st in logs)
+            )
+            for file_path, _ in logs:
+                if file_path == summary_path:
+                    continue
+                if keep_dir is None:
+                    os.remove(file_path)
+                else:
+                    kept_path = keep_dir / os.path.relpath(file_path, claude_dir)
+                    kept_path.parent.mkdir(parents=True, exist_ok=True)
+                    shutil.move(file_path, kept_path)
+        except OSError as e:
+            print(f"Cannot archive {directory}: {e}", file=sys.stderr)
+            return 1
+        archived += len(logs)
+        print(
+            f"Archived {len(logs)} logs in {directory} into "
+            f"{os.path.basename(summary_path)}: "
+            f"{format_number(len(copies.copies))} records, "
+            f"{size / 1_000_000:.1f} MB -> {summary_size / 1_000_000:.2f} MB",
+            file=sys.stderr,
+        )
+    if not args.dry_run:
+        print(f"Archived {format_number(archived)} logs.", file=sys.stderr)
+        if archived and keep_dir is None:
+            print(
+                "The archived logs were deleted; their conversations are gone.",
+                file=sys.stderr,
+            )
+        elif archived:
+            print(
+                f"The original logs were moved to {keep_dir}; delete them "
+                "once they are no longer needed.",
+                file=sys.stderr,
+            )
+    return 0
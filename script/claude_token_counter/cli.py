@@ -0,0 +1,711 @@
+"""Command line interface."""
+
+import argparse
+import cProfile
+import os
+import socket
+import sys
+import time
+from pathlib import Path
+
+from .core import (
+    DECODER_BACKENDS,
+    DEDUP_MEMORY_LIMIT,
+    DEDUP_POLICIES,
+    GRANULARITIES,
+    GROUP_DIMS,
+    READERS,
+    SORT_METRICS,
+    SOURCES,
+    WINDOWS,
+    DedupIndex,
+    PipelineTimer,
+    aggregate_stats,
+    analyze_files,
+    analyze_opencode,
+    calculate_stats_costs,
+    default_index_path,
+    get_bucketer,
+    get_decoder,
+    get_timezone,
+    load_index,
+    load_pricing,
+    make_filters,
+    opencode_sessions,
+    parse_group_by,
+    project_name,
+    relabel_partial,
+    resolve_claude_dir,
+    save_index,
+    scan_claude_projects,
+    track_windows,
+)
+from .report import (
+    print_dedup_summary,
+    print_pipeline_stats,
+    print_scan_rate,
+    report,
+)
+from .watch import WATCH_INTERVAL, watch_logs
+from .ingest import ingest_command, parse_bucket, query_command
+from .approx import (
+    APPROX_ERROR,
+    APPROX_SEED,
+    approx_command,
+    parse_error_bound,
+)
+from .export import EXPORT_FORMATS, export_records
+from .archive import ARCHIVE_DAYS, ARCHIVE_KEEP_DIR, archive_command
+from .snapshot import SNAPSHOT_SUFFIX, export_command, merge_command
+from .serve import SERVE_PORT, serve_command
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Count Claude tokens from conversation logs",
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog="""
+Examples:
+  %(prog)s                           # Count all tokens with costs
+  %(prog)s --model claude-3-5-sonnet # Filter by model
+  %(prog)s --since 2025-06-01 --project myapp
+                                     # Only June onwards, one project
+  %(prog)s --json                    # Output as JSON
+  %(prog)s --claude-dir ~/.claude    # Custom Claude directory
+  %(prog)s --source all              # Claude Code and opencode usage together
+  %(prog)s --no-cost                 # Skip cost calculation
+  %(prog)s --pricing custom.csv      # Use custom pricing file
+  %(prog)s --no-cache                # Re-parse every file from scratch
+  %(prog)s --jobs 8                  # Parse files on 8 processes
+  %(prog)s --decoder json            # Force the stdlib JSON decoder
+  %(prog)s --reader stream           # Read with buffered IO instead of mmap
+  %(prog)s --dedup max               # Count the largest copy of each request
+  %(prog)s --group-by project,branch --top 10 --sort cost
+                                     # The ten costliest branches
+  %(prog)s --sessions --top 20       # The twenty costliest sessions
+  %(prog)s --watch                   # Keep the summary updated as logs grow
+  %(prog)s --watch --windows         # ... with the 5-hour and 7-day windows
+  %(prog)s --stats                   # Show where the run spent its time
+  %(prog)s --approx --since 2025-06-01
+                                     # Quick estimate of June's spend
+  %(prog)s --export csv > usage.csv  # Every deduplicated request as a CSV row
+  %(prog)s ingest                    # Load new log records into the database
+  %(prog)s archive --older-than 90   # Compact logs untouched for 90 days
+  %(prog)s export-snapshot -o box1.snapshot.json.gz
+                                     # Save this machine's usage for merging
+  %(prog)s --group-by project merge snapshots/
+                                     # One report across every machine
+  %(prog)s serve --port 9464         # Prometheus metrics at :9464/metrics
+  %(prog)s --json query --since 2025-06-01
+                                     # Report from the database's rollups
+        """,
+    )
+    parser.add_argument(
+        "--claude-dir",
+        type=str,
+        help="Path to Claude projects directory (default: ~/.claude/projects)",
+    )
+    parser.add_argument(
+        "--source",
+        choices=SOURCES + ("all",),
+        help="Logs to read: Claude Code's projects directory, opencode's "
+        "session storage, or both (default: claude)",
+    )
+    parser.add_argument(
+        "--opencode-dir",
+        type=str,
+        help="Path to opencode's storage directory "
+        "(default: ~/.local/share/opencode/storage)",
+    )
+    parser.add_argument(
+        "--model",
+        type=str,
+        help="Filter by model name (partial match)",
+    )
+    parser.add_argument(
+        "--project",
+        type=str,
+        help="Filter by project directory name (partial match)",
+    )
+    parser.add_argument(
+        "--since",
+        type=parse_bucket,
+        help="First day (YYYY-MM-DD) or hour (YYYY-MM-DDTHH) to report",
+    )
+    parser.add_argument(
+        "--until",
+        type=parse_bucket,
+        help="Last day (YYYY-MM-DD) or hour (YYYY-MM-DDTHH) to report",
+    )
+    parser.add_argument(
+        "--tz",
+        type=str,
+        default="UTC",
+        help="Time zone for date buckets and --since/--until: UTC, local, an "
+        "IANA name such as Europe/Berlin, or +HH:MM (default: UTC)",
+    )
+    parser.add_argument(
+        "--granularity",
+        choices=GRANULARITIES,
+        default="day",
+        help="Size of the time buckets in the by-date report (default: day)",
+    )
+    parser.add_argument(
+        "--group-by",
+        type=parse_group_by,
+        metavar="DIMS",
+        help="Report one table grouped by a comma-separated list of "
+        f"dimensions ({', '.join(GROUP_DIMS)}) instead of the model and date "
+        "tables",
+    )
+    parser.add_argument(
+        "--sessions",
+        action="store_true",
+        help="Report every session (span, length, tokens, cost, cache hit "
+        "ratio and models) instead of the model and date tables",
+    )
+    parser.add_argument(
+        "--windows",
+        action="store_true",
+        help="Add the usage of the trailing "
+        f"{', '.join(WINDOWS)} windows, when their oldest usage expires and "
+        "the burn rate",
+    )
+    parser.add_argument(
+        "--top",
+        type=int,
+        metavar="N",
+        help="Only list the N largest groups of --group-by (by --sort, "
+        "default tokens) or sessions of --sessions",
+    )
+    parser.add_argument(
+        "--sort",
+        choices=tuple(SORT_METRICS),
+        help="Order --group-by groups or --sessions largest first by this "
+        "metric (default: by key for groups, cost for sessions)",
+    )
+    parser.add_argument(
+        "--json",
+        action="store_true",
+        help="Output results as JSON",
+    )
+    parser.add_argument(
+        "--pricing",
+        type=str,
+        help="Path to model pricing CSV file",
+    )
+    parser.add_argument(
+        "--no-cost",
+        action="store_true",
+        help="Skip cost calculation",
+    )
+    parser.add_argument(
+        "--cache",
+        type=str,
+        help="Path to the incremental scan index "
+        "(default: ~/.cache/claude-token-counter/index.json)",
+    )
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="Do not read or update the incremental scan index",
+    )
+    parser.add_argument(
+        "--decoder",
+        choices=("auto",) + DECODER_BACKENDS,
+        default="auto",
+        help="JSON decoder backend (default: auto, fastest installed)",
+    )
+    parser.add_argument(
+        "--reader",
+        choices=READERS,
+        default="auto",
+        help="Line reader: mmap, buffered stream, or auto (mmap except for "
+        "files written to in the last minute; default: auto)",
+    )
+    parser.add_argument(
+        "--dedup",
+        choices=DEDUP_POLICIES,
+        default="first",
+        help="Which copy of a repeated requestId to count: first, last, or the "
+        "one with the most output tokens (default: first)",
+    )
+    parser.add_argument(
+        "--dedup-spill",
+        type=str,
+        metavar="DIR",
+        help="Spill requestId hashes to a temporary SQLite file in DIR once "
+        "more than --dedup-memory are held",
+    )
+    parser.add_argument(
+        "--dedup-memory",
+        type=int,
+        default=DEDUP_MEMORY_LIMIT,
+        help="requestId hashes kept in memory before spilling "
+        f"(default: {DEDUP_MEMORY_LIMIT:,})",
+    )
+    parser.add_argument(
+        "--jobs",
+        type=int,
+        default=1,
+        help="Number of parser processes (0 = one per CPU, default: 1)",
+    )
+    parser.add_argument(
+        "--approx",
+        type=parse_error_bound,
+        nargs="?",
+        const=APPROX_ERROR,
+        metavar="ERROR",
+        help="Estimate the report from a random sample of the logs, reading "
+        "until the 95%% confidence interval of the total tokens and cost is "
+        f"within ERROR of the estimate (default: {APPROX_ERROR:g})",
+    )
+    parser.add_argument(
+        "--approx-seed",
+        type=int,
+        default=APPROX_SEED,
+        metavar="SEED",
+        help=f"Seed of the --approx sample (default: {APPROX_SEED})",
+    )
+    parser.add_argument(
+        "--export",
+        choices=EXPORT_FORMATS,
+        help="Instead of reporting, write every deduplicated request "
+        "(timestamp, session, project, model, tokens and cost) to stdout as "
+        "it is parsed",
+    )
+
+    parser.add_argument(
+        "--watch",
+        action="store_true",
+        help="After the first report, keep tailing the logs and redraw it "
+        "whenever they grow",
+    )
+    parser.add_argument(
+        "--interval",
+        type=float,
+        default=WATCH_INTERVAL,
+        help="Seconds between checks in --watch mode when inotify is not "
+        f"available (default: {WATCH_INTERVAL:g})",
+    )
+    parser.add_argument(
+        "--stats",
+        action="store_true",
+        help="Report time per pipeline phase, line and dedup counters and the "
+        "slowest files (on stderr, or under 'stats' with --json)",
+    )
+    parser.add_argument(
+        "--profile",
+        type=str,
+        metavar="FILE",
+        help="Write cProfile statistics for the run to FILE (worker processes "
+        "started by --jobs are not profiled)",
+    )
+
+    commands = parser.add_subparsers(dest="command", metavar="COMMAND")
+    ingest_parser = commands.add_parser(
+        "ingest",
+        help="Load deduplicated request records into a SQLite rollup database",
+    )
+    query_parser = commands.add_parser(
+        "query",
+        help="Report from the rollup database instead of the raw logs",
+    )
+    for command_parser in (ingest_parser, query_parser):
+        command_parser.add_argument(
+            "--db",
+            type=str,
+            help="Path to the rollup database "
+            "(default: ~/.cache/claude-token-counter/usage.sqlite)",
+        )
+    archive_parser = commands.add_parser(
+        "archive",
+        help="Replace old logs with compressed summaries of their requests "
+        "(every copy is kept, so --dedup does not apply); the originals are "
+        f"moved to ~/.claude/{ARCHIVE_KEEP_DIR} unless --delete is given",
+    )
+    archive_parser.add_argument(
+        "--older-than",
+        type=float,
+        default=ARCHIVE_DAYS,
+        metavar="DAYS",
+        help=f"Archive logs not modified for DAYS days (default: {ARCHIVE_DAYS})",
+    )
+    archive_parser.add_argument(
+        "--dry-run",
+        action="store_true",
+        help="List the logs that would be archived without touching them",
+    )
+    archive_parser.add_argument(
+        "--keep-dir",
+        type=str,
+        metavar="DIR",
+        help="Move the archived logs to DIR (default: "
+        f"{ARCHIVE_KEEP_DIR} next to the projects directory)",
+    )
+    archive_parser.add_argument(
+        "--delete",
+        action="store_true",
+        help="Delete the archived logs, and their conversations, instead of "
+        "moving them",
+    )
+
+    export_parser = commands.add_parser(
+        "export-snapshot",
+        help="Write this machine's deduplicated usage to a mergeable snapshot",
+    )
+    export_parser.add_argument(
+        "--output",
+        "-o",
+        type=str,
+        metavar="FILE",
+        help=f"Snapshot to write (default: usage-HOST{SNAPSHOT_SUFFIX})",
+    )
+    export_parser.add_argument(
+        "--host",
+        type=str,
+        default=socket.gethostname(),
+        help="Name recorded for this machine (default: the host name)",
+    )
+    merge_parser = commands.add_parser(
+        "merge",
+        help="Report from snapshots exported on any number of machines",
+    )
+    merge_parser.add_argument(
+        "snapshots",
+        nargs="+",
+        metavar="SNAPSHOT",
+        help=f"Snapshot files, or directories of *{SNAPSHOT_SUFFIX} files",
+    )
+
+    serve_parser = commands.add_parser(
+        "serve",
+        help="Keep the aggregate in memory, follow the logs and serve it over "
+        "HTTP as Prometheus metrics and JSON",
+    )
+    serve_parser.add_argument(
+        "--bind",
+        type=str,
+        default="127.0.0.1",
+        help="Address to listen on (default: 127.0.0.1)",
+    )
+    serve_parser.add_argument(
+        "--port",
+        type=int,
+        default=SERVE_PORT,
+        help=f"Port to listen on, 0 for any free one (default: {SERVE_PORT})",
+    )
+
+    args = parser.parse_args()
+    if args.watch and args.command is not None:
+        parser.error(f"--watch cannot be used with {args.command}")
+    try:
+        get_timezone(args.tz)
+    except ValueError as e:
+        parser.error(str(e))
+    args.filters = make_filters(
+        args.model, args.project, args.since, args.until, args.tz
+    )
+    if args.filters is not None and args.command == "ingest":
+        parser.error("ingest always loads every record; filter with query instead")
+    if args.filters is not None and args.command == "export-snapshot":
+        parser.error(
+            "export-snapshot always keeps every record; filter with merge instead"
+        )
+    if args.group_by and args.sessions:
+        parser.error("--group-by and --sessions cannot be used together")
+    if args.group_by is None and not args.sessions:
+        if args.top is not None or args.sort is not None:
+            parser.error("--top and --sort need --group-by or --sessions")
+    elif args.command == "ingest":
+        parser.error("ingest does not report; use query instead")
+    elif args.command == "export-snapshot":
+        parser.error("export-snapshot does not report; use merge instead")
+    if args.windows and args.command == "ingest":
+        parser.error("ingest does not report; use query --windows instead")
+    if args.windows and args.command == "export-snapshot":
+        parser.error("export-snapshot does not report; use merge --windows instead")
+    if args.command == "archive":
+        if args.filters is not None:
+            parser.error("archive always keeps every record; it cannot be filtered")
+        if args.group_by or args.sessions or args.windows:
+            parser.error("archive does not report")
+    if args.source is not None and args.source != "claude":
+        if args.command in ("query", "merge"):
+            parser.error(
+                f"{args.command} reports every source that was loaded; use "
+                "--source with ingest or export-snapshot"
+            )
+        if args.command == "archive":
+            parser.error("archive only compacts Claude Code logs")
+        if args.watch:
+            parser.error("--watch only follows Claude Code logs")
+        if args.command == "serve":
+            parser.error("serve only follows Claude Code logs")
+    args.sources = SOURCES if args.source == "all" else (args.source or "claude",)
+    if args.approx is not None:
+        if args.command is not None:
+            parser.error(
+                f"--approx only samples the logs; it cannot be used with {args.command}"
+            )
+        if args.watch:
+            parser.error("--watch cannot be used with --approx")
+        if args.sources != ("claude",):
+            parser.error("--approx only samples Claude Code logs")
+        if args.sessions or (args.group_by and "session" in args.group_by):
+            parser.error("--approx cannot estimate sessions one by one")
+        if args.windows:
+            parser.error(
+                "--windows needs every recent request; it cannot be used with --approx"
+            )
+    if args.export is not None:
+        if args.command is not None:
+            parser.error(
+                "--export writes the records of the logs; it cannot be used "
+                f"with {args.command}"
+            )
+        for flag, value in (
+            ("--json", args.json),
+            ("--watch", args.watch),
+            ("--approx", args.approx is not None),
+            ("--group-by", args.group_by),
+            ("--sessions", args.sessions),
+            ("--windows", args.windows),
+        ):
+            if value:
+                parser.error(
+                    "--export writes records, not a report; it cannot "
+                    f"be used with {flag}"
+                )
+        if args.jobs != 1:
+            parser.error("--export writes records in log order; it cannot use --jobs")
+    if args.top is not None and args.top < 1:
+        parser.error("--top must be at least 1")
+    if args.sort == "cost" and args.no_cost:
+        parser.error("--sort cost cannot be used with --no-cost")
+    # An "hour" grouping needs hourly cells; the date groupings are then
+    # relabelled to --granularity when the cells are rolled up
+    args.cell_granularity = args.granularity
+    args.date_label = None
+    args.session_sort = "tokens" if args.no_cost else "cost"
+    if args.group_by and "hour" in args.group_by and args.granularity != "hour":
+        args.cell_granularity = "hour"
+        args.date_label = get_bucketer(args.tz, args.granularity).label
+
+    try:
+        args.decoder = get_decoder(args.decoder)[0]
+    except (ImportError, ValueError) as e:
+        print(f"JSON decoder {args.decoder!r} is not available: {e}", file=sys.stderr)
+        return 1
+    args.timer = PipelineTimer(enabled=args.stats)
+
+    if args.profile is None:
+        return run(args)
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        return run(args)
+    finally:
+        profiler.disable()
+        try:
+            profiler.dump_stats(args.profile)
+            print(
+                f"Wrote profile to {args.profile} (view with python3 -m pstats)",
+                file=sys.stderr,
+            )
+        except OSError as e:
+            print(f"Could not write profile {args.profile}: {e}", file=sys.stderr)
+
+
+def run(args):
+    """Run the command selected on the command line; return the exit status."""
+    if args.command == "ingest":
+        return ingest_command(args)
+    if args.command == "archive":
+        return archive_command(args)
+    if args.command == "export-snapshot":
+        return export_command(args)
+
+    timer = args.timer
+
+    # Load pricing
+    pricing = {}
+    if not args.no_cost:
+        print("Loading pricing information...", file=sys.stderr)
+        with timer.phase("pricing"):
+            pricing = load_pricing(args.pricing)
+        if pricing:
+            print(f"Loaded {len(pricing)} pricing rules.", file=sys.stderr)
+        else:
+            print(
+                "No pricing data found. Costs will not be calculated.", file=sys.stderr
+            )
+
+    if args.export is not None:
+        return export_records(args, pricing)
+
+    dedup = DedupIndex(args.dedup, args.dedup_memory, args.dedup_spill)
+    try:
+        if args.command == "query":
+            aggregated = query_command(args)
+            if aggregated is None:
+                return 1
+        elif args.command == "merge":
+            aggregated = merge_command(args, dedup)
+            if aggregated is None:
+                return 1
+        elif args.approx is not None:
+            aggregated = approx_command(args, pricing)
+            if aggregated is None:
+                return 0
+        else:
+            offsets = {} if args.watch or args.command == "serve" else None
+            aggregated = scan_command(args, dedup, offsets)
+            if aggregated is None:
+                return 0
+
+        aggregated["granularity"] = args.granularity
+
+        # Calculate costs if pricing is available
+        if pricing:
+            with timer.phase("cost"):
+                aggregated = calculate_stats_costs(aggregated, pricing)
+        if args.windows:
+            with timer.phase("windows"):
+                aggregated["window"] = track_windows(aggregated["recent"], pricing)
+
+        if args.command == "serve":
+            if args.stats:
+                print_pipeline_stats(timer, aggregated)
+            return serve_command(args, aggregated, dedup, offsets, pricing)
+
+        with timer.phase("render"):
+            status = report(args, aggregated, pricing)
+        sys.stdout.flush()
+        if args.stats and not args.json:
+            print_pipeline_stats(timer, aggregated)
+        if args.watch and status == 0:
+            status = watch_logs(args, aggregated, dedup, offsets, pricing)
+        return status
+    finally:
+        dedup.close()
+
+
+def scan_command(args, dedup, offsets=None):
+    """Aggregate the raw logs; return None when there is nothing to report.
+
+    When ``offsets`` is a dict it receives the ``(inode, offset)`` each file
+    was parsed up to, for watch_logs().
+    """
+    claude_dir = resolve_claude_dir(args.claude_dir)
+    jobs = args.jobs if args.jobs > 0 else os.cpu_count() or 1
+    timer = args.timer
+
+    # Logs are parsed into hourly cells, relabelled and filtered per report
+    # as they are folded in (see relabel_partial()), so the partials cached
+    # in the scan index describe whole files and serve every report; files
+    # without one are parsed with the filters pushed down (see
+    # analyze_files())
+    options = {
+        "decoder": args.decoder,
+        "reader": args.reader,
+        "policy": args.dedup,
+        "tz": args.tz,
+        "granularity": "hour",
+        "profile": timer.enabled,
+    }
+    bucketer = get_bucketer(args.tz, args.cell_granularity)
+
+    index = None
+    listings = None
+    if not args.no_cache:
+        index_path = Path(args.cache) if args.cache else default_index_path()
+        with timer.phase("index"):
+            index = load_index(index_path, {"policy": args.dedup, "tz": args.tz})
+        listings = index.setdefault("dirs", {})
+
+    # Files are parsed as the walk finds them
+    jsonl_files = []
+    session_dirs = []
+
+    def discovered():
+        walk = scan_claude_projects(claude_dir, args.filters, listings, args.dedup)
+        for file_path in timer.iterate(walk, "discover"):
+            jsonl_files.append(file_path)
+            yield file_path
+
+    def partials():
+        if "claude" in args.sources:
+            print("Scanning Claude conversation logs...", file=sys.stderr)
+            analyzed = analyze_files(
+                discovered(),
+                index,
+                jobs=jobs,
+                options=options,
+                claude_dir=claude_dir,
+                filters=args.filters,
+            )
+            for file_number, stats in enumerate(analyzed):
+                file_path = jsonl_files[file_number]
+                yield file_path, project_name(file_path, claude_dir), stats
+        if "opencode" in args.sources:
+            print("Scanning opencode sessions...", file=sys.stderr)
+            sessions = opencode_sessions(args.opencode_dir, args.filters)
+            # Sessions are cached whole, like logs, but their messages are
+            # only checked once decoded, so nothing else is pushed down
+            session_options = options
+            if index is None:
+                session_options = dict(options, filters=args.filters)
+            for session_dir, stats in analyze_opencode(
+                timer.iterate(sessions, "discover"), index, options=session_options
+            ):
+                session_dirs.append(session_dir)
+                yield session_dir, None, stats
+
+    def tracked(partials):
+        for file_path, project, stats in partials:
+            timer.add_file(file_path, stats)
+            if offsets is not None:
+                try:
+                    inode = os.stat(file_path).st_ino
+                except OSError:
+                    inode = None
+                offsets[str(file_path)] = (inode, stats["offset"])
+            yield relabel_partial(stats, args.filters, bucketer, project)
+
+    # Analyze and aggregate all files in one streaming pass, resuming from
+    # the scan index when enabled
+    parse_started = time.perf_counter()
+    aggregated = aggregate_stats(tracked(partials()), dedup, timer, args.date_label)
+
+    if not jsonl_files and not session_dirs:
+        if args.sources == ("claude",):
+            print("No JSONL files found.", file=sys.stderr)
+        else:
+            print("No logs found.", file=sys.stderr)
+        return None
+    if "claude" in args.sources:
+        print(f"Found {len(jsonl_files)} conversation files.", file=sys.stderr)
+    if "opencode" in args.sources:
+        print(f"Found {len(session_dirs)} opencode sessions.", file=sys.stderr)
+
+    if index is not None:
+        # Forget the files, and opencode sessions, that no longer exist; a
+        # filtered run does not visit every one of them
+        seen_paths = {str(path) for path in jsonl_files + session_dirs}
+        for key, entry in list(index["files"].items()):
+            source = "opencode" if "messages" in entry else "claude"
+            if key in seen_paths or source not in args.sources:
+                continue
+            if args.filters is None or not os.path.exists(key):
+                del index["files"][key]
+        with timer.phase("index"):
+            save_index(index, index_path)
+
+    print_scan_rate(
+        aggregated["scan"],
+        time.perf_counter() - parse_started,
+        f"{args.decoder}, {args.reader} reader",
+    )
+    print_dedup_summary(aggregated["dedup"])
+    return aggregated
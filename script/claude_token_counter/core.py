@@ -0,0 +1,3084 @@
+"""Parsing, deduplication, pricing and aggregation of usage logs."""
+
+import argparse
+import bz2
+import csv
+import gzip
+import hashlib
+import heapq
+import json
+import lzma
+import mmap
+import os
+import re
+import sqlite3
+import sys
+import tempfile
+import time
+from array import array
+from bisect import bisect_left
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import date, datetime, timedelta, timezone
+from decimal import Decimal
+from itertools import chain
+from operator import itemgetter
+from pathlib import Path
+
+try:
+    import numpy as np
+except ImportError:  # NumPy is optional; pricing falls back to a plain loop
+    np = None
+
+
+def parse_usage(usage_obj):
+    """Parse usage object, return input, output, cache write, and cache read tokens."""
+    if not usage_obj:
+        return 0, 0, 0, 0
+
+    input_tokens = usage_obj.get("input_tokens", 0)
+    output_tokens = usage_obj.get("output_tokens", 0)
+    cache_write_input_tokens = usage_obj.get("cache_creation_input_tokens", 0)
+    cache_read_input_tokens = usage_obj.get("cache_read_input_tokens", 0)
+
+    return (
+        input_tokens,
+        output_tokens,
+        cache_write_input_tokens,
+        cache_read_input_tokens,
+    )
+
+
+def parse_opencode_usage(message):
+    """Return the input, output, cache write and cache read tokens of an opencode message.
+
+    opencode reports reasoning tokens apart from the output tokens they are
+    billed as, so they are counted with them.
+    """
+    tokens = message.get("tokens") or {}
+    cache = tokens.get("cache") or {}
+    return (
+        tokens.get("input") or 0,
+        (tokens.get("output") or 0) + (tokens.get("reasoning") or 0),
+        cache.get("write") or 0,
+        cache.get("read") or 0,
+    )
+
+
+# Price columns of the pricing CSV, in the order of a price vector
+PRICE_COLUMNS = (
+    "input_price_per_1m",
+    "output_price_per_1m",
+    "cache_write_price_per_1m",
+    "cache_read_price_per_1m",
+)
+
+# Trailing context-window variant of a model name, such as "[1m]"
+MODEL_VARIANT = re.compile(r"\[[^\]]*\]$")
+
+
+def model_candidates(model):
+    """Return the names a logged model may be priced under, most specific first.
+
+    Besides the name itself these are the name without a provider prefix
+    (``anthropic/``, ``openrouter/anthropic/``), without a ``[1m]``-style
+    variant suffix, and with a Vertex-style ``@`` date written as ``-``.
+    """
+    model = str(model)
+    candidates = [model]
+    base = model.rsplit("/", 1)[-1]
+    plain = MODEL_VARIANT.sub("", base)
+    for name in (base, plain, plain.replace("@", "-")):
+        if name not in candidates:
+            candidates.append(name)
+    return candidates
+
+
+class PricingTable:
+    """Model prices with aliases, glob rules and effective dates.
+
+    A rule maps a model name, or a glob using ``*`` and ``?``, either to
+    prices or to another model whose prices it shares (``alias_of``).  A
+    priced rule may have several versions, each applying from its
+    ``effective_from`` day until the next one; days before the first version
+    use the first version.  Exact names win over globs, and globs are tried
+    in the order they were added.  Every logged model resolves to a rule
+    once, and every (model, day) to an integer price vector once, so pricing
+    a cell is a dictionary lookup.
+    """
+
+    def __init__(self):
+        # name -> sorted [(effective_from or "", price vector)]
+        self.versions = {}
+        self.aliases = {}
+        self.globs = []
+        self._resolved = {}
+        self._prices = {}
+
+    def __len__(self):
+        return len(self.versions) + len(self.aliases)
+
+    def add(self, model, prices=None, effective_from=None, alias_of=None):
+        """Add a rule; ``prices`` maps PRICE_COLUMNS to prices per 1M tokens."""
+        if alias_of:
+            if effective_from:
+                raise ValueError("an alias cannot have an effective date")
+            self.aliases[model] = alias_of
+        else:
+            vector = tuple(
+                price_units(prices.get(column) or 0) for column in PRICE_COLUMNS
+            )
+            if effective_from:
+                effective_from = date.fromisoformat(effective_from).isoformat()
+            versions = self.versions.setdefault(model, [])
+            versions.append((effective_from or "", vector))
+            versions.sort(key=itemgetter(0))
+        is_glob = "*" in model or "?" in model
+        if is_glob and not any(rule == model for _, rule in self.globs):
+            pattern = re.escape(model).replace(r"\*", ".*").replace(r"\?", ".")
+            self.globs.append((re.compile(pattern), model))
+        self._resolved.clear()
+        self._prices.clear()
+
+    @property
+    def versioned(self):
+        """Whether any model's price depends on the day."""
+        return any(len(versions) > 1 for versions in self.versions.values())
+
+    def _match(self, names):
+        for name in names:
+            if name in self.versions or name in self.aliases:
+                return name
+        for name in names:
+            for pattern, rule in self.globs:
+                if pattern.fullmatch(name):
+                    return rule
+        return None
+
+    def resolve(self, model):
+        """Return the priced rule a model resolves to, or None if unpriced."""
+        try:
+            return self._resolved[model]
+        except KeyError:
+            pass
+        rule = self._match(model_candidates(model))
+        seen = set()
+        while rule in self.aliases and rule not in seen:
+            seen.add(rule)
+            rule = self._match(model_candidates(self.aliases[rule]))
+        if rule not in self.versions:
+            rule = None
+        self._resolved[model] = rule
+        return rule
+
+    def prices(self, model, day=None):
+        """Return the ``(input, output, cache_write, cache_read)`` PRICE_SCALE
+        prices of a model on a ``YYYY-MM-DD`` day (None: the latest prices).
+        """
+        key = (model, day)
+        vector = self._prices.get(key)
+        if vector is None:
+            rule = self.resolve(model)
+            if rule is None:
+                vector = (0, 0, 0, 0)
+            else:
+                versions = self.versions[rule]
+                vector = versions[0][1]
+                for effective_from, version in versions:
+                    if day is not None and effective_from > day:
+                        break
+                    vector = version
+            self._prices[key] = vector
+        return vector
+
+
+def load_pricing(csv_path=None):
+    """Load model pricing from CSV file into a PricingTable.
+
+    Besides the price columns, a row may have ``effective_from`` (a
+    ``YYYY-MM-DD`` day from which its prices apply) and ``alias_of`` (a model
+    whose prices it uses instead).  The ``model`` column may be a glob.
+    """
+    if csv_path is None:
+        # Use the script directory, next to this package
+        script_dir = Path(__file__).parent.parent
+        csv_path = script_dir / "model-cost.csv"
+    csv_path = Path(csv_path)
+
+    pricing = PricingTable()
+
+    if not csv_path.exists():
+        return pricing
+
+    with open(csv_path, "r", encoding="utf-8") as f:
+        reader = csv.DictReader(f)
+        for row in reader:
+            try:
+                pricing.add(
+                    row["model"],
+                    {column: float(row.get(column) or 0) for column in PRICE_COLUMNS},
+                    row.get("effective_from"),
+                    row.get("alias_of"),
+                )
+            except (KeyError, ValueError) as e:
+                print(
+                    f"Skipping pricing row {reader.line_num} of {csv_path}: {e}",
+                    file=sys.stderr,
+                )
+
+    return pricing
+
+
+# JSON decoder backends in order of preference for --decoder auto
+DECODER_BACKENDS = ("orjson", "msgspec", "json")
+
+_decoders = {}
+
+
+def get_decoder(name="auto"):
+    """Return ``(backend_name, loads, errors)`` for a JSON decoder backend.
+
+    ``loads`` accepts ``bytes``; ``errors`` is the tuple of exceptions it raises
+    for malformed input.  ``auto`` picks the fastest installed backend and
+    falls back to the stdlib ``json`` module.
+    """
+    if name in _decoders:
+        return _decoders[name]
+
+    candidates = DECODER_BACKENDS if name == "auto" else (name,)
+    for backend in candidates:
+        try:
+            if backend == "orjson":
+                import orjson
+
+                decoder = (backend, orjson.loads, (ValueError,))
+            elif backend == "msgspec":
+                import msgspec
+
+                decoder = (
+                    backend,
+                    msgspec.json.decode,
+                    (ValueError, msgspec.DecodeError),
+                )
+            elif backend == "json":
+                decoder = (backend, json.loads, (ValueError,))
+            else:
+                raise ValueError(f"Unknown JSON decoder: {backend}")
+        except ImportError:
+            if name != "auto":
+                raise
+            continue
+        _decoders[name] = decoder
+        return decoder
+
+    raise ValueError(f"Unknown JSON decoder: {name}")
+
+
+# Byte markers that every countable line contains; anything else is rejected
+# before it is decoded
+ASSISTANT_MARKER = b'"assistant"'
+USAGE_MARKER = b'"usage"'
+
+
+# Line readers selectable with --reader
+READERS = ("auto", "mmap", "stream")
+
+# Files modified more recently than this are treated as live sessions
+LIVE_FILE_SECONDS = 60
+
+
+def _stream_candidates(f, start_offset, end_offset, cursor):
+    """Yield ``(line, line_end, complete)`` for candidate lines of a buffered file.
+
+    Lines without the usage markers are skipped; ``cursor`` receives the end
+    of the last skipped complete line and the number of lines seen.
+    """
+    f.seek(start_offset)
+    offset = start_offset
+    lines = 0
+    for raw_line in f:
+        if end_offset is not None and offset >= end_offset:
+            break
+        lines += 1
+        line_end = offset + len(raw_line)
+        complete = raw_line.endswith(b"\n")
+
+        # Fast reject: user, tool-result and summary lines never carry both
+        # markers, so they are skipped as raw bytes
+        if ASSISTANT_MARKER not in raw_line or USAGE_MARKER not in raw_line:
+            if not complete:
+                # Possibly a line still being written
+                break
+            offset = cursor[0] = line_end
+            continue
+
+        yield raw_line, line_end, complete
+        offset = line_end
+    cursor[1] = lines
+
+
+def _mmap_candidates(mm, start_offset, end_offset, cursor):
+    """Yield ``(line, line_end, complete)`` for candidate lines of a mapped file.
+
+    Line boundaries and markers are searched in the mapping itself, so only
+    candidate lines are ever copied out of it.
+    """
+    size = len(mm)
+    limit = size if end_offset is None else min(end_offset, size)
+    find = mm.find
+    pos = start_offset
+    lines = 0
+    while pos < limit:
+        lines += 1
+        newline = find(b"\n", pos)
+        complete = newline >= 0
+        line_end = newline + 1 if complete else size
+
+        if (
+            find(ASSISTANT_MARKER, pos, line_end) < 0
+            or find(USAGE_MARKER, pos, line_end) < 0
+        ):
+            if not complete:
+                break
+            pos = cursor[0] = line_end
+            continue
+
+        yield mm[pos:line_end], line_end, complete
+        pos = line_end
+    cursor[1] = lines
+
+
+# Time buckets the report can be grouped by
+GRANULARITIES = ("hour", "day", "week", "month")
+
+# Distinct minute prefixes remembered by a TimeBucketer before it starts over
+BUCKET_MEMO_SIZE = 8192
+
+
+def get_timezone(name):
+    """Resolve a --tz value: "UTC", "local", an IANA name or "+HH:MM".
+
+    Returns a tzinfo, or None for the system's local time zone (so that
+    datetime.astimezone() applies its DST rules per instant).  Raises
+    ValueError for an unknown zone.
+    """
+    if name is None or name.upper() in ("UTC", "Z"):
+        return timezone.utc
+    if name == "local":
+        return None
+    if name[:1] in "+-" and len(name) == 6 and name[3] == ":":
+        sign = -1 if name[0] == "-" else 1
+        try:
+            offset = timedelta(hours=int(name[1:3]), minutes=int(name[4:6]))
+        except ValueError:
+            raise ValueError(f"invalid UTC offset {name!r}") from None
+        return timezone(sign * offset)
+    try:
+        from zoneinfo import ZoneInfo
+
+        return ZoneInfo(name)
+    except (ImportError, KeyError, ValueError, OSError) as e:
+        raise ValueError(f"unknown time zone {name!r}") from e
+
+
+class TimeBucketer:
+    """Map log timestamps to report buckets in a time zone.
+
+    Claude logs use the fixed layout ``YYYY-MM-DDTHH:MM:SS.sssZ``, so the
+    common case is handled by slicing: the minute prefix is looked up in a
+    memo of recently seen prefixes (records arrive roughly in time order) and
+    only a new prefix is converted, once.  Other ISO forms take the slower
+    datetime.fromisoformat() path.  A timestamp that cannot be parsed gives
+    None, and the caller counts it as malformed.
+    """
+
+    def __init__(self, tz="UTC", granularity="day"):
+        self.tz_name = tz
+        self.tz = get_timezone(tz)
+        self.granularity = granularity
+        self._hours = {}
+        self._labels = {}
+
+    def hour(self, timestamp_str):
+        """Return the ``YYYY-MM-DDTHH`` hour of a timestamp in the time zone."""
+        if type(timestamp_str) is not str:
+            return None
+        if len(timestamp_str) >= 17 and timestamp_str[-1] == "Z":
+            prefix = timestamp_str[:16]
+            hour = self._hours.get(prefix)
+            if hour is None:
+                hour = self._convert_prefix(prefix)
+                if hour is None:
+                    return self._convert(timestamp_str)
+                if len(self._hours) >= BUCKET_MEMO_SIZE:
+                    self._hours.clear()
+                self._hours[prefix] = hour
+            return hour
+        return self._convert(timestamp_str)
+
+    def _convert_prefix(self, prefix):
+        """Convert a UTC ``YYYY-MM-DDTHH:MM`` prefix, or return None."""
+        if (
+            prefix[4] != "-"
+            or prefix[7] != "-"
+            or prefix[10] not in "T "
+            or prefix[13] != ":"
+        ):
+            return None
+        try:
+            moment = datetime(
+                int(prefix[0:4]),
+                int(prefix[5:7]),
+                int(prefix[8:10]),
+                int(prefix[11:13]),
+                int(prefix[14:16]),
+                tzinfo=timezone.utc,
+            )
+        except ValueError:
+            return None
+        if self.tz is timezone.utc:
+            return f"{prefix[:10]}T{prefix[11:13]}"
+        return moment.astimezone(self.tz).strftime("%Y-%m-%dT%H")
+
+    def _convert(self, timestamp_str):
+        """Parse any ISO timestamp; naive ones are taken to be UTC."""
+        try:
+            moment = datetime.fromisoformat(timestamp_str.replace("Z", "+00:00"))
+        except (ValueError, TypeError):
+            return None
+        if moment.tzinfo is None:
+            moment = moment.replace(tzinfo=timezone.utc)
+        return moment.astimezone(self.tz).strftime("%Y-%m-%dT%H")
+
+    def label(self, hour):
+        """Return the report bucket of an hour (see hour()) or "unknown"."""
+        if hour is None or hour == "unknown":
+            return "unknown"
+        label = self._labels.get(hour)
+        if label is None:
+            if self.granularity == "hour":
+                label = hour
+            elif self.granularity == "day":
+                label = hour[:10]
+            elif self.granularity == "month":
+                label = hour[:7]
+            else:
+                year, week, _ = date.fromisoformat(hour[:10]).isocalendar()
+                label = f"{year}-W{week:02d}"
+            self._labels[hour] = label
+        return label
+
+    def utc_hour(self, hour):
+        """Convert a UTC ``YYYY-MM-DDTHH`` bucket to this time zone."""
+        if self.tz is timezone.utc or hour == "unknown":
+            return hour
+        moment = datetime.strptime(hour, "%Y-%m-%dT%H").replace(tzinfo=timezone.utc)
+        return moment.astimezone(self.tz).strftime("%Y-%m-%dT%H")
+
+
+_bucketers = {}
+
+
+def get_bucketer(tz="UTC", granularity="day"):
+    """Return a shared TimeBucketer, so its memo outlives a single file."""
+    bucketer = _bucketers.get((tz, granularity))
+    if bucketer is None:
+        bucketer = _bucketers[(tz, granularity)] = TimeBucketer(tz, granularity)
+    return bucketer
+
+
+def label_day(label):
+    """Return the ``YYYY-MM-DD`` day a TimeBucketer label starts on, or None."""
+    if label == "unknown":
+        return None
+    if "W" in label:
+        year, week = label.split("-W")
+        return date.fromisocalendar(int(year), int(week), 1).isoformat()
+    if len(label) == 7:
+        return label + "-01"
+    return label[:10]
+
+
+def span_timestamp(timestamp_str):
+    """Return a timestamp as UTC ``YYYY-MM-DDTHH:MM:SS.sssZ``, or None.
+
+    Claude logs already use this form, whose strings sort in time order, so
+    session spans can be kept as plain strings.
+    """
+    if type(timestamp_str) is not str:
+        return None
+    if len(timestamp_str) == 24 and timestamp_str[-1] == "Z":
+        return timestamp_str
+    try:
+        moment = datetime.fromisoformat(timestamp_str.replace("Z", "+00:00"))
+    except ValueError:
+        return None
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=timezone.utc)
+    moment = moment.astimezone(timezone.utc)
+    return moment.strftime("%Y-%m-%dT%H:%M:%S.") + f"{moment.microsecond // 1000:03d}Z"
+
+
+def merge_spans(target, spans):
+    """Widen the ``[first, last]`` session spans in ``target`` by ``spans``."""
+    for session, (first, last) in spans.items():
+        span = target.get(session)
+        if span is None:
+            target[session] = [first, last]
+        else:
+            span[0] = min(span[0], first)
+            span[1] = max(span[1], last)
+
+
+# Trailing windows reported by --windows, in minutes; the burn rate is
+# measured over BURN_WINDOW
+WINDOWS = {"1h": 60, "5h": 5 * 60, "7d": 7 * 24 * 60}
+BURN_WINDOW = "1h"
+
+# Minutes of history kept per request for the windows
+WINDOW_HISTORY = max(WINDOWS.values())
+
+
+def window_cutoff(now=None):
+    """Return the UTC ``YYYY-MM-DDTHH:MM`` from which requests are recent."""
+    now = datetime.now(timezone.utc) if now is None else now
+    return (now - timedelta(minutes=WINDOW_HISTORY)).strftime("%Y-%m-%dT%H:%M")
+
+
+def merge_recent(target, partial, rejected=(), window=None, pricing=None):
+    """Merge the recent requests of a partial into ``target``.
+
+    Entries are ``(timestamp, input, output, cache_write, cache_read,
+    model)``.  They follow the dedup decisions: the partial's copies whose
+    keys are in ``rejected`` were not counted, and any other request of the
+    partial replaces the copy held in ``target``, even when its own copy is
+    too old to be recent.  When ``window`` (a UsageWindow) is given, it is
+    updated with every entry added or dropped, priced by ``pricing``.
+    """
+    recent = partial["recent"]
+    if target:
+        for key in partial["requests"]:
+            if key in target and key not in recent and key not in rejected:
+                old = target.pop(key)
+                if window is not None:
+                    window.add(old, pricing, sign=-1)
+    for key, entry in recent.items():
+        if key in rejected:
+            continue
+        old = target.get(key)
+        target[key] = entry
+        if window is not None:
+            if old is not None:
+                window.add(old, pricing, sign=-1)
+            window.add(entry, pricing)
+
+
+class UsageWindow:
+    """Usage over trailing time windows such as the last 5 hours.
+
+    Tokens, cost and messages are kept in a ring of per-minute buckets
+    spanning the longest window, and every window keeps a running total.
+    Adding a request and reading a window are O(1); moving the clock
+    forward subtracts each minute once from each window it leaves, so it is
+    O(1) per minute passed.
+    """
+
+    def __init__(self, now=None, windows=None):
+        self.windows = dict(WINDOWS if windows is None else windows)
+        self.size = max(self.windows.values())
+        self.tokens = [0] * self.size
+        self.costs = [0] * self.size
+        self.messages = [0] * self.size
+        # name -> [tokens, cost, messages]
+        self.totals = {name: [0, 0, 0] for name in self.windows}
+        # name -> earliest minute that may still hold usage in the window
+        self.oldest = dict.fromkeys(self.windows)
+        self._minutes = {}
+        self.now = time.time() if now is None else now
+        self.minute = int(self.now // 60)
+
+    def _minute_of(self, timestamp):
+        """Return the minute since the epoch of a span_timestamp() string."""
+        prefix = timestamp[:16]
+        minute = self._minutes.get(prefix)
+        if minute is None:
+            moment = datetime.strptime(prefix, "%Y-%m-%dT%H:%M")
+            minute = int(moment.replace(tzinfo=timezone.utc).timestamp()) // 60
+            self._minutes[prefix] = minute
+        return minute
+
+    def add(self, entry, pricing=None, sign=1):
+        """Add a merge_recent() entry (``sign=-1`` takes it back out)."""
+        timestamp, *tokens, model = entry
+        minute = self._minute_of(timestamp)
+        age = self.minute - minute
+        if age < 0:
+            # Logged ahead of our clock
+            self.advance(minute * 60)
+            age = 0
+        if age >= self.size:
+            return
+        cost = 0
+        if pricing:
+            prices = pricing.prices(model, timestamp[:10])
+            cost = sum(count * price for count, price in zip(tokens, prices))
+        total_tokens = sign * sum(tokens)
+        cost *= sign
+        slot = minute % self.size
+        self.tokens[slot] += total_tokens
+        self.costs[slot] += cost
+        self.messages[slot] += sign
+        for name, length in self.windows.items():
+            if age < length:
+                totals = self.totals[name]
+                totals[0] += total_tokens
+                totals[1] += cost
+                totals[2] += sign
+                oldest = self.oldest[name]
+                if oldest is None or minute < oldest:
+                    self.oldest[name] = minute
+
+    def advance(self, now=None):
+        """Move the clock to ``now`` (seconds since the epoch; default: now)."""
+        now = time.time() if now is None else now
+        minute = int(now // 60)
+        self.now = max(self.now, now)
+        if minute <= self.minute:
+            return
+        size = self.size
+        if minute - self.minute >= size:
+            # Everything has left every window
+            self.tokens = [0] * size
+            self.costs = [0] * size
+            self.messages = [0] * size
+            self.totals = {name: [0, 0, 0] for name in self.windows}
+            self.oldest = dict.fromkeys(self.windows)
+            self.minute = minute
+            return
+        for current in range(self.minute + 1, minute + 1):
+            for name, length in self.windows.items():
+                leaving = (current - length) % size
+                totals = self.totals[name]
+                totals[0] -= self.tokens[leaving]
+                totals[1] -= self.costs[leaving]
+                totals[2] -= self.messages[leaving]
+            # The slot held the minute that just left the longest window
+            slot = current % size
+            self.tokens[slot] = self.costs[slot] = self.messages[slot] = 0
+        self.minute = minute
+
+    def _oldest(self, name):
+        """Return the oldest minute with messages in a window, or None."""
+        oldest = self.oldest[name]
+        if oldest is None:
+            return None
+        # Skip minutes that left the window or were emptied; the pointer only
+        # moves forward, so this is amortised O(1)
+        oldest = max(oldest, self.minute - self.windows[name] + 1)
+        while oldest <= self.minute and not self.messages[oldest % self.size]:
+            oldest += 1
+        if oldest > self.minute:
+            oldest = None
+        self.oldest[name] = oldest
+        return oldest
+
+    def window(self, name):
+        """Return the usage in a window and when its oldest usage expires.
+
+        ``expires_in`` is the number of seconds until the oldest minute with
+        usage leaves the window (None when the window is empty).
+        """
+        tokens, cost, messages = self.totals[name]
+        oldest = self._oldest(name)
+        expires_in = None
+        if oldest is not None:
+            expires_in = (oldest + self.windows[name]) * 60 - self.now
+        return {
+            "minutes": self.windows[name],
+            "tokens": tokens,
+            "cost": cost / COST_SCALE,
+            "messages": messages,
+            "expires_in": expires_in,
+        }
+
+    def burn_rate(self):
+        """Return tokens and cost per hour over the BURN_WINDOW.
+
+        The rate is taken over the time since the window's oldest usage (at
+        least a minute), so a burst that just started is not diluted.
+        """
+        tokens, cost, _ = self.totals[BURN_WINDOW]
+        oldest = self._oldest(BURN_WINDOW)
+        if oldest is None:
+            return {"tokens_per_hour": 0.0, "cost_per_hour": 0.0}
+        hours = max(self.now - oldest * 60, 60) / 3600
+        return {
+            "tokens_per_hour": tokens / hours,
+            "cost_per_hour": cost / COST_SCALE / hours,
+        }
+
+
+# Precedes a record timestamp; the value follows after an optional space
+TIMESTAMP_MARKER = b'"timestamp":'
+
+# Precedes the model of a message; the value follows after an optional space
+MODEL_MARKER = b'"model":'
+
+# Keys of the requestId of a log line and of the hash archive summaries carry
+REQUEST_ID_MARKER = b'"requestId"'
+REQUEST_KEY_MARKER = b'"requestKey"'
+
+# The values that follow those keys, after an optional space
+REQUEST_ID_VALUE = re.compile(rb'"requestId": ?"([^"\\]+)"')
+REQUEST_KEY_VALUE = re.compile(rb'"requestKey": ?(-?[0-9]+)')
+
+# Precedes the usage object of a message
+USAGE_VALUE_MARKER = b'"usage":'
+
+# The parse_usage() fields of a usage object and their raw values
+USAGE_FIELD = re.compile(
+    rb'"(input|output|cache_creation_input|cache_read_input)_tokens": ?([^,}]*)'
+)
+
+# Positions of the USAGE_FIELD names in parse_usage() order
+USAGE_POSITIONS = {
+    b"input": 0,
+    b"output": 1,
+    b"cache_creation_input": 2,
+    b"cache_read_input": 3,
+}
+
+
+# Dedup policies that keep a copy of a request by its place in scan order
+# alone, so a copy known to fail the filters needs only its key, not its usage
+POSITIONAL_POLICIES = ("first", "last")
+
+
+def make_filters(model=None, project=None, since=None, until=None, tz="UTC"):
+    """Return the record filters of a report, or None when nothing is filtered.
+
+    ``model`` and ``project`` are case-insensitive substrings; ``since`` and
+    ``until`` are inclusive ``YYYY-MM-DD`` or ``YYYY-MM-DDTHH`` bounds (see
+    parse_bucket()) in the ``tz`` time zone.
+    """
+    if not (model or project or since or until):
+        return None
+    return {
+        "model": model.lower() if model else None,
+        "project": project.lower() if project else None,
+        "since": since,
+        "until": until,
+        # Bounds are local, while the raw timestamps the line filter sees
+        # are UTC, so outside UTC it has to allow a day either way
+        "shifted": get_timezone(tz) is not timezone.utc,
+    }
+
+
+def make_line_filter(filters, project=None):
+    """Build a bytes check rejecting lines that cannot pass ``filters``.
+
+    It runs before decoding, so it only looks for the model substring in the
+    ``"model"`` values and compares the day of every ``"timestamp"`` value in
+    the line against the bounds; a line it passes is still checked exactly
+    once decoded.  When
+    ``project``, the project of the log, does not match, every line is
+    rejected.  Returns None when there is nothing to check.
+    """
+    if filters.get("project") and project is not None:
+        if filters["project"] not in project.lower():
+            return lambda line: False
+    model = filters.get("model")
+    slack = timedelta(days=1 if filters.get("shifted") else 0)
+    since = until = None
+    if filters.get("since"):
+        day = date.fromisoformat(filters["since"][:10]) - slack
+        since = day.isoformat().encode()
+    if filters.get("until"):
+        day = date.fromisoformat(filters["until"][:10]) + slack
+        until = day.isoformat().encode()
+    if not (model or since or until):
+        return None
+    model = model.encode() if model else None
+    model_length = len(MODEL_MARKER)
+    marker_length = len(TIMESTAMP_MARKER)
+
+    def model_matches(line):
+        # As with timestamps, any model in the line will do; one that is not
+        # a plain string is left to the decoder
+        start = line.find(MODEL_MARKER)
+        if start < 0:
+            return True
+        while start >= 0:
+            value = start + model_length
+            if line[value : value + 1] == b" ":
+                value += 1
+            end = line.find(b'"', value + 1)
+            if line[value : value + 1] != b'"' or end < 0:
+                return True
+            if model in line[value + 1 : end].lower():
+                return True
+            start = line.find(MODEL_MARKER, end)
+        return False
+
+    def line_matches(line):
+        if model is not None and not model_matches(line):
+            return False
+        if since is None and until is None:
+            return True
+        # Nested objects may carry their own timestamps, so a line is only
+        # rejected when none of them is in range
+        start = line.find(TIMESTAMP_MARKER)
+        if start < 0:
+            return True
+        while start >= 0:
+            value = start + marker_length
+            if line[value : value + 1] == b" ":
+                value += 1
+            day = line[value + 1 : value + 11]
+            if (since is None or day >= since) and (until is None or day <= until):
+                return True
+            start = line.find(TIMESTAMP_MARKER, start + marker_length)
+        return False
+
+    return line_matches
+
+
+def line_usage(line):
+    """Return the usage tokens of a raw log line without decoding it, or None.
+
+    The fields are read after the last ``"usage"`` key, as parse_usage()
+    reads them; a missing one counts as 0.  None is returned when the line
+    has no usage or a value is not a plain integer, so that the caller
+    decodes the line instead.
+    """
+    start = line.rfind(USAGE_VALUE_MARKER)
+    if start < 0:
+        return None
+    tokens = [0, 0, 0, 0]
+    for name, value in USAGE_FIELD.findall(line, start):
+        if not value.isdigit():
+            return None
+        tokens[USAGE_POSITIONS[name]] = int(value)
+    return tokens
+
+
+def line_request_key(line):
+    """Return the request_key() of a raw log line without decoding it, or None.
+
+    The last requestId in the line is taken: Claude Code writes it after the
+    message, whose tool calls may carry ids of their own.  Summaries written
+    by archive carry the key itself (see summary_records()).
+    """
+    start = line.rfind(REQUEST_ID_MARKER)
+    if start >= 0:
+        match = REQUEST_ID_VALUE.match(line, start)
+        if match is not None:
+            return request_key(match.group(1).decode("utf-8", "replace"))
+    start = line.rfind(REQUEST_KEY_MARKER)
+    if start >= 0:
+        match = REQUEST_KEY_VALUE.match(line, start)
+        if match is not None:
+            return int(match.group(1))
+    return None
+
+
+def in_bounds(filters, bucket):
+    """Return True when a ``YYYY-MM-DDTHH`` bucket is within the filter bounds."""
+    since = filters["since"]
+    until = filters["until"]
+    if since and bucket[: len(since)] < since:
+        return False
+    if until and bucket[: len(until)] > until:
+        return False
+    return True
+
+
+# Stdlib codecs that stream compressed logs, by file suffix
+COMPRESSED_SUFFIXES = {".gz": gzip.open, ".bz2": bz2.open, ".xz": lzma.open}
+
+# Names of the log files picked up by a scan
+LOG_SUFFIXES = (".jsonl",) + tuple(".jsonl" + suffix for suffix in COMPRESSED_SUFFIXES)
+
+
+def log_opener(file_path):
+    """Return the function opening a log for binary reads.
+
+    Compressed logs are decompressed as they are read, in chunks, by a
+    stdlib codec; offsets into them count decompressed bytes.
+    """
+    return COMPRESSED_SUFFIXES.get(os.path.splitext(file_path)[1], open)
+
+
+def choose_reader(file_path, reader="auto"):
+    """Resolve ``auto`` to ``mmap`` or ``stream`` for a file.
+
+    A mapping only covers the size the file had when it was mapped, so
+    appends are harmless, but a file truncated while mapped would fault.
+    Files written to within the last LIVE_FILE_SECONDS (a live session) are
+    therefore read with the buffered reader.
+    """
+    if reader != "auto":
+        return reader
+    try:
+        mtime = os.path.getmtime(file_path)
+    except OSError:
+        return "stream"
+    if time.time() - mtime < LIVE_FILE_SECONDS:
+        return "stream"
+    return "mmap"
+
+
+# Key dimensions of a UsageStore cell, in order
+CELL_DIMS = ("date", "model", "project", "session", "branch", "cwd")
+
+# Counter columns of a UsageStore row, in order
+USAGE_COLUMNS = ("input", "output", "cache_write", "cache_read", "messages")
+
+# Dimensions a grouping may use: the CELL_DIMS, plus "hour", which reads the
+# time bucket of cells scanned at hourly granularity
+GROUP_DIMS = ("model", "date", "hour", "session", "project", "branch", "cwd")
+
+# Report groupings, each a tuple of GROUP_DIMS; a new grouping only needs an
+# entry here to get counters and costs
+GROUPINGS = {
+    "by_model": ("model",),
+    "by_date": ("date",),
+    "by_date_and_model": ("date", "model"),
+    "by_project": ("project",),
+    "by_session": ("session",),
+}
+
+
+def make_group_key(dims, date_label=None):
+    """Return the function mapping a cell key to its key in a grouping by ``dims``.
+
+    One dimension gives scalar keys and several give tuples.  When cells
+    are hourly but the report is not, ``date_label`` (see
+    TimeBucketer.label()) turns their hour into the "date" bucket.
+    """
+    positions = [CELL_DIMS.index("date" if dim == "hour" else dim) for dim in dims]
+    getter = itemgetter(*positions)
+    if date_label is None or "date" not in dims:
+        return getter
+    if len(dims) == 1:
+        position = positions[0]
+        return lambda key: date_label(key[position])
+    slot = dims.index("date")
+
+    def key_of(key):
+        values = list(getter(key))
+        values[slot] = date_label(values[slot])
+        return tuple(values)
+
+    return key_of
+
+
+def group_cells(store, groupings, costs=None, date_label=None):
+    """Sum the live cells of a store by one or more groupings.
+
+    ``groupings`` holds tuples of GROUP_DIMS.  Returns a dict per grouping,
+    keyed like make_group_key(), mapping each group to ``[input, output,
+    cache_write, cache_read, messages, cost]``; the cost sums ``costs``
+    (price_cells() output) in 1/COST_SCALE dollars, or stays 0 without it.
+    Cells are summed by their interned key ids, so key values are only
+    looked up, and relabelled by ``date_label``, once per group.
+    """
+    inputs, outputs, cache_writes, cache_reads, message_counts = store.columns
+    if costs is None:
+        costs = [0] * len(store)
+    live = store.live_rows()
+    results = []
+    for dims in groupings:
+        positions = [CELL_DIMS.index("date" if dim == "hour" else dim) for dim in dims]
+        if len(positions) == 1:
+            ids = store.keys[positions[0]]
+        else:
+            ids = list(zip(*(store.keys[position] for position in positions)))
+        sums = {}
+        for row in live:
+            group = ids[row]
+            totals = sums.get(group)
+            if totals is None:
+                sums[group] = [
+                    inputs[row],
+                    outputs[row],
+                    cache_writes[row],
+                    cache_reads[row],
+                    message_counts[row],
+                    costs[row],
+                ]
+            else:
+                totals[0] += inputs[row]
+                totals[1] += outputs[row]
+                totals[2] += cache_writes[row]
+                totals[3] += cache_reads[row]
+                totals[4] += message_counts[row]
+                totals[5] += costs[row]
+
+        key_of = make_group_key(dims, date_label)
+        cell_key = [None] * len(CELL_DIMS)
+        groups = {}
+        for group, totals in sums.items():
+            if len(positions) == 1:
+                group = (group,)
+            for position, value_id in zip(positions, group):
+                cell_key[position] = store.values[position][value_id]
+            key = key_of(cell_key)
+            merged = groups.get(key)
+            if merged is None:
+                groups[key] = totals
+            else:
+                for position, value in enumerate(totals):
+                    merged[position] += value
+        results.append(groups)
+    return results
+
+
+# Prices are held as integer micro-dollars per 1M tokens, so a cost is an
+# exact integer number of 1e-12 dollars
+PRICE_SCALE = 1_000_000
+COST_SCALE = PRICE_SCALE * 1_000_000
+
+
+class UsageStore:
+    """Columnar counters for the sparse cells of an aggregate.
+
+    A cell is keyed by one value per entry of CELL_DIMS.  Key values are
+    interned per dimension to small integer ids held in ``keys`` (one typed
+    ``array('q')`` per dimension), and ``columns`` holds one ``array('q')`` per
+    entry of USAGE_COLUMNS.  Rows are never removed, so row numbers stay valid
+    for deduplication contributions; a row whose ``messages`` count drops back
+    to zero is simply skipped when reporting.
+    """
+
+    def __init__(self):
+        self.values = tuple([] for _ in CELL_DIMS)
+        self._value_ids = tuple({} for _ in CELL_DIMS)
+        self._rows = {}
+        self.keys = tuple(array("q") for _ in CELL_DIMS)
+        self.columns = tuple(array("q") for _ in USAGE_COLUMNS)
+
+    def __len__(self):
+        return len(self.columns[0])
+
+    def row(self, *key):
+        """Return the row of a cell, creating it if needed."""
+        row = self._rows.get(key)
+        if row is None:
+            row = self._rows[key] = len(self)
+            for value, values, value_ids, key_ids in zip(
+                key, self.values, self._value_ids, self.keys
+            ):
+                value_id = value_ids.get(value)
+                if value_id is None:
+                    value_id = value_ids[value] = len(values)
+                    values.append(value)
+                key_ids.append(value_id)
+            for column in self.columns:
+                column.append(0)
+        return row
+
+    def key(self, row):
+        """Return the key tuple of a row."""
+        return tuple(
+            values[key_ids[row]] for values, key_ids in zip(self.values, self.keys)
+        )
+
+    def add(
+        self, row, input_tokens, output_tokens, cache_write, cache_read, messages=1
+    ):
+        """Add one record (or, with negative values, remove it) to a row."""
+        inputs, outputs, cache_writes, cache_reads, message_counts = self.columns
+        inputs[row] += input_tokens
+        outputs[row] += output_tokens
+        cache_writes[row] += cache_write
+        cache_reads[row] += cache_read
+        message_counts[row] += messages
+
+    def merge(self, other):
+        """Add every row of ``other``; return the mapping of its rows to ours."""
+        row_map = []
+        for other_row in range(len(other)):
+            row = self.row(*other.key(other_row))
+            self.add(row, *(column[other_row] for column in other.columns))
+            row_map.append(row)
+        return row_map
+
+    def live_rows(self):
+        """Return the rows that currently count at least one message."""
+        message_counts = self.columns[4]
+        return [row for row in range(len(self)) if message_counts[row]]
+
+    def cells(self):
+        """Yield ``(key, counters)`` for every non-empty cell."""
+        for row in self.live_rows():
+            yield self.key(row), [column[row] for column in self.columns]
+
+    def distinct(self, dim):
+        """Return the set of values of a dimension over the non-empty cells."""
+        position = CELL_DIMS.index(dim)
+        values = self.values[position]
+        key_ids = self.keys[position]
+        return {values[key_ids[row]] for row in self.live_rows()}
+
+    def to_rows(self):
+        """Serialise every row as ``[*key, *counters]``, in row order."""
+        return [
+            [*self.key(row), *(column[row] for column in self.columns)]
+            for row in range(len(self))
+        ]
+
+    @classmethod
+    def from_rows(cls, rows):
+        """Rebuild a store from to_rows() output, preserving row numbers."""
+        store = cls()
+        width = len(CELL_DIMS)
+        for row in rows:
+            store.add(store.row(*row[:width]), *row[width:])
+        return store
+
+
+def price_units(price_per_1m):
+    """Convert a price per 1M tokens to exact integer micro-dollars."""
+    return int(Decimal(str(price_per_1m)) * PRICE_SCALE)
+
+
+def price_matrix(store, pricing):
+    """Return ``(matrix, cell_prices)`` for pricing the cells of a store.
+
+    ``matrix`` holds integer ``(input, output, cache_write, cache_read)``
+    PRICE_SCALE price vectors and ``cell_prices`` is an ``array('q')`` giving
+    the matrix row of each cell: one row per model, or per (model, day) when
+    some model's prices changed over time (see PricingTable).  Unpriced
+    models get zeros.
+    """
+    model_position = CELL_DIMS.index("model")
+    models = store.values[model_position]
+    cell_models = store.keys[model_position]
+    if not pricing.versioned:
+        return [pricing.prices(model) for model in models], cell_models
+
+    date_position = CELL_DIMS.index("date")
+    days = [label_day(label) for label in store.values[date_position]]
+    matrix = []
+    vector_rows = {}
+    cell_prices = array("q")
+    for model_id, date_id in zip(cell_models, store.keys[date_position]):
+        vector = pricing.prices(models[model_id], days[date_id])
+        row = vector_rows.get(vector)
+        if row is None:
+            row = vector_rows[vector] = len(matrix)
+            matrix.append(vector)
+        cell_prices.append(row)
+    return matrix, cell_prices
+
+
+def price_cells(store, pricing):
+    """Return the exact cost of every row of a store in 1/COST_SCALE dollars.
+
+    Each cell is priced once.  With NumPy the whole store is priced in one
+    vectorised int64 multiply; Python integers are used instead when NumPy is
+    missing or a cell is large enough to overflow int64.
+    """
+    matrix, cell_prices = price_matrix(store, pricing)
+    if not len(store):
+        return []
+    token_columns = store.columns[:4]
+
+    if np is not None:
+        prices = np.asarray(matrix, dtype=np.int64).reshape(-1, 4)
+        tokens = np.stack(
+            [np.frombuffer(column, dtype=np.int64) for column in token_columns],
+            axis=1,
+        )
+        largest_price = int(prices.max()) if prices.size else 0
+        largest_tokens = int(np.abs(tokens).max())
+        if largest_price * largest_tokens * 4 < 2**63:
+            price_ids = np.frombuffer(cell_prices, dtype=np.int64)
+            return (tokens * prices[price_ids]).sum(axis=1).tolist()
+
+    inputs, outputs, cache_writes, cache_reads = token_columns
+    costs = []
+    for row, price_id in enumerate(cell_prices):
+        input_price, output_price, cache_write_price, cache_read_price = matrix[
+            price_id
+        ]
+        costs.append(
+            inputs[row] * input_price
+            + outputs[row] * output_price
+            + cache_writes[row] * cache_write_price
+            + cache_reads[row] * cache_read_price
+        )
+    return costs
+
+
+# Which copy of a request that was logged several times gets counted
+DEDUP_POLICIES = ("first", "last", "max")
+
+# Hashes held in memory before the global dedup index spills to disk
+DEDUP_MEMORY_LIMIT = 4_000_000
+
+# Minimum number of recent insertions before they are merged into the
+# sorted hash array
+DEDUP_BUFFER = 65536
+
+# Size of the bitmap that lets most new keys skip the sorted/on-disk lookup
+DEDUP_FILTER_BITS = 1 << 24
+
+
+def request_key(request_id):
+    """Hash a requestId to a signed 64-bit integer."""
+    digest = hashlib.blake2b(request_id.encode("utf-8"), digest_size=8).digest()
+    return int.from_bytes(digest, "little", signed=True)
+
+
+def position_key(file_path, position, timestamp_str):
+    """Key a record without a requestId by where and when it was logged.
+
+    A rotated or truncated and rewritten log holds other records at the same
+    offsets; their timestamps tell them apart, while reading the same record
+    again gives the same key.
+    """
+    return request_key(f"{file_path}:{position}:{timestamp_str}")
+
+
+def replaces(policy, old, new):
+    """Return True when contribution ``new`` should displace ``old``.
+
+    Contributions are ``(row, input, output, cache_write, cache_read)``.
+    ``max`` keeps the copy with the most output tokens (a streamed response
+    logged again as it grows), then the most tokens overall.
+    """
+    if policy == "first":
+        return False
+    if policy == "last":
+        return True
+    return (new[2], sum(new[1:])) > (old[2], sum(old[1:]))
+
+
+class DedupIndex:
+    """Global requestId deduplication state keyed by 64-bit hashes.
+
+    Keys live in a sorted ``array('q')`` plus a dict of recent insertions
+    that is merged in once it reaches an eighth of the sorted part, so a
+    lookup is a dict probe plus a bisect and a request costs about 8 bytes.
+    A fixed bitmap over the low hash bits of every compacted key lets most
+    first sightings skip the bisect (and the disk) altogether.
+    The ``last`` and ``max`` policies also keep the counted contribution
+    (another 40 bytes) because a later copy may need to take it back out.
+    With ``spill_dir`` the sorted part moves to a temporary SQLite table
+    whenever it holds more than ``memory_limit`` keys, so memory stays flat
+    however long the history is.
+    """
+
+    def __init__(self, policy="first", memory_limit=DEDUP_MEMORY_LIMIT, spill_dir=None):
+        self.policy = policy
+        self.memory_limit = memory_limit
+        self.spill_dir = spill_dir
+        self.keep_contributions = policy != "first"
+        self.recent = {}
+        self.keys = array("q")
+        self.values = tuple(array("q") for _ in range(5))
+        self._compact_at = DEDUP_BUFFER
+        self.filter = bytearray(DEDUP_FILTER_BITS // 8)
+        self.requests = 0
+        self.duplicates = 0
+        self.replaced = 0
+        self.spilled = 0
+        self._db = None
+        self._db_file = None
+
+    def __len__(self):
+        return self.requests
+
+    def offer(self, key, contribution):
+        """Offer a request; return ``(counted, displaced)``.
+
+        ``counted`` says whether ``contribution`` is (now) the counted copy;
+        ``displaced`` is the previously counted contribution it replaced, which
+        the caller must take back out of its aggregate.
+        """
+        recent = self.recent
+        old = recent.get(key)
+        bit = key & (DEDUP_FILTER_BITS - 1)
+        if old is None and self.filter[bit >> 3] & (1 << (bit & 7)):
+            keys = self.keys
+            position = bisect_left(keys, key)
+            if position < len(keys) and keys[position] == key:
+                if not self.keep_contributions:
+                    # Membership is all "first" needs
+                    return self._duplicate()
+                old = tuple(values[position] for values in self.values)
+            elif self._db is not None:
+                old = self._db.execute(
+                    "SELECT row, input, output, cache_write, cache_read "
+                    "FROM seen WHERE key = ?",
+                    (key,),
+                ).fetchone()
+
+        if old is None:
+            self.requests += 1
+        else:
+            if not replaces(self.policy, old, contribution):
+                return self._duplicate()
+            self.duplicates += 1
+            self.replaced += 1
+
+        recent[key] = contribution if self.keep_contributions else ()
+        if len(recent) >= self._compact_at:
+            self._compact()
+        return True, old
+
+    def _duplicate(self):
+        self.duplicates += 1
+        return False, None
+
+    def _compact(self):
+        """Merge the recent insertions into the sorted array, spilling if large."""
+        seen = self.filter
+        for key in self.recent:
+            bit = key & (DEDUP_FILTER_BITS - 1)
+            seen[bit >> 3] |= 1 << (bit & 7)
+        if self.keep_contributions:
+            # Stable sort: for a replaced key the recent entry sorts last
+            entries = list(zip(self.keys, *self.values))
+            entries.extend((key, *values) for key, values in self.recent.items())
+            entries.sort(key=itemgetter(0))
+            latest = {}
+            for entry in entries:
+                latest[entry[0]] = entry
+            entries = list(latest.values())
+            self.keys = array("q", (entry[0] for entry in entries))
+            self.values = tuple(
+                array("q", (entry[i] for entry in entries)) for i in range(1, 6)
+            )
+        else:
+            # Under first-wins a key is only ever remembered once
+            merged = list(self.keys)
+            merged.extend(self.recent)
+            merged.sort()
+            self.keys = array("q", merged)
+        self.recent = {}
+        self._compact_at = max(DEDUP_BUFFER, len(self.keys) // 8)
+
+        if self.spill_dir is not None and len(self.keys) > self.memory_limit:
+            self._spill()
+
+    def _spill(self):
+        """Move the sorted keys to the on-disk table."""
+        if self._db is None:
+            self._db_file = tempfile.NamedTemporaryFile(
+                prefix="claude-token-dedup-", suffix=".sqlite", dir=self.spill_dir
+            )
+            self._db = sqlite3.connect(self._db_file.name)
+            self._db.execute("PRAGMA journal_mode = OFF")
+            self._db.execute("PRAGMA synchronous = OFF")
+            self._db.execute(
+                "CREATE TABLE seen (key INTEGER PRIMARY KEY, row INTEGER, "
+                "input INTEGER, output INTEGER, cache_write INTEGER, "
+                "cache_read INTEGER)"
+            )
+        if self.keep_contributions:
+            rows = zip(self.keys, *self.values)
+        else:
+            rows = ((key, 0, 0, 0, 0, 0) for key in self.keys)
+        self._db.executemany(
+            "INSERT OR REPLACE INTO seen VALUES (?, ?, ?, ?, ?, ?)", rows
+        )
+        self._db.commit()
+        self.spilled = self._db.execute("SELECT count(*) FROM seen").fetchone()[0]
+        self.keys = array("q")
+        self.values = tuple(array("q") for _ in range(5))
+        self._compact_at = DEDUP_BUFFER
+
+    def close(self):
+        """Release the on-disk table, if any."""
+        if self._db is not None:
+            self._db.close()
+            self._db_file.close()
+            self._db = None
+
+
+# Phases timed inside analyze_jsonl_file() when profiling; the sub-phases
+# after "parse" are part of it and only have a wall time
+PARSE_PHASES = ("parse", "parse.decode", "parse.timestamps")
+
+
+def timed(func, timing):
+    """Wrap ``func`` so the wall time of each call is added to ``timing[0]``."""
+    perf_counter = time.perf_counter
+
+    def wrapper(arg):
+        started = perf_counter()
+        try:
+            return func(arg)
+        finally:
+            timing[0] += perf_counter() - started
+
+    return wrapper
+
+
+# Per-partial counters summed into the ``scan`` totals of a run
+SCAN_COUNTERS = ("bytes", "lines", "decoded", "undecodable", "malformed")
+
+
+def new_file_stats(offset=0):
+    """Create an empty per-file partial aggregate.
+
+    ``store`` holds the cell counters.  ``requests`` is the deduplication
+    state: for every request counted in this file it maps the requestId hash
+    (see request_key()) to the contribution
+    ``(row, input, output, cache_write, cache_read)`` so a later merge can take
+    it back out if another file's copy wins.  ``duplicates`` counts the
+    copies collapsed within the file.  ``spans`` maps each session to the
+    ``[first, last]`` timestamps (see span_timestamp()) of its
+    records, and ``recent`` holds the counted requests of the last
+    WINDOW_HISTORY minutes for the trailing windows (see merge_recent()).
+    """
+    return {
+        "store": UsageStore(),
+        "requests": {},
+        "spans": {},
+        "recent": {},
+        "duplicates": 0,
+        # Records counted under "unknown" for want of a parseable timestamp
+        "malformed": 0,
+        # Byte offset just past the last fully consumed line
+        "offset": offset,
+        "error": None,
+        # Work done by this run: bytes read, lines seen, lines decoded and
+        # lines that failed to decode
+        "bytes": 0,
+        "lines": 0,
+        "decoded": 0,
+        "undecodable": 0,
+    }
+
+
+# Row of the contributions of keyed records that fail the report's filters:
+# they take part in deduplication, but no cell counts them
+EXCLUDED_ROW = -1
+
+
+def remove_contribution(stats, contribution, row_map=None):
+    """Take a previously counted request back out of a partial.
+
+    ``row_map`` translates the contribution's row when it was recorded
+    against another partial's store (see UsageStore.merge()).
+    """
+    row, *tokens = contribution
+    if row == EXCLUDED_ROW:
+        return
+    if row_map is not None:
+        row = row_map[row]
+    stats["store"].add(row, *(-t for t in tokens), messages=-1)
+
+
+def merge_partial(target, partial, policy="first"):
+    """Merge ``partial`` into ``target``, resolving shared requests by ``policy``."""
+    row_map = target["store"].merge(partial["store"])
+
+    requests = target["requests"]
+    times = partial.get("timestamps")
+    if times is not None:
+        target_times = target.setdefault("timestamps", {})
+    rejected = set()
+    for key, (row, *tokens) in partial["requests"].items():
+        contribution = (row_map[row] if row != EXCLUDED_ROW else row, *tokens)
+        old = requests.get(key)
+        if old is None:
+            requests[key] = contribution
+        else:
+            target["duplicates"] += 1
+            if not replaces(policy, old, contribution):
+                remove_contribution(target, contribution)
+                rejected.add(key)
+                continue
+            remove_contribution(target, old)
+            requests[key] = contribution
+        if times is not None:
+            target_times[key] = times[key]
+
+    merge_spans(target["spans"], partial["spans"])
+    merge_recent(target["recent"], partial, rejected)
+    target["duplicates"] += partial["duplicates"]
+    target["malformed"] += partial["malformed"]
+    target["offset"] = partial["offset"]
+    if partial["error"] is not None:
+        target["error"] = partial["error"]
+    for counter in ("bytes", "lines", "decoded", "undecodable"):
+        target[counter] += partial[counter]
+    if "timings" in partial:
+        timings = target.setdefault("timings", {})
+        for phase, (wall, cpu) in partial["timings"].items():
+            total = timings.setdefault(phase, [0.0, 0.0])
+            total[0] += wall
+            total[1] += cpu
+
+
+def record_counter(
+    stats,
+    file_path=None,
+    policy="first",
+    timestamps=False,
+    filters=None,
+    bucketer=None,
+    bucket_hour=None,
+    sink=None,
+):
+    """Return a function folding normalised usage records into a partial.
+
+    Every log source (see SOURCES) reduces its records to calls of
+    ``count(key, timestamp, model, project, session, branch, cwd, input,
+    output, cache_write, cache_read, position, matched)``, so they are filtered,
+    bucketed, deduplicated and counted the same way.  ``key`` is the
+    request_key() of the record, or None when it has none; ``position`` then
+    identifies it within ``file_path`` where a key is needed anyway (see
+    position_key()).
+    ``timestamp`` is an ISO 8601 string, bucketed by ``bucket_hour``
+    (default: ``bucketer.hour``).  The other arguments are those of
+    analyze_jsonl_file().
+
+    With ``sink``, records that pass the filters are handed to
+    ``sink(key, hour, timestamp, model, project, session, branch, cwd, input,
+    output, cache_write, cache_read, matched)`` instead of being deduplicated
+    and counted (see RecordWriter); with ``timestamps`` records without a
+    requestId get their position_key() first.
+
+    ``filters`` are applied to the copy of a request that deduplication
+    keeps, as query and merge apply them: a keyed record that does not match
+    still takes part in deduplication, with an EXCLUDED_ROW contribution, but
+    is not counted, and only records without a requestId are dropped
+    outright.  ``matched=False`` marks a record already known not to match,
+    such as a line the line filter rejected (see analyze_jsonl_file()).
+    """
+    store = stats["store"]
+    requests = stats["requests"]
+    spans = stats["spans"]
+    recent = stats["recent"]
+    recent_since = window_cutoff()
+    times = stats.setdefault("timestamps", {}) if timestamps else None
+    bounded = bool(filters and (filters["since"] or filters["until"]))
+    if bucketer is None:
+        bucketer = get_bucketer()
+    if bucket_hour is None:
+        bucket_hour = bucketer.hour
+    label = bucketer.label
+
+    def count(
+        key,
+        timestamp_str,
+        model,
+        project,
+        session_id,
+        branch,
+        cwd,
+        input_tokens,
+        output_tokens,
+        cache_write_tokens,
+        cache_read_tokens,
+        position=None,
+        matched=True,
+    ):
+        hour = bucket_hour(timestamp_str)
+
+        if filters is not None and matched:
+            if filters["model"] and filters["model"] not in str(model).lower():
+                matched = False
+            elif filters["project"] and filters["project"] not in str(project).lower():
+                matched = False
+            elif bounded and (hour is None or not in_bounds(filters, hour)):
+                matched = False
+        # A request is filtered on the copy deduplication keeps, so only
+        # records without a requestId can be dropped here
+        if not matched and key is None:
+            return
+
+        if hour is None and matched:
+            stats["malformed"] += 1
+        if key is None and times is not None:
+            key = position_key(file_path, position, timestamp_str)
+        if sink is not None:
+            sink(
+                key,
+                hour,
+                timestamp_str,
+                model,
+                project,
+                session_id,
+                branch,
+                cwd,
+                input_tokens,
+                output_tokens,
+                cache_write_tokens,
+                cache_read_tokens,
+                matched,
+            )
+            return
+        date_key = label(hour)
+
+        # Every copy of a request widens its session's span
+        moment = None
+        if hour is not None and matched:
+            if len(timestamp_str) == 24 and timestamp_str[-1] == "Z":
+                moment = timestamp_str
+            else:
+                moment = span_timestamp(timestamp_str)
+        if moment is not None and session_id is not None:
+            span = spans.get(session_id)
+            if span is None:
+                spans[session_id] = [moment, moment]
+            elif moment < span[0]:
+                span[0] = moment
+            elif moment > span[1]:
+                span[1] = moment
+
+        # Resolve copies of a request within this partial
+        old = requests.get(key) if key is not None else None
+        if old is not None:
+            stats["duplicates"] += 1
+            if not replaces(
+                policy,
+                old,
+                (
+                    None,
+                    input_tokens,
+                    output_tokens,
+                    cache_write_tokens,
+                    cache_read_tokens,
+                ),
+            ):
+                return
+            remove_contribution(stats, old)
+            recent.pop(key, None)
+        if not matched:
+            requests[key] = (
+                EXCLUDED_ROW,
+                input_tokens,
+                output_tokens,
+                cache_write_tokens,
+                cache_read_tokens,
+            )
+            return
+
+        row = store.row(date_key, model, project, session_id, branch, cwd)
+        store.add(
+            row,
+            input_tokens,
+            output_tokens,
+            cache_write_tokens,
+            cache_read_tokens,
+        )
+        if key is not None:
+            requests[key] = (
+                row,
+                input_tokens,
+                output_tokens,
+                cache_write_tokens,
+                cache_read_tokens,
+            )
+            if times is not None:
+                times[key] = timestamp_str
+
+        if moment is not None and moment >= recent_since:
+            if key is None:
+                key = position_key(file_path, position, timestamp_str)
+            recent[key] = (
+                moment,
+                input_tokens,
+                output_tokens,
+                cache_write_tokens,
+                cache_read_tokens,
+                model,
+            )
+
+    return count
+
+
+def analyze_jsonl_file(
+    file_path,
+    start_offset=0,
+    end_offset=None,
+    stats=None,
+    decoder="auto",
+    reader="auto",
+    project=None,
+    policy="first",
+    timestamps=False,
+    filters=None,
+    tz="UTC",
+    granularity="day",
+    profile=False,
+    sink=None,
+):
+    """Analyze a single JSONL file and return its partial aggregate.
+
+    Records are folded into the (date, model, project, session, branch, cwd)
+    cells of ``stats["store"]`` as soon as they are parsed (see
+    record_counter()), and every copy of
+    a request widens its session's span in ``stats["spans"]``; nothing
+    per-message is kept beyond the requestId dedup state and the requests
+    of the last WINDOW_HISTORY minutes.
+    Parsing covers the lines starting in ``[start_offset, end_offset)``; both
+    bounds must be line boundaries, and ``end_offset=None`` reads to EOF.  This
+    lets a grown file be resumed (pass its cached partial as ``stats``) and a
+    large file be split across workers.  The returned ``offset`` is the end of
+    the last fully consumed line; an unterminated trailing line is only
+    consumed once it decodes, since it may still be being written.
+
+    Lines are handled as bytes, and lines lacking the ``"assistant"`` or
+    ``"usage"`` markers are rejected without being decoded.  Survivors go
+    through the ``decoder`` backend (see get_decoder()).  ``reader`` picks
+    the buffered reader or a memory-mapped one (see choose_reader()).  Copies
+    of a request within the file are resolved by the dedup ``policy``.
+
+    With ``timestamps`` the partial also maps every counted request to its raw
+    timestamp in ``stats["timestamps"]``, and records without a requestId are
+    keyed by their file position and timestamp so they can be stored
+    individually (see position_key() and ingest_files()).
+
+    ``filters`` (see make_filters()) apply to the copy of a request that
+    deduplication keeps, so filtered reports partition the unfiltered one.
+    Lines that cannot match are rejected as raw bytes, without being decoded
+    (see make_line_filter()); only the request key of such a line is read
+    (see line_request_key()).  Under max, which weighs every copy, such a
+    line still needs its usage: it is read from the bytes (see line_usage())
+    when the decoder is the stdlib ``json``, and otherwise decoded, as
+    orjson and msgspec decode a line faster than it can be scanned.
+
+    Records are bucketed by ``granularity`` in the ``tz`` time zone (see
+    TimeBucketer); records whose timestamp cannot be parsed are counted under
+    "unknown" and in ``stats["malformed"]``.
+
+    With ``profile`` the wall and CPU time spent on the file, and the share
+    of it spent decoding JSON and parsing timestamps, are added to
+    ``stats["timings"]`` (see PipelineTimer).
+
+    A ``sink`` receives the records instead of the partial (see
+    record_counter()); ``store`` and ``requests`` then stay empty.
+    """
+    if stats is None:
+        stats = new_file_stats(start_offset)
+    positional = policy in POSITIONAL_POLICIES
+    line_matches = None
+    if filters:
+        line_matches = make_line_filter(filters, project)
+    bucketer = get_bucketer(tz, granularity)
+    bucket_hour = bucketer.hour
+    backend, loads, decode_errors = get_decoder(decoder)
+    # Whether rejected keyed lines are counted without being decoded
+    undecoded = positional or backend == "json"
+    if profile:
+        timings = stats.setdefault("timings", {})
+        for phase in PARSE_PHASES:
+            timings.setdefault(phase, [0.0, 0.0])
+        loads = timed(loads, timings["parse.decode"])
+        bucket_hour = timed(bucket_hour, timings["parse.timestamps"])
+        started = time.perf_counter()
+        cpu_started = time.process_time()
+    count = record_counter(
+        stats, file_path, policy, timestamps, filters, bucketer, bucket_hour, sink
+    )
+    decoded = 0
+    undecodable = 0
+    # [end of the last skipped complete line, lines seen]
+    cursor = [start_offset, 0]
+    offset = start_offset
+
+    try:
+        opener = log_opener(file_path)
+        with opener(file_path, "rb") as f:
+            mapped = None
+            if opener is open and choose_reader(file_path, reader) == "mmap":
+                try:
+                    mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                except (OSError, ValueError):
+                    # Empty or unmappable file
+                    mapped = None
+
+            if mapped is not None:
+                candidates = _mmap_candidates(mapped, start_offset, end_offset, cursor)
+            else:
+                candidates = _stream_candidates(f, start_offset, end_offset, cursor)
+
+            for raw_line, line_end, complete in candidates:
+                if (
+                    line_matches is not None
+                    and not line_matches(raw_line)
+                    and (
+                        undecoded
+                        or not (
+                            REQUEST_ID_MARKER in raw_line
+                            or REQUEST_KEY_MARKER in raw_line
+                        )
+                    )
+                ):
+                    key = line_request_key(raw_line) if undecoded else None
+                    if key is None:
+                        if complete:
+                            offset = line_end
+                        continue
+                    tokens = [0, 0, 0, 0] if positional else line_usage(raw_line)
+                    # A torn final line, or usage that is not plain, is
+                    # decoded as usual
+                    if complete and tokens is not None:
+                        offset = line_end
+                        if positional or any(tokens):
+                            count(
+                                key,
+                                None,
+                                None,
+                                project,
+                                None,
+                                None,
+                                None,
+                                *tokens,
+                                line_end,
+                                matched=False,
+                            )
+                        continue
+                decoded += 1
+                try:
+                    data = loads(raw_line)
+                except decode_errors:
+                    # A torn final line is retried on the next run
+                    if complete:
+                        offset = line_end
+                        undecodable += 1
+                    continue
+
+                offset = line_end
+
+                # Only count assistant messages with usage
+                if not isinstance(data, dict) or data.get("type") != "assistant":
+                    continue
+
+                message = data.get("message", {})
+                usage = message.get("usage", {})
+                request_id = data.get("requestId")
+
+                # Skip if no usage
+                if not usage:
+                    continue
+
+                (
+                    input_tokens,
+                    output_tokens,
+                    cache_write_tokens,
+                    cache_read_tokens,
+                ) = parse_usage(usage)
+
+                # Skip if no tokens
+                if (
+                    input_tokens == 0
+                    and output_tokens == 0
+                    and cache_write_tokens == 0
+                    and cache_read_tokens == 0
+                ):
+                    continue
+
+                if request_id:
+                    key = request_key(request_id)
+                else:
+                    # Summaries written by archive carry the hash instead
+                    key = data.get("requestKey")
+                    if type(key) is not int:
+                        key = None
+                count(
+                    key,
+                    data.get("timestamp", ""),
+                    message.get("model", "unknown"),
+                    project,
+                    data.get("sessionId"),
+                    data.get("gitBranch"),
+                    data.get("cwd"),
+                    input_tokens,
+                    output_tokens,
+                    cache_write_tokens,
+                    cache_read_tokens,
+                    line_end,
+                )
+
+            if mapped is not None:
+                mapped.close()
+            offset = max(offset, cursor[0])
+            stats["offset"] = offset
+            stats["bytes"] += offset - start_offset
+
+    except Exception as e:
+        print(f"Error reading {file_path}: {e}", file=sys.stderr)
+        stats["error"] = str(e)
+
+    stats["lines"] += cursor[1]
+    stats["decoded"] += decoded
+    stats["undecodable"] += undecodable
+    if profile:
+        timings["parse"][0] += time.perf_counter() - started
+        timings["parse"][1] += time.process_time() - cpu_started
+    return stats
+
+
+INDEX_VERSION = 12
+
+
+def default_index_path():
+    """Return the default location of the incremental scan index."""
+    cache_home = os.environ.get("XDG_CACHE_HOME") or Path.home() / ".cache"
+    return Path(cache_home) / "claude-token-counter" / "index.json"
+
+
+def load_index(index_path, settings=None):
+    """Load the incremental scan index, returning an empty one if unusable.
+
+    ``settings`` are the options that shape the cached partials (such as the
+    dedup policy); an index written with different settings is discarded.
+    """
+    settings = settings or {}
+    empty = {"version": INDEX_VERSION, "settings": settings, "files": {}}
+    try:
+        with open(index_path, "r", encoding="utf-8") as f:
+            index = json.load(f)
+    except FileNotFoundError:
+        return empty
+    except (OSError, ValueError) as e:
+        print(f"Ignoring unreadable index {index_path}: {e}", file=sys.stderr)
+        return empty
+
+    if not isinstance(index, dict) or index.get("version") != INDEX_VERSION:
+        return empty
+    if index.get("settings") != settings:
+        return empty
+    return index
+
+
+def save_index(index, index_path):
+    """Atomically write the incremental scan index."""
+    index_path = Path(index_path)
+    try:
+        index_path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = index_path.with_name(index_path.name + f".{os.getpid()}.tmp")
+        # json.dump() streams through the pure-Python encoder; dumps() does not
+        data = json.dumps(index, separators=(",", ":"))
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(data)
+        os.replace(tmp_path, index_path)
+    except OSError as e:
+        print(f"Could not write index {index_path}: {e}", file=sys.stderr)
+
+
+def partial_from_index(cached):
+    """Rebuild a partial aggregate from its scan index representation."""
+    stats = new_file_stats(cached["offset"])
+    stats["store"] = UsageStore.from_rows(cached["cells"])
+    stats["requests"] = {
+        key: tuple(contribution) for key, *contribution in cached["requests"]
+    }
+    stats["spans"] = cached["spans"]
+    stats["recent"] = {key: tuple(entry) for key, *entry in cached["recent"]}
+    stats["duplicates"] = cached["duplicates"]
+    stats["malformed"] = cached["malformed"]
+    if "messages" in cached:
+        stats["messages"] = cached["messages"]
+    return stats
+
+
+def index_resume_point(file_path, index):
+    """Return ``(cached_partial, stat)`` for a file.
+
+    The cached partial is reused as-is when the file is unchanged, extended
+    when the file has only grown, and discarded (``None``) when the file was
+    truncated, rewritten or replaced by a new inode (log rotation).
+    """
+    try:
+        st = os.stat(file_path)
+    except OSError:
+        return None, None
+
+    cached = index["files"].get(str(file_path))
+    if cached and cached["inode"] == st.st_ino:
+        if cached["size"] == st.st_size and cached["mtime"] == st.st_mtime_ns:
+            return partial_from_index(cached), st
+        if cached["size"] < st.st_size:
+            return partial_from_index(cached), st
+    return None, st
+
+
+def partial_record(stats):
+    """Serialise a partial aggregate as JSON-ready data (see partial_from_index())."""
+    recent_since = window_cutoff()
+    return {
+        "offset": stats["offset"],
+        "cells": stats["store"].to_rows(),
+        "requests": [
+            [key, *contribution] for key, contribution in stats["requests"].items()
+        ],
+        "spans": stats["spans"],
+        # Requests that are no longer recent cannot become recent again
+        "recent": [
+            [key, *entry]
+            for key, entry in stats["recent"].items()
+            if entry[0] >= recent_since
+        ],
+        "duplicates": stats["duplicates"],
+        "malformed": stats["malformed"],
+    }
+
+
+def update_index(index, file_path, st, stats):
+    """Record the parsed state of a file in the scan index."""
+    key = str(file_path)
+    if st is None or stats["error"] is not None:
+        index["files"].pop(key, None)
+        return
+    index["files"][key] = {
+        "inode": st.st_ino,
+        "size": st.st_size,
+        "mtime": st.st_mtime_ns,
+        **partial_record(stats),
+    }
+    if "messages" in stats:
+        # An opencode session (see analyze_opencode())
+        index["files"][key]["messages"] = stats["messages"]
+
+
+# Files larger than this are split into byte ranges when parsing in parallel
+PARALLEL_CHUNK_BYTES = 32 * 1024 * 1024
+
+# Byte ranges handed to a worker process at a time
+PARALLEL_TASKS_PER_CHUNK = 4
+
+
+def split_file_ranges(file_path, start_offset, chunk_bytes=PARALLEL_CHUNK_BYTES):
+    """Split a file into line-aligned ``(start, end)`` byte ranges.
+
+    The last range is open-ended (``end=None``) so lines appended while the
+    file is being parsed are handled the same way as in a sequential run.
+    Compressed logs cannot be entered mid-stream, so they are not split.
+    """
+    if log_opener(file_path) is not open:
+        return [(start_offset, None)]
+    try:
+        size = os.path.getsize(file_path)
+    except OSError:
+        return [(start_offset, None)]
+
+    ranges = []
+    start = start_offset
+    try:
+        with open(file_path, "rb") as f:
+            while size - start > chunk_bytes:
+                f.seek(start + chunk_bytes)
+                f.readline()
+                end = f.tell()
+                if end >= size:
+                    break
+                ranges.append((start, end))
+                start = end
+    except OSError:
+        pass
+    ranges.append((start, None))
+    return ranges
+
+
+def _analyze_range(task):
+    """Worker entry point: parse one byte range into a partial aggregate."""
+    file_path, start_offset, end_offset, project, options = task
+    return analyze_jsonl_file(
+        file_path, start_offset, end_offset, project=project, **options
+    )
+
+
+def project_name(file_path, claude_dir=None):
+    """Return the project a log belongs to: its top directory under claude_dir."""
+    file_path = Path(file_path)
+    if claude_dir is not None:
+        try:
+            return file_path.relative_to(claude_dir).parts[0]
+        except (ValueError, IndexError):
+            pass
+    return file_path.parent.name
+
+
+def analyze_files(
+    jsonl_files,
+    index=None,
+    jobs=1,
+    options=None,
+    claude_dir=None,
+    start_offsets=None,
+    filters=None,
+):
+    """Analyze files sequentially or across a process pool.
+
+    Yields one partial aggregate per file, in input order, so the caller can
+    fold them into the global aggregate as they arrive.  ``jsonl_files`` may
+    be a generator, such as scan_claude_projects(); it is consumed as the
+    files are parsed.  ``options`` holds
+    the keyword arguments passed on to analyze_jsonl_file() (decoder, reader,
+    policy, timestamps).  Without a scan ``index``, ``start_offsets`` may map
+    file paths to the offset to resume from; the partial then only covers
+    what follows.  With ``jobs > 1`` every file, or every byte range of a large
+    file, is parsed by a worker process and the ranges are merged back in
+    order, so requestId deduplication is identical to a sequential run.
+
+    ``filters`` are pushed down into the parse (see analyze_jsonl_file()) of
+    the files the ``index`` has no partial for, or of every file without
+    one.  Those partials only serve reports filtered alike, so they are not
+    recorded in the index; cached partials describe whole files and are
+    filtered by the caller (see relabel_partial()).
+    """
+    options = options or {}
+    policy = options.get("policy", "first")
+    filtered_options = dict(options, filters=filters) if filters else options
+
+    def file_options(cached):
+        return filtered_options if cached is None else options
+
+    def resume_points():
+        for file_path in jsonl_files:
+            if index is not None:
+                yield file_path, *index_resume_point(file_path, index)
+            elif start_offsets and start_offsets.get(str(file_path)):
+                yield file_path, new_file_stats(start_offsets[str(file_path)]), None
+            else:
+                yield file_path, None, None
+
+    def finish(file_path, cached, st, stats):
+        if index is not None:
+            if cached is None and filters:
+                index["files"].pop(str(file_path), None)
+            else:
+                update_index(index, file_path, st, stats)
+        return stats
+
+    if jobs <= 1:
+        for file_path, cached, st in resume_points():
+            start_offset = cached["offset"] if cached else 0
+            stats = analyze_jsonl_file(
+                file_path,
+                start_offset,
+                stats=cached,
+                project=project_name(file_path, claude_dir),
+                **file_options(cached),
+            )
+            yield finish(file_path, cached, st, stats)
+        return
+
+    # Tasks are generated lazily, so workers start parsing the first files
+    # while the rest are still being discovered
+    files = []
+    owners = []
+
+    def tasks():
+        for file_path, cached, st in resume_points():
+            file_number = len(files)
+            files.append((file_path, cached, st))
+            start_offset = cached["offset"] if cached else 0
+            project = project_name(file_path, claude_dir)
+            for start, end in split_file_ranges(file_path, start_offset):
+                owners.append(file_number)
+                yield file_path, start, end, project, file_options(cached)
+
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        # map() submits every task before returning, so owners is complete
+        results = zip(
+            owners,
+            executor.map(_analyze_range, tasks(), chunksize=PARALLEL_TASKS_PER_CHUNK),
+        )
+        current = None
+        current_number = None
+        for file_number, partial in results:
+            if file_number != current_number:
+                if current is not None:
+                    yield finish(*files[current_number], current)
+                current_number = file_number
+                current = files[file_number][1] or new_file_stats()
+            merge_partial(current, partial, policy)
+        if current is not None:
+            yield finish(*files[current_number], current)
+
+
+def resolve_claude_dir(claude_dir=None):
+    """Return the Claude projects directory, defaulting to ~/.claude/projects."""
+    if claude_dir is None:
+        return Path.home() / ".claude" / "projects"
+    return Path(claude_dir)
+
+
+# Directory listings changed this recently are not cached: another change
+# within the same mtime tick would leave the mtime as it was
+DIR_CACHE_SETTLE_NS = 2 * 1_000_000_000
+
+
+def walk_jsonl_files(root, listings=None, keep=None):
+    """Yield the paths of the logs (see LOG_SUFFIXES) under ``root`` as they are found.
+
+    Directories are walked depth first with os.scandir(), each directory's
+    files before its subdirectories, the same order as Path.rglob().
+    ``listings`` maps directory paths to ``[mtime_ns, files, subdirs]``; a
+    directory whose mtime is unchanged is not listed again.  Appending to a
+    log does not touch its directory's mtime, so the files themselves are
+    still stat()ed by the caller.  ``keep(names)`` selects which of the
+    directories directly under ``root`` are walked.
+    """
+    root = str(root)
+    now = time.time_ns()
+    stack = [root]
+    while stack:
+        directory = stack.pop()
+        try:
+            mtime = os.stat(directory).st_mtime_ns
+        except OSError:
+            continue
+        cached = listings.get(directory) if listings is not None else None
+        if cached and cached[0] == mtime:
+            files, subdirs = cached[1], cached[2]
+        else:
+            files = []
+            subdirs = []
+            try:
+                with os.scandir(directory) as entries:
+                    for entry in entries:
+                        try:
+                            if entry.is_dir(follow_symlinks=False):
+                                subdirs.append(entry.name)
+                            elif entry.name.endswith(LOG_SUFFIXES) and entry.is_file():
+                                files.append(entry.name)
+                        except OSError:
+                            continue
+            except OSError:
+                continue
+            if listings is not None:
+                if cached:
+                    # Forget the listings of subdirectories that went away
+                    for name in set(cached[2]) - set(subdirs):
+                        gone = os.path.join(directory, name)
+                        for key in [
+                            key
+                            for key in listings
+                            if key == gone or key.startswith(gone + os.sep)
+                        ]:
+                            del listings[key]
+                if now - mtime > DIR_CACHE_SETTLE_NS:
+                    listings[directory] = [mtime, files, subdirs]
+                else:
+                    listings.pop(directory, None)
+
+        if keep is not None and directory == root:
+            subdirs = keep(subdirs)
+        for name in files:
+            yield os.path.join(directory, name)
+        stack.extend(os.path.join(directory, name) for name in reversed(subdirs))
+
+
+# Slack for --since mtime pruning: a record's day is taken in its own UTC
+# offset, which may be up to a day ahead of the file's UTC mtime
+MTIME_SLACK_SECONDS = 24 * 3600
+
+
+def scan_claude_projects(claude_dir=None, filters=None, listings=None, policy=None):
+    """Yield the JSONL files in the Claude projects directory as they are found.
+
+    With ``filters`` (see make_filters()), files last written before
+    ``since`` are skipped without being opened: copies of a request are
+    logged with its timestamp, so none of theirs could be reported.  Other
+    projects take part in deduplication, so they are walked too, except
+    where the dedup ``policy`` shows they cannot hold a kept copy: under
+    first the projects after the last matching one, and under last those
+    before the first.  ``listings`` is the directory cache described in
+    walk_jsonl_files().
+    """
+    claude_dir = resolve_claude_dir(claude_dir)
+
+    if not claude_dir.exists():
+        print(f"Claude projects directory not found: {claude_dir}", file=sys.stderr)
+        return
+
+    keep = None
+    if filters is not None and filters["project"] and policy in POSITIONAL_POLICIES:
+        project = filters["project"]
+
+        def keep(names):
+            matching = [
+                number for number, name in enumerate(names) if project in name.lower()
+            ]
+            if not matching:
+                return []
+            if policy == "first":
+                return names[: matching[-1] + 1]
+            return names[matching[0] :]
+
+    since = None
+    if filters is not None and filters["since"]:
+        since = bucket_start(filters["since"]) - MTIME_SLACK_SECONDS
+
+    for file_path in walk_jsonl_files(claude_dir, listings, keep):
+        if since is not None:
+            try:
+                if os.stat(file_path).st_mtime < since:
+                    continue
+            except OSError:
+                continue
+        yield file_path
+
+
+def bucket_start(bucket):
+    """Return the UTC epoch time a ``YYYY-MM-DD[THH]`` bucket starts at."""
+    fmt = "%Y-%m-%dT%H" if len(bucket) > 10 else "%Y-%m-%d"
+    return datetime.strptime(bucket, fmt).replace(tzinfo=timezone.utc).timestamp()
+
+
+# Log sources --source can read; "all" reads every one of them
+SOURCES = ("claude", "opencode")
+
+# opencode message files read per batch, and threads reading the batches
+OPENCODE_BATCH = 64
+OPENCODE_THREADS = 16
+
+# opencode timestamps are milliseconds since this
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+
+def resolve_opencode_dir(opencode_dir=None):
+    """Return opencode's storage directory, defaulting to ~/.local/share/opencode/storage."""
+    if opencode_dir is None:
+        data_home = os.environ.get("XDG_DATA_HOME") or Path.home() / ".local" / "share"
+        return Path(data_home) / "opencode" / "storage"
+    return Path(opencode_dir)
+
+
+def opencode_project(path):
+    """Name an opencode message's project the way Claude Code names its directories.
+
+    ``path`` is the message's ``{"cwd", "root"}``; the worktree root is
+    used unless it is "/", which opencode reports outside git repositories.
+    """
+    directory = path.get("root")
+    if not directory or directory == "/":
+        directory = path.get("cwd")
+    if not directory:
+        return "unknown"
+    return re.sub(r"[^A-Za-z0-9]", "-", directory)
+
+
+def opencode_sessions(opencode_dir=None, filters=None):
+    """Yield ``(session_dir, messages)`` for every opencode session.
+
+    opencode keeps one small JSON file per message under
+    ``message/<sessionID>/``; ``messages`` maps their names to their mtimes
+    in nanoseconds.  With ``filters`` (see make_filters()), sessions whose
+    directory was last written before ``since`` are skipped.
+    """
+    message_dir = resolve_opencode_dir(opencode_dir) / "message"
+    try:
+        with os.scandir(message_dir) as entries:
+            session_names = sorted(
+                entry.name for entry in entries if entry.is_dir(follow_symlinks=False)
+            )
+    except OSError:
+        print(f"opencode message directory not found: {message_dir}", file=sys.stderr)
+        return
+
+    since = None
+    if filters is not None and filters["since"]:
+        since = bucket_start(filters["since"]) - MTIME_SLACK_SECONDS
+
+    for name in session_names:
+        session_dir = os.path.join(message_dir, name)
+        messages = {}
+        try:
+            if since is not None and os.stat(session_dir).st_mtime < since:
+                continue
+            with os.scandir(session_dir) as entries:
+                for entry in entries:
+                    if entry.name.endswith(".json"):
+                        try:
+                            if entry.is_file():
+                                messages[entry.name] = entry.stat().st_mtime_ns
+                        except OSError:
+                            continue
+        except OSError:
+            continue
+        yield session_dir, messages
+
+
+def _read_files(paths):
+    """Thread pool entry point: read a batch of files, or the OSError each raised."""
+    contents = []
+    for path in paths:
+        try:
+            with open(path, "rb") as f:
+                contents.append(f.read())
+        except OSError as e:
+            contents.append(e)
+    return contents
+
+
+def analyze_opencode(sessions, index=None, known=None, options=None):
+    """Parse opencode sessions into one partial aggregate per session.
+
+    ``sessions`` yields ``(session_dir, messages)`` (see opencode_sessions()).
+    Only message files whose mtime differs from the one already accounted
+    for are read.  With a scan ``index`` a session's cached partial is
+    reused: a rewritten message replaces what was counted for it, and a
+    deleted one is taken back out.  ``known`` (used by ingest) maps message
+    paths to the mtime already stored; the partial then only covers the
+    other messages.  Either way ``stats["messages"]`` maps the session's
+    accounted message files to their mtimes.
+
+    Message files are tiny, so they are read in batches of OPENCODE_BATCH by
+    OPENCODE_THREADS threads, which wait on the file system without holding
+    the GIL, while the calling thread decodes and counts them in order.
+    Messages are keyed by their id (the file name), so a message is one
+    request however often opencode rewrote it.  ``options`` are those of
+    analyze_jsonl_file() (decoder, policy, timestamps, filters, tz,
+    granularity, profile, sink).
+    """
+    options = options or {}
+    _, loads, decode_errors = get_decoder(options.get("decoder", "auto"))
+    bucketer = get_bucketer(options.get("tz", "UTC"), options.get("granularity", "day"))
+    profile = options.get("profile", False)
+
+    # (session_dir, partial, [(name, mtime)] to read), in session order
+    plans = []
+
+    def batches():
+        batch = []
+        for session_dir, messages in sessions:
+            cached = index["files"].get(str(session_dir)) if index is not None else None
+            if cached is not None and "messages" in cached:
+                stats = partial_from_index(cached)
+            else:
+                stats = new_file_stats()
+                if known is not None:
+                    stats["messages"] = {
+                        name: mtime
+                        for name, mtime in messages.items()
+                        if known.get(os.path.join(session_dir, name)) == mtime
+                    }
+            accounted = stats.setdefault("messages", {})
+            changed = [
+                (name, mtime)
+                for name, mtime in messages.items()
+                if accounted.get(name) != mtime
+            ]
+            # Messages that went away, such as those of a reverted turn
+            for name in [name for name in accounted if name not in messages]:
+                forget_message(stats, name)
+            plans.append((session_dir, stats, changed))
+            for name, _ in changed:
+                batch.append(os.path.join(session_dir, name))
+                if len(batch) >= OPENCODE_BATCH:
+                    yield batch
+                    batch = []
+        if batch:
+            yield batch
+
+    def forget_message(stats, name, key=None):
+        if key is None:
+            key = request_key(name[: -len(".json")])
+        old = stats["requests"].pop(key, None)
+        if old is not None:
+            remove_contribution(stats, old)
+            stats["recent"].pop(key, None)
+            stats.get("timestamps", {}).pop(key, None)
+        stats["messages"].pop(name, None)
+
+    with ThreadPoolExecutor(max_workers=OPENCODE_THREADS) as executor:
+        # map() submits every batch before returning, so plans is complete
+        contents = chain.from_iterable(executor.map(_read_files, batches()))
+        for session_dir, stats, changed in plans:
+            session_loads = loads
+            bucket_hour = bucketer.hour
+            if profile:
+                timings = stats.setdefault("timings", {})
+                for phase in PARSE_PHASES:
+                    timings.setdefault(phase, [0.0, 0.0])
+                session_loads = timed(loads, timings["parse.decode"])
+                bucket_hour = timed(bucket_hour, timings["parse.timestamps"])
+                started = time.perf_counter()
+                cpu_started = time.process_time()
+            count = record_counter(
+                stats,
+                session_dir,
+                options.get("policy", "first"),
+                options.get("timestamps", False),
+                options.get("filters"),
+                bucketer,
+                bucket_hour,
+                options.get("sink"),
+            )
+            accounted = stats["messages"]
+            for name, mtime in changed:
+                raw = next(contents)
+                if isinstance(raw, OSError):
+                    forget_message(stats, name)
+                    if not isinstance(raw, FileNotFoundError):
+                        print(f"Error reading {raw.filename}: {raw}", file=sys.stderr)
+                        stats["error"] = str(raw)
+                    continue
+                stats["lines"] += 1
+                stats["bytes"] += len(raw)
+                stats["decoded"] += 1
+                try:
+                    message = session_loads(raw)
+                except decode_errors:
+                    # A message being written is read again on the next run
+                    stats["undecodable"] += 1
+                    continue
+
+                # A rewritten message replaces what was counted for it
+                key = request_key(name[: -len(".json")])
+                forget_message(stats, name, key)
+                accounted[name] = mtime
+                if not isinstance(message, dict) or message.get("role") != "assistant":
+                    continue
+                tokens = parse_opencode_usage(message)
+                if not any(tokens):
+                    continue
+                created = (message.get("time") or {}).get("created")
+                timestamp_str = ""
+                if type(created) in (int, float):
+                    moment = EPOCH + timedelta(milliseconds=created)
+                    timestamp_str = moment.strftime("%Y-%m-%dT%H:%M:%S.%f")[:23] + "Z"
+                path = message.get("path") or {}
+                count(
+                    key,
+                    timestamp_str,
+                    message.get("modelID", "unknown"),
+                    opencode_project(path),
+                    message.get("sessionID"),
+                    None,
+                    path.get("cwd"),
+                    *tokens,
+                )
+            if profile:
+                timings["parse"][0] += time.perf_counter() - started
+                timings["parse"][1] += time.process_time() - cpu_started
+            if index is not None:
+                try:
+                    st = os.stat(session_dir)
+                except OSError:
+                    st = None
+                update_index(index, session_dir, st, stats)
+            yield session_dir, stats
+
+
+def calculate_stats_costs(aggregated, pricing):
+    """Calculate costs for every grouping based on pricing.
+
+    Each cell of the aggregate's UsageStore is priced exactly once (see
+    price_cells()) and its cost is handed to every grouping in GROUPINGS.
+    Costs are summed as exact integers and only converted to dollars at the
+    end, so totals do not depend on summation order.  Models ``pricing``
+    has no rule for are listed in ``aggregated["unpriced"]``.
+    """
+    store = aggregated["store"]
+    costs = price_cells(store, pricing)
+    group_units = {}
+    for group, groups in zip(
+        GROUPINGS,
+        group_cells(store, list(GROUPINGS.values()), costs, aggregated["date_label"]),
+    ):
+        group_units[group] = defaultdict(
+            int, {key: cell[5] for key, cell in groups.items()}
+        )
+    total_units = sum(group_units["by_model"].values())
+
+    for group, units in group_units.items():
+        for group_key, data in aggregated[group].items():
+            data["cost"] = units[group_key] / COST_SCALE
+    aggregated["total"]["cost"] = total_units / COST_SCALE
+    # Exact costs, kept so apply_delta() can update them
+    aggregated["units"] = group_units
+    aggregated["total_units"] = total_units
+    aggregated["unpriced"] = unpriced_models(aggregated, pricing)
+
+    return aggregated
+
+
+def add_grouping(aggregated, group, dims, pricing=None):
+    """Keep one more grouping by ``dims`` resident in an aggregate.
+
+    The grouping is summed, and priced, once and stored as
+    ``aggregated[group]`` like the GROUPINGS; its key function joins
+    ``aggregated["groupings"]``, so apply_delta() keeps it up to date by
+    touching only the groups a delta changes.
+    """
+    store = aggregated["store"]
+    costs = price_cells(store, pricing) if pricing else None
+    date_label = aggregated.get("date_label")
+    (groups,) = group_cells(store, [dims], costs, date_label)
+    rows = aggregated[group] = defaultdict(new_totals)
+    for group_key_value, cell in groups.items():
+        data = rows[group_key_value]
+        add_cell(data, cell)
+        data["cost"] = cell[5] / COST_SCALE
+    if costs is not None:
+        aggregated["units"][group] = defaultdict(
+            int, {key: cell[5] for key, cell in groups.items()}
+        )
+    aggregated["groupings"][group] = make_group_key(dims, date_label)
+    return aggregated
+
+
+def parse_group_by(value):
+    """argparse type for --group-by: a comma-separated list of GROUP_DIMS."""
+    dims = tuple(dim.strip().lower() for dim in value.split(","))
+    for dim in dims:
+        if dim not in GROUP_DIMS:
+            raise argparse.ArgumentTypeError(
+                f"unknown dimension {dim!r} (choose from {', '.join(GROUP_DIMS)})"
+            )
+    if len(set(dims)) != len(dims):
+        raise argparse.ArgumentTypeError(f"repeated dimension in {value!r}")
+    return dims
+
+
+# --sort metrics of a group_cells() cell
+SORT_METRICS = {
+    "cost": itemgetter(5),
+    "tokens": lambda cell: cell[0] + cell[1] + cell[2] + cell[3],
+    "messages": itemgetter(4),
+}
+
+
+def group_table(aggregated, dims, pricing=None, top=None, sort=None):
+    """Group an aggregate's cells by ``dims`` for --group-by.
+
+    Returns ``(key, totals)`` pairs, where ``totals`` is laid out like
+    new_totals().  Without ``sort`` the groups come in key order; with it,
+    largest first by that SORT_METRICS entry.  ``top`` keeps only the first
+    groups, picked with a heap of that size rather than a full sort.
+    """
+    store = aggregated["store"]
+    costs = price_cells(store, pricing) if pricing else None
+    (groups,) = group_cells(store, [dims], costs, aggregated.get("date_label"))
+    if top is not None and sort is None:
+        sort = "tokens"
+    if sort is None:
+        # Keys may mix None (a missing session or branch) with strings
+        def key_order(item):
+            key = item[0] if len(dims) > 1 else (item[0],)
+            return tuple("" if value is None else str(value) for value in key)
+
+        rows = sorted(groups.items(), key=key_order)
+    elif top is None:
+        metric = SORT_METRICS[sort]
+        rows = sorted(groups.items(), key=lambda item: metric(item[1]), reverse=True)
+    else:
+        metric = SORT_METRICS[sort]
+        rows = heapq.nlargest(top, groups.items(), key=lambda item: metric(item[1]))
+
+    table = []
+    for key, cell in rows:
+        totals = dict(zip(USAGE_COLUMNS, cell))
+        totals["cost"] = cell[5] / COST_SCALE
+        table.append((key if len(dims) > 1 else (key,), totals))
+    return table
+
+
+def session_table(aggregated, pricing=None, top=None, sort="cost"):
+    """Summarise the sessions of an aggregate for --sessions.
+
+    A single group_cells() pass by (session, project, model) gives every
+    session's counters, cost, project and model mix; the span comes from
+    ``aggregated["spans"]``.  Sessions are ordered largest first by the
+    ``sort`` metric (see SORT_METRICS), and ``top`` keeps only the first,
+    picked with a heap of that size.  Records without a sessionId are left
+    out.
+    """
+    store = aggregated["store"]
+    costs = price_cells(store, pricing) if pricing else None
+    (groups,) = group_cells(store, [("session", "project", "model")], costs)
+    # session -> [counters, project, {model: tokens}]
+    sessions = {}
+    for (session, project, model), cell in groups.items():
+        if session is None:
+            continue
+        entry = sessions.get(session)
+        if entry is None:
+            entry = sessions[session] = [[0] * len(cell), project, {}]
+        for position, value in enumerate(cell):
+            entry[0][position] += value
+        models = entry[2]
+        models[model] = models.get(model, 0) + cell[0] + cell[1] + cell[2] + cell[3]
+
+    metric = SORT_METRICS[sort]
+    if top is None:
+        ranked = sorted(
+            sessions.items(), key=lambda item: metric(item[1][0]), reverse=True
+        )
+    else:
+        ranked = heapq.nlargest(
+            top, sessions.items(), key=lambda item: metric(item[1][0])
+        )
+
+    spans = aggregated.get("spans", {})
+    table = []
+    for session, (cell, project, models) in ranked:
+        first, last = spans.get(session, (None, None))
+        duration = None
+        if first is not None:
+            duration = (
+                datetime.strptime(last, "%Y-%m-%dT%H:%M:%S.%fZ")
+                - datetime.strptime(first, "%Y-%m-%dT%H:%M:%S.%fZ")
+            ).total_seconds()
+        looked_up = cell[0] + cell[3]
+        row = {"session": session, "project": project, "start": first, "end": last}
+        row["duration"] = duration
+        row.update(zip(USAGE_COLUMNS, cell))
+        row["tokens"] = cell[0] + cell[1] + cell[2] + cell[3]
+        row["cost"] = cell[5] / COST_SCALE
+        # Share of the prompt served from the cache
+        row["cache_hit_ratio"] = cell[3] / looked_up if looked_up else None
+        row["models"] = dict(sorted(models.items(), key=itemgetter(1), reverse=True))
+        table.append(row)
+    return table
+
+
+def track_windows(recent, pricing=None, now=None):
+    """Return a UsageWindow holding merge_recent() entries, as of ``now``."""
+    window = UsageWindow(now)
+    for entry in recent.values():
+        window.add(entry, pricing)
+    return window
+
+
+def unpriced_models(aggregated, pricing):
+    """Return the reported models that ``pricing`` cannot price, sorted."""
+    return sorted(
+        str(model) for model in aggregated["by_model"] if pricing.resolve(model) is None
+    )
+
+
+def apply_delta(aggregated, delta, pricing=None):
+    """Fold a delta UsageStore (see fold_partial()) into a rolled-up aggregate.
+
+    Only the delta's cells are visited and priced, so the cost of an update
+    does not grow with the history.  Groups left without messages are
+    dropped, as a full roll-up would not list them.
+    """
+    costs = price_cells(delta, pricing) if pricing else None
+    units = aggregated.get("units")
+    total = aggregated["total"]
+    sessions = aggregated["sessions"]
+    for row in range(len(delta)):
+        key = delta.key(row)
+        cell = [column[row] for column in delta.columns]
+        for group, key_of in aggregated["groupings"].items():
+            group_key = key_of(key)
+            data = aggregated[group][group_key]
+            add_cell(data, cell)
+            if costs is not None:
+                units[group][group_key] += costs[row]
+                data["cost"] = units[group][group_key] / COST_SCALE
+            else:
+                data["cost"] = 0.0
+            if not data["messages"]:
+                del aggregated[group][group_key]
+        add_cell(total, cell)
+        if costs is not None:
+            aggregated["total_units"] += costs[row]
+            total["cost"] = aggregated["total_units"] / COST_SCALE
+
+        session = key[CELL_DIMS.index("session")]
+        if session not in (None, ""):
+            if session in aggregated["by_session"]:
+                sessions.add(session)
+            else:
+                sessions.discard(session)
+    if costs is not None:
+        aggregated["unpriced"] = unpriced_models(aggregated, pricing)
+
+
+def new_totals():
+    """Return an empty counter block for one report row."""
+    return {
+        "input": 0,
+        "output": 0,
+        "cache_write": 0,
+        "cache_read": 0,
+        "messages": 0,
+    }
+
+
+def add_cell(totals, cell):
+    """Add a ``[input, output, cache_write, cache_read, messages]`` cell to a row."""
+    totals["input"] += cell[0]
+    totals["output"] += cell[1]
+    totals["cache_write"] += cell[2]
+    totals["cache_read"] += cell[3]
+    totals["messages"] += cell[4]
+
+
+def aggregate_stats(all_stats, dedup=None, timer=None, date_label=None, cells=None):
+    """Aggregate statistics from multiple files with global requestId deduplication.
+
+    ``all_stats`` may be any iterable of per-file partials (typically the
+    generator returned by analyze_files()); each one is folded in and dropped,
+    so only the merged UsageStore and the ``dedup`` index (a DedupIndex,
+    first-wins by default) are held.  When the same requestId appears in
+    several files the index's policy decides which copy stays counted.
+    ``timer`` (a PipelineTimer) times the dedup and rollup phases, and
+    ``date_label`` is passed on to rollup_store().  ``cells``, when given,
+    maps the merged UsageStore to the one that is rolled up.
+    """
+    if dedup is None:
+        dedup = DedupIndex()
+    if timer is None:
+        timer = PipelineTimer(enabled=False)
+    merged = new_file_stats()
+    scan = dict.fromkeys(("files",) + SCAN_COUNTERS, 0)
+    file_duplicates = 0
+
+    for stats in all_stats:
+        scan["files"] += 1
+        for counter in SCAN_COUNTERS:
+            scan[counter] += stats[counter]
+        file_duplicates += stats["duplicates"]
+        with timer.phase("dedup"):
+            rejected = fold_partial(merged["store"], stats, dedup)
+            merge_recent(merged["recent"], stats, rejected)
+        merge_spans(merged["spans"], stats["spans"])
+
+    with timer.phase("rollup"):
+        store = merged["store"] if cells is None else cells(merged["store"])
+        aggregated = rollup_store(store, date_label)
+    aggregated["spans"] = merged["spans"]
+    aggregated["recent"] = merged["recent"]
+    aggregated["scan"] = scan
+    aggregated["dedup"] = {
+        "policy": dedup.policy,
+        "requests": len(dedup),
+        "duplicates": file_duplicates + dedup.duplicates,
+        "replaced": dedup.replaced,
+        "spilled": dedup.spilled,
+    }
+    return aggregated
+
+
+def fold_partial(store, stats, dedup, delta=None):
+    """Merge a per-file partial into the global ``store`` through ``dedup``.
+
+    When ``delta`` (a UsageStore) is given, every change made to ``store`` is
+    mirrored into it, so callers can update derived totals without rolling up
+    the whole store again (see apply_delta()).  Returns the keys of the
+    partial's requests whose copy was not counted.
+    """
+    row_map = store.merge(stats["store"])
+    if delta is not None:
+        delta.merge(stats["store"])
+
+    def take_back(row, tokens):
+        if row == EXCLUDED_ROW:
+            return
+        store.add(row, *(-t for t in tokens), messages=-1)
+        if delta is not None:
+            delta.add(delta.row(*store.key(row)), *(-t for t in tokens), messages=-1)
+
+    rejected = set()
+    for key, (row, *tokens) in stats["requests"].items():
+        if row != EXCLUDED_ROW:
+            row = row_map[row]
+        counted, displaced = dedup.offer(key, (row, *tokens))
+        if not counted:
+            take_back(row, tokens)
+            rejected.add(key)
+        if displaced is not None:
+            take_back(displaced[0], displaced[1:])
+    return rejected
+
+
+def relabel_partial(stats, filters=None, bucketer=None, project=None):
+    """Return an hourly partial relabelled by ``bucketer`` and filtered.
+
+    Scans parse logs into hourly cells (see scan_command()), so one cached
+    partial serves every report.  Cells that do not match ``filters`` are
+    dropped, as relabel_store() drops them; their requests keep taking part
+    in deduplication under EXCLUDED_ROW, and their recent requests are left
+    out.  Recent records without a requestId are checked on their own, as
+    records of ``project``.  ``stats`` itself is not changed, so it can stay
+    in the scan index.
+    """
+    bucketer = bucketer or get_bucketer()
+    if not filters and bucketer.granularity == "hour":
+        return stats
+    store = stats["store"]
+    relabelled = dict(stats, store=UsageStore())
+    target = relabelled["store"]
+    row_map = []
+    for row in range(len(store)):
+        hour, model, cell_project, *dims = store.key(row)
+        if not cell_matches(filters, model, cell_project, hour):
+            row_map.append(EXCLUDED_ROW)
+            continue
+        new_row = target.row(bucketer.label(hour), model, cell_project, *dims)
+        target.add(new_row, *(column[row] for column in store.columns))
+        row_map.append(new_row)
+    relabelled["requests"] = {
+        key: (row if row == EXCLUDED_ROW else row_map[row], *tokens)
+        for key, (row, *tokens) in stats["requests"].items()
+    }
+    if filters:
+        requests = relabelled["requests"]
+        recent = {}
+        for key, entry in stats["recent"].items():
+            contribution = requests.get(key)
+            if contribution is not None:
+                if contribution[0] == EXCLUDED_ROW:
+                    continue
+            elif not cell_matches(
+                filters, entry[5], project, bucketer.hour(entry[0])
+            ):
+                continue
+            recent[key] = entry
+        relabelled["recent"] = recent
+    return relabelled
+
+
+def rollup_store(store, date_label=None):
+    """Roll the cells of a UsageStore up into the report groupings.
+
+    ``date_label`` relabels hourly cells for the date groupings (see
+    make_group_key()); it is kept in ``aggregated["date_label"]`` for
+    costing, and the key functions in ``aggregated["groupings"]`` for
+    incremental updates.
+    """
+    key_functions = {
+        group: make_group_key(dims, date_label) for group, dims in GROUPINGS.items()
+    }
+    aggregated = {"groupings": key_functions, "store": store, "date_label": date_label}
+    aggregated["total"] = new_totals()
+    aggregated["sessions"] = store.distinct("session") - {None, ""}
+
+    groupings = group_cells(store, list(GROUPINGS.values()), date_label=date_label)
+    for group, groups in zip(GROUPINGS, groupings):
+        rows = aggregated[group] = defaultdict(new_totals)
+        for group_key_value, cell in groups.items():
+            data = rows[group_key_value]
+            add_cell(data, cell)
+            data["cost"] = 0.0
+    # Every cell is in exactly one group of a grouping
+    for data in aggregated["by_model"].values():
+        add_cell(aggregated["total"], [data[column] for column in USAGE_COLUMNS])
+    aggregated["total"]["cost"] = 0.0
+
+    return aggregated
+
+
+# Number of files listed as the slowest to parse by --stats
+SLOWEST_FILES = 10
+
+
+class PipelineTimer:
+    """Wall and CPU time per pipeline phase, plus the slowest files, for --stats.
+
+    Phases are reported in the order they are first timed; ``parent.child``
+    phases are part of ``parent`` (see PARSE_PHASES).  With --jobs, parsing
+    happens in worker processes and its times are the workers' summed time.
+    A disabled timer records nothing.
+    """
+
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+        self.phases = {}
+        # Min-heap of (wall, path, bytes) for the slowest files
+        self.slowest = []
+        self.started = time.perf_counter()
+        self.cpu_started = time.process_time()
+
+    def add(self, phase, wall, cpu=0.0):
+        """Add time to ``phase``."""
+        total = self.phases.setdefault(phase, [0.0, 0.0])
+        total[0] += wall
+        total[1] += cpu
+
+    @contextmanager
+    def phase(self, name):
+        """Time the body of a ``with`` block as ``name``."""
+        if not self.enabled:
+            yield
+            return
+        started = time.perf_counter()
+        cpu_started = time.process_time()
+        try:
+            yield
+        finally:
+            self.add(
+                name,
+                time.perf_counter() - started,
+                time.process_time() - cpu_started,
+            )
+
+    def iterate(self, iterable, name):
+        """Iterate over ``iterable``, timing the production of every item."""
+        if not self.enabled:
+            yield from iterable
+            return
+        iterator = iter(iterable)
+        while True:
+            with self.phase(name):
+                item = next(iterator, self)
+            if item is self:
+                return
+            yield item
+
+    def add_file(self, file_path, stats):
+        """Take over a parsed file's timings (see analyze_jsonl_file())."""
+        timings = stats.get("timings")
+        if not self.enabled or not timings:
+            return
+        for phase, (wall, cpu) in timings.items():
+            self.add(phase, wall, cpu)
+        entry = (timings["parse"][0], str(file_path), stats["bytes"])
+        if len(self.slowest) < SLOWEST_FILES:
+            heapq.heappush(self.slowest, entry)
+        else:
+            heapq.heappushpop(self.slowest, entry)
+
+    def summary(self, aggregated=None):
+        """Return the timings and the run's counters as a JSON-ready dict."""
+        result = {
+            "wall": time.perf_counter() - self.started,
+            "cpu": time.process_time() - self.cpu_started,
+            # Sub-phases are only timed by wall clock
+            "phases": {
+                phase: {"wall": wall} if "." in phase else {"wall": wall, "cpu": cpu}
+                for phase, (wall, cpu) in self.phases.items()
+            },
+            "slowest_files": [
+                {"path": path, "seconds": wall, "bytes": size}
+                for wall, path, size in sorted(self.slowest, reverse=True)
+            ],
+        }
+        scan = (aggregated or {}).get("scan")
+        if scan:
+            dedup = aggregated["dedup"]
+            result["counters"] = {
+                "files": scan["files"],
+                "bytes_read": scan["bytes"],
+                "lines_seen": scan["lines"],
+                "lines_prefiltered": scan["lines"] - scan["decoded"],
+                "lines_decoded": scan["decoded"],
+                "decode_errors": scan["undecodable"],
+                "malformed_timestamps": scan["malformed"],
+                "requests": dedup["requests"],
+                "dedup_hits": dedup["duplicates"],
+                "dedup_replaced": dedup["replaced"],
+            }
+        return result
+
+
+def cell_matches(filters, model, project, hour):
+    """Return whether a cell of ``hour`` (see TimeBucketer.hour()) passes ``filters``."""
+    if not filters:
+        return True
+    if filters["model"] and filters["model"] not in str(model).lower():
+        return False
+    if filters["project"] and filters["project"] not in str(project).lower():
+        return False
+    if filters["since"] or filters["until"]:
+        return hour != "unknown" and in_bounds(filters, hour)
+    return True
@@ -0,0 +1,337 @@
+"""Per-request export of deduplicated records (--export)."""
+
+import csv
+import json
+import os
+import sys
+import time
+from array import array
+
+from .core import (
+    COST_SCALE,
+    SCAN_COUNTERS,
+    DedupIndex,
+    analyze_jsonl_file,
+    analyze_opencode,
+    opencode_sessions,
+    project_name,
+    resolve_claude_dir,
+    scan_claude_projects,
+    span_timestamp,
+)
+from .report import format_number, print_pipeline_stats, print_scan_rate
+
+
+# Formats --export writes records in
+EXPORT_FORMATS = ("csv", "ndjson")
+
+# Fields of every record written by --export
+EXPORT_COLUMNS = (
+    "timestamp",
+    "session",
+    "project",
+    "model",
+    "input",
+    "output",
+    "cache_write",
+    "cache_read",
+    "cost",
+)
+
+# Output --export buffers between writes, in bytes
+EXPORT_BUFFER = 1024 * 1024
+
+
+class RecordWriter:
+    """Write usage records as CSV or NDJSON rows as they are parsed, for --export.
+
+    An instance is the ``sink`` of record_counter().  Records are numbered in
+    the order they arrive.  With a ``dedup`` index, under the ``first``
+    policy, a request is written when it is first seen and its later copies
+    are dropped; otherwise ``displaced`` holds the sorted numbers of the
+    copies that lose to another (see DisplacedCopies) and the others are
+    written.  Records without a requestId are always written, and requests
+    whose kept copy fails the filters never are.
+
+    Timestamps are written in UTC, as ``YYYY-MM-DDTHH:MM:SS.sssZ``, and
+    costs in dollars, priced on the record's day in the report's time zone;
+    both are empty (``null``) when unknown.  The parsers report exceptions
+    per file and move on, so a failed write is kept in ``error`` instead of
+    being raised, and later records are dropped.
+    """
+
+    def __init__(self, out, export_format, pricing=None, dedup=None, displaced=None):
+        self.pricing = pricing
+        self.dedup = dedup
+        self.displaced = displaced
+        self.ordinal = 0
+        self._next_displaced = 0
+        self.written = 0
+        self.skipped = 0
+        self.error = None
+        if export_format == "csv":
+            self._write = csv.writer(out).writerow
+            self._write(EXPORT_COLUMNS)
+        else:
+            encode = json.JSONEncoder(separators=(",", ":")).encode
+
+            def write(row):
+                out.write(encode(dict(zip(EXPORT_COLUMNS, row))) + "\n")
+
+            self._write = write
+
+    def __call__(
+        self,
+        key,
+        hour,
+        timestamp_str,
+        model,
+        project,
+        session_id,
+        branch,
+        cwd,
+        input_tokens,
+        output_tokens,
+        cache_write_tokens,
+        cache_read_tokens,
+        matched=True,
+    ):
+        ordinal = self.ordinal
+        self.ordinal += 1
+        if self.error is not None:
+            return
+        if key is not None:
+            if self.dedup is not None:
+                if not self.dedup.offer(key, ())[0]:
+                    self.skipped += 1
+                    return
+            elif self.displaced is not None:
+                # Records arrive in order, so the displaced ones are walked once
+                displaced = self.displaced
+                position = self._next_displaced
+                while position < len(displaced) and displaced[position] < ordinal:
+                    position += 1
+                self._next_displaced = position
+                if position < len(displaced) and displaced[position] == ordinal:
+                    self.skipped += 1
+                    return
+        if not matched:
+            return
+
+        cost = None
+        if self.pricing and self.pricing.resolve(model) is not None:
+            input_price, output_price, cache_write_price, cache_read_price = (
+                self.pricing.prices(model, hour[:10] if hour is not None else None)
+            )
+            cost = (
+                input_tokens * input_price
+                + output_tokens * output_price
+                + cache_write_tokens * cache_write_price
+                + cache_read_tokens * cache_read_price
+            ) / COST_SCALE
+        try:
+            self._write(
+                (
+                    span_timestamp(timestamp_str) if hour is not None else None,
+                    session_id,
+                    project,
+                    model,
+                    input_tokens,
+                    output_tokens,
+                    cache_write_tokens,
+                    cache_read_tokens,
+                    cost,
+                )
+            )
+        except OSError as e:
+            self.error = e
+            return
+        self.written += 1
+
+
+class DisplacedCopies:
+    """record_counter() sink finding the copies of requests that lose, for --export.
+
+    Records are numbered like RecordWriter numbers them.  Every request is
+    offered to ``dedup``, and ``numbers`` collects the number of every copy
+    that is not, or stops being, the counted one under its policy.
+    """
+
+    def __init__(self, dedup):
+        self.dedup = dedup
+        self.ordinal = 0
+        self.numbers = array("q")
+
+    def __call__(
+        self,
+        key,
+        hour,
+        timestamp_str,
+        model,
+        project,
+        session_id,
+        branch,
+        cwd,
+        *tokens_matched,
+    ):
+        ordinal = self.ordinal
+        self.ordinal += 1
+        if key is None:
+            return
+        # The record's number stands in for the cell row of a contribution
+        counted, old = self.dedup.offer(key, (ordinal, *tokens_matched[:4]))
+        if not counted:
+            self.numbers.append(ordinal)
+        elif old is not None:
+            self.numbers.append(old[0])
+
+
+def export_records(args, pricing=None):
+    """Write every deduplicated usage record to stdout, for --export.
+
+    Records go out through a RecordWriter as the logs are parsed, with an
+    EXPORT_BUFFER output buffer, so nothing per record is kept beyond the
+    requestId dedup state.  Under ``first`` the first copy of a request is
+    the counted one and one pass suffices.  ``last`` and ``max`` parse the
+    logs once to find the copies that lose (see DisplacedCopies), then
+    write the others while parsing the same lines again.  opencode messages
+    are unique by id and are written as they are read.  Returns the exit
+    status.
+    """
+    claude_dir = resolve_claude_dir(args.claude_dir)
+    timer = args.timer
+    options = {
+        "decoder": args.decoder,
+        "reader": args.reader,
+        "policy": args.dedup,
+        "filters": args.filters,
+        "tz": args.tz,
+        "profile": timer.enabled,
+    }
+
+    jsonl_files = []
+    if "claude" in args.sources:
+        print("Scanning Claude conversation logs...", file=sys.stderr)
+        walk = scan_claude_projects(claude_dir, args.filters, policy=args.dedup)
+        jsonl_files = list(timer.iterate(walk, "discover"))
+        print(f"Found {len(jsonl_files)} conversation files.", file=sys.stderr)
+    scan = dict.fromkeys(("files",) + SCAN_COUNTERS, 0)
+
+    def parsed(file_path, stats):
+        timer.add_file(file_path, stats)
+        scan["files"] += 1
+        for counter in SCAN_COUNTERS:
+            scan[counter] += stats[counter]
+        return stats
+
+    started = time.perf_counter()
+    dedup = DedupIndex(args.dedup, args.dedup_memory, args.dedup_spill)
+    # Per file: the number of its first record and the offset it was read to
+    firsts = []
+    ends = []
+    displaced = None
+    sys.stdout.flush()
+    out = open(
+        sys.stdout.fileno(),
+        "w",
+        encoding="utf-8",
+        newline="",
+        buffering=EXPORT_BUFFER,
+        closefd=False,
+    )
+    try:
+        if args.dedup != "first" and jsonl_files:
+            print(f"Finding the {args.dedup} copy of every request...", file=sys.stderr)
+            copies = DisplacedCopies(dedup)
+            for file_path in jsonl_files:
+                # The second pass restarts every file's numbering here, so a
+                # file read differently cannot shift the files that follow
+                firsts.append(copies.ordinal)
+                stats = analyze_jsonl_file(
+                    file_path,
+                    project=project_name(file_path, claude_dir),
+                    sink=copies,
+                    **options,
+                )
+                ends.append(parsed(file_path, stats)["offset"])
+            displaced = array("q", sorted(copies.numbers))
+
+        writer = RecordWriter(
+            out,
+            args.export,
+            pricing,
+            dedup=dedup if displaced is None else None,
+            displaced=displaced,
+        )
+        for file_number, file_path in enumerate(jsonl_files):
+            end = None
+            if firsts:
+                writer.ordinal = firsts[file_number]
+                end = ends[file_number]
+            stats = analyze_jsonl_file(
+                file_path,
+                0,
+                end,
+                project=project_name(file_path, claude_dir),
+                sink=writer,
+                **options,
+            )
+            parsed(file_path, stats)
+            if writer.error is not None:
+                break
+
+        if "opencode" in args.sources and writer.error is None:
+            print("Scanning opencode sessions...", file=sys.stderr)
+            writer.dedup = writer.displaced = None
+            sessions = opencode_sessions(args.opencode_dir, args.filters)
+            for session_dir, stats in analyze_opencode(
+                timer.iterate(sessions, "discover"), options=dict(options, sink=writer)
+            ):
+                parsed(session_dir, stats)
+                if writer.error is not None:
+                    break
+        with timer.phase("write"):
+            try:
+                out.flush()
+            except OSError as e:
+                writer.error = e
+    finally:
+        dedup.close()
+
+    if writer.error is not None:
+        if isinstance(writer.error, BrokenPipeError):
+            # The reader went away, as with ``| head``; drop what is left
+            os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+        else:
+            print(f"Cannot write records: {writer.error}", file=sys.stderr)
+        return 1
+    print_scan_rate(
+        dict(scan, malformed=0),
+        time.perf_counter() - started,
+        f"{args.decoder}, {args.reader} reader",
+    )
+    if scan["malformed"]:
+        print(
+            f"{format_number(scan['malformed'])} records had a malformed "
+            "timestamp and were written without one",
+            file=sys.stderr,
+        )
+    print(
+        f"Exported {format_number(writer.written)} records as {args.export} "
+        f"({format_number(writer.skipped)} duplicate copies skipped, "
+        f"policy: {args.dedup})",
+        file=sys.stderr,
+    )
+    if args.stats:
+        print_pipeline_stats(
+            timer,
+            {
+                "scan": scan,
+                "dedup": {
+                    "requests": len(dedup),
+                    "duplicates": writer.skipped,
+                    "replaced": dedup.replaced,
+                },
+            },
+        )
+    return 0
@@ -0,0 +1,645 @@
+"""The SQLite database of requests and hourly cells (ingest, query)."""
+
+import argparse
+import os
+import sqlite3
+import sys
+import time
+from datetime import date, datetime, timedelta, timezone
+from pathlib import Path
+
+from .core import (
+    SCAN_COUNTERS,
+    PipelineTimer,
+    UsageStore,
+    analyze_files,
+    analyze_opencode,
+    default_index_path,
+    get_bucketer,
+    in_bounds,
+    merge_spans,
+    opencode_sessions,
+    replaces,
+    resolve_claude_dir,
+    rollup_store,
+    scan_claude_projects,
+    span_timestamp,
+    window_cutoff,
+)
+from .report import format_number, print_pipeline_stats, print_scan_rate
+
+
+def query_requests(conn, columns, where=(), filters=None, bucketer=None):
+    """Yield ``(timestamp, *columns)`` for the stored requests.
+
+    Requests are restricted by ``filters`` like query_store(), with
+    --since/--until checked against the hours of ``bucketer``'s time zone,
+    and timestamps are normalised by span_timestamp(); requests without a
+    usable timestamp are skipped.
+    """
+    filters = filters or {}
+    bucketer = bucketer or get_bucketer()
+    bounded = filters.get("since") or filters.get("until")
+    where = ["hour != 'unknown'", *where]
+    params = []
+    for dim in ("model", "project"):
+        if filters.get(dim):
+            where.append(f"instr(lower({dim}), ?) > 0")
+            params.append(filters[dim])
+
+    for timestamp, *values in conn.execute(
+        f"SELECT timestamp, {', '.join(columns)} FROM requests "
+        f"WHERE {' AND '.join(where)}",
+        params,
+    ):
+        timestamp = span_timestamp(timestamp)
+        if timestamp is None:
+            continue
+        if bounded and not in_bounds(filters, bucketer.hour(timestamp)):
+            continue
+        yield timestamp, *values
+
+
+def query_spans(conn, filters=None, bucketer=None):
+    """Return the ``[first, last]`` span of each session in the database.
+
+    Only the counted copy of each request is stored, so a span can be
+    narrower than a scan's when copies were logged at other times.
+    """
+    spans = {}
+    for timestamp, session in query_requests(
+        conn, ["session"], ["session != ''"], filters, bucketer
+    ):
+        merge_spans(spans, {session: (timestamp, timestamp)})
+    return spans
+
+
+def query_recent(conn, filters=None, bucketer=None):
+    """Return the requests of the last WINDOW_HISTORY minutes (see merge_recent())."""
+    cutoff = window_cutoff()
+    recent = {}
+    for timestamp, key, *entry in query_requests(
+        conn,
+        ["key", "input", "output", "cache_write", "cache_read", "model"],
+        # Stored hours are UTC, like the cutoff
+        [f"hour >= '{cutoff[:13]}'"],
+        filters,
+        bucketer,
+    ):
+        if timestamp >= cutoff:
+            recent[key] = (timestamp, *entry)
+    return recent
+
+
+DB_VERSION = 2
+
+DB_SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (
+    name TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT PRIMARY KEY,
+    inode INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    mtime INTEGER NOT NULL,
+    offset INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS requests (
+    key INTEGER PRIMARY KEY,
+    timestamp TEXT,
+    hour TEXT NOT NULL,
+    model TEXT NOT NULL,
+    project TEXT NOT NULL,
+    session TEXT NOT NULL,
+    branch TEXT NOT NULL,
+    cwd TEXT NOT NULL,
+    input INTEGER NOT NULL,
+    output INTEGER NOT NULL,
+    cache_write INTEGER NOT NULL,
+    cache_read INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS hourly (
+    hour TEXT NOT NULL,
+    model TEXT NOT NULL,
+    project TEXT NOT NULL,
+    session TEXT NOT NULL,
+    branch TEXT NOT NULL,
+    cwd TEXT NOT NULL,
+    input INTEGER NOT NULL,
+    output INTEGER NOT NULL,
+    cache_write INTEGER NOT NULL,
+    cache_read INTEGER NOT NULL,
+    messages INTEGER NOT NULL,
+    PRIMARY KEY (hour, model, project, session, branch, cwd)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS daily (
+    date TEXT NOT NULL,
+    model TEXT NOT NULL,
+    project TEXT NOT NULL,
+    session TEXT NOT NULL,
+    branch TEXT NOT NULL,
+    cwd TEXT NOT NULL,
+    input INTEGER NOT NULL,
+    output INTEGER NOT NULL,
+    cache_write INTEGER NOT NULL,
+    cache_read INTEGER NOT NULL,
+    messages INTEGER NOT NULL,
+    PRIMARY KEY (date, model, project, session, branch, cwd)
+) WITHOUT ROWID;
+"""
+
+# Secondary indexes of the requests table, named requests_<column>
+DB_INDEXED_COLUMNS = ("timestamp", "model", "session", "project")
+
+# Request keys looked up per SQL statement during ingest
+DB_LOOKUP_BATCH = 500
+
+# Stored requests per ingest transaction; a file's offset is always committed
+# together with its requests, so a batch boundary is a safe resume point
+DB_COMMIT_REQUESTS = 50000
+
+# SQLite page cache for ingest, in KiB; request keys are random hashes, so a
+# small cache turns every insert into page I/O
+DB_CACHE_KIB = 65536
+
+
+def default_db_path():
+    """Return the default location of the rollup database."""
+    return default_index_path().with_name("usage.sqlite")
+
+
+def open_db(db_path, policy=None, readonly=False):
+    """Open the rollup database, creating it if needed.
+
+    The dedup policy is fixed when the database is created, since the stored
+    requests were resolved with it; passing a different ``policy`` raises
+    ValueError.  A ``readonly`` connection expects an existing database.
+    """
+    db_path = Path(db_path)
+    if readonly:
+        conn = sqlite3.connect(f"{db_path.resolve().as_uri()}?mode=ro", uri=True)
+    else:
+        db_path.parent.mkdir(parents=True, exist_ok=True)
+        conn = sqlite3.connect(db_path)
+        # Ingest commits often; WAL keeps those commits cheap while never
+        # exposing a half-ingested file
+        conn.execute("PRAGMA journal_mode = WAL")
+        conn.execute("PRAGMA synchronous = NORMAL")
+        conn.execute(f"PRAGMA cache_size = -{DB_CACHE_KIB}")
+        conn.executescript(DB_SCHEMA)
+        create_db_indexes(conn)
+    meta = dict(conn.execute("SELECT name, value FROM meta"))
+    if not meta and not readonly:
+        conn.executemany(
+            "INSERT INTO meta VALUES (?, ?)",
+            [("version", str(DB_VERSION)), ("policy", policy or "first")],
+        )
+        conn.commit()
+        meta = dict(conn.execute("SELECT name, value FROM meta"))
+    if meta.get("version") != str(DB_VERSION):
+        conn.close()
+        raise ValueError(
+            f"unsupported database version {meta.get('version')}; "
+            "remove it and run ingest again"
+        )
+    if policy is not None and meta.get("policy") != policy:
+        conn.close()
+        raise ValueError(
+            f"database was ingested with --dedup {meta.get('policy')}, not {policy}"
+        )
+    return conn
+
+
+def create_db_indexes(conn):
+    """Create any missing secondary index of the requests table."""
+    for column in DB_INDEXED_COLUMNS:
+        conn.execute(
+            f"CREATE INDEX IF NOT EXISTS requests_{column} ON requests ({column})"
+        )
+
+
+def bucket_date(hour):
+    """Return the daily bucket of an hourly one."""
+    return hour if hour == "unknown" else hour[:10]
+
+
+def ingest_partial(conn, stats, policy="first"):
+    """Store the requests of a partial and fold them into the rollups.
+
+    Requests already in the database are resolved by ``policy`` (see
+    replaces()); a displaced copy is taken back out of the rollups before
+    the new one is added, so re-reading a file never double counts.  Returns
+    ``(new_requests, duplicates, replaced)``.  The caller commits.  Hours are
+    stored in UTC; query_store() converts them to the report's time zone.
+    """
+    store = stats["store"]
+    times = stats.get("timestamps", {})
+    bucketer = get_bucketer("UTC", "hour")
+    keys = list(stats["requests"])
+    existing = {}
+    for start in range(0, len(keys), DB_LOOKUP_BATCH):
+        batch = keys[start : start + DB_LOOKUP_BATCH]
+        placeholders = ",".join("?" * len(batch))
+        for key, *old in conn.execute(
+            "SELECT key, hour, model, project, session, branch, cwd, input, "
+            "output, cache_write, cache_read FROM requests "
+            f"WHERE key IN ({placeholders})",
+            batch,
+        ):
+            existing[key] = old
+
+    # Rollup deltas, keyed like the hourly table
+    hourly = UsageStore()
+    cell_keys = {}
+    writes = []
+    new_requests = 0
+    duplicates = stats["duplicates"]
+    replaced = 0
+    for key, (row, *tokens) in stats["requests"].items():
+        cell_key = cell_keys.get(row)
+        if cell_key is None:
+            _, *dims = store.key(row)
+            cell_key = cell_keys[row] = tuple(
+                value if value is not None else "" for value in dims
+            )
+        timestamp = times.get(key)
+        hour = bucketer.hour(timestamp) or "unknown"
+        old = existing.get(key)
+        if old is None:
+            new_requests += 1
+        else:
+            duplicates += 1
+            if not replaces(policy, (None, *old[6:]), (None, *tokens)):
+                continue
+            replaced += 1
+            hourly.add(hourly.row(*old[:6]), *(-t for t in old[6:]), messages=-1)
+        writes.append((key, timestamp, hour, *cell_key, *tokens))
+        hourly.add(hourly.row(hour, *cell_key), *tokens)
+
+    # Inserting in key order keeps the primary key B-tree writes local
+    writes.sort()
+    conn.executemany(
+        "INSERT OR REPLACE INTO requests VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+        writes,
+    )
+    hourly_rows = hourly.to_rows()
+    daily = UsageStore()
+    for (
+        hour,
+        *cell_key,
+        input_tokens,
+        output,
+        cache_write,
+        cache_read,
+        messages,
+    ) in hourly_rows:
+        daily.add(
+            daily.row(bucket_date(hour), *cell_key),
+            input_tokens,
+            output,
+            cache_write,
+            cache_read,
+            messages,
+        )
+    for table, bucket, rows in (
+        ("hourly", "hour", hourly_rows),
+        ("daily", "date", daily.to_rows()),
+    ):
+        # The conflict target is spelled out for SQLite before 3.35
+        conn.executemany(
+            f"INSERT INTO {table} VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?) "
+            f"ON CONFLICT ({bucket}, model, project, session, branch, cwd) "
+            "DO UPDATE SET "
+            "input = input + excluded.input, "
+            "output = output + excluded.output, "
+            "cache_write = cache_write + excluded.cache_write, "
+            "cache_read = cache_read + excluded.cache_read, "
+            "messages = messages + excluded.messages",
+            rows,
+        )
+    return new_requests, duplicates, replaced
+
+
+def ingest_files(
+    conn,
+    jsonl_files,
+    jobs=1,
+    options=None,
+    claude_dir=None,
+    timer=None,
+    sessions=None,
+):
+    """Incrementally load log files into the rollup database.
+
+    Every file's parsed offset is committed in the same transaction as its
+    requests, so an interrupted ingest resumes where it stopped and running it again only
+    reads what was appended since.  Records stay in the database after their
+    log is truncated or deleted, and across runs ``first`` and ``last`` refer
+    to ingest order rather than file order.  Returns counters for the run.
+    ``timer`` (a PipelineTimer) receives the parse and store timings.
+
+    ``sessions`` (see opencode_sessions()) adds opencode's messages.  Their
+    files are tracked by mtime alone: a message is read again once its mtime
+    changes, and its new version replaces the stored one whatever the
+    policy, since opencode rewrites a message as its response grows.
+    """
+    options = dict(options or {}, timestamps=True)
+    if timer is None:
+        timer = PipelineTimer(enabled=False)
+    policy = options.get("policy", "first")
+    known = {
+        path: (inode, size, mtime, offset)
+        for path, inode, size, mtime, offset in conn.execute(
+            "SELECT path, inode, size, mtime, offset FROM files"
+        )
+    }
+
+    # Filling an empty table is much faster with the indexes built once at
+    # the end; if the run is interrupted, open_db() recreates them
+    bulk_load = conn.execute("SELECT 1 FROM requests LIMIT 1").fetchone() is None
+    if bulk_load:
+        for column in DB_INDEXED_COLUMNS:
+            conn.execute(f"DROP INDEX IF EXISTS requests_{column}")
+
+    pending = []
+    start_offsets = {}
+    summary = {
+        "files": 0,
+        "sessions": 0,
+        "unchanged": 0,
+        "requests": 0,
+        "duplicates": 0,
+        "replaced": 0,
+        "scan": dict.fromkeys(("files",) + SCAN_COUNTERS, 0),
+    }
+    for file_path in jsonl_files:
+        try:
+            st = os.stat(file_path)
+        except OSError:
+            continue
+        summary["files"] += 1
+        entry = known.get(str(file_path))
+        # Same resume rules as the scan index (see index_resume_point())
+        if entry and entry[0] == st.st_ino:
+            if entry[1] == st.st_size and entry[2] == st.st_mtime_ns:
+                summary["unchanged"] += 1
+                continue
+            if entry[1] < st.st_size:
+                start_offsets[str(file_path)] = entry[3]
+        pending.append((file_path, st))
+
+    partials = analyze_files(
+        [file_path for file_path, _ in pending],
+        jobs=jobs,
+        options=options,
+        claude_dir=claude_dir,
+        start_offsets=start_offsets,
+    )
+    uncommitted = 0
+
+    def store(file_path, stats, policy, file_rows):
+        nonlocal uncommitted
+        scan = summary["scan"]
+        scan["files"] += 1
+        for counter in SCAN_COUNTERS:
+            scan[counter] += stats[counter]
+        timer.add_file(file_path, stats)
+        if stats["error"] is not None:
+            return
+        with timer.phase("store"):
+            new_requests, duplicates, replaced = ingest_partial(conn, stats, policy)
+        summary["requests"] += new_requests
+        summary["duplicates"] += duplicates
+        summary["replaced"] += replaced
+        conn.executemany(
+            "INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?)", file_rows
+        )
+        uncommitted += len(stats["requests"])
+        if uncommitted >= DB_COMMIT_REQUESTS:
+            conn.commit()
+            uncommitted = 0
+
+    for (file_path, st), stats in zip(pending, partials):
+        store(
+            file_path,
+            stats,
+            policy,
+            [(str(file_path), st.st_ino, st.st_size, st.st_mtime_ns, stats["offset"])],
+        )
+
+    if sessions is not None:
+        known_mtimes = {path: entry[2] for path, entry in known.items()}
+        for session_dir, stats in analyze_opencode(
+            sessions, known=known_mtimes, options=options
+        ):
+            summary["sessions"] += 1
+            if not stats["lines"]:
+                summary["unchanged"] += 1
+                continue
+            file_rows = []
+            for name, mtime in stats["messages"].items():
+                path = os.path.join(session_dir, name)
+                if known_mtimes.get(path) != mtime:
+                    file_rows.append((path, 0, 0, mtime, 0))
+            store(session_dir, stats, "last", file_rows)
+
+    with timer.phase("store"):
+        if bulk_load:
+            create_db_indexes(conn)
+        conn.commit()
+    return summary
+
+
+def parse_bucket(value):
+    """argparse type for --since/--until: ``YYYY-MM-DD`` or ``YYYY-MM-DDTHH``."""
+    for fmt in ("%Y-%m-%d", "%Y-%m-%dT%H"):
+        try:
+            return datetime.strptime(value, fmt).strftime(fmt)
+        except ValueError:
+            pass
+    raise argparse.ArgumentTypeError(
+        f"expected YYYY-MM-DD or YYYY-MM-DDTHH, got {value!r}"
+    )
+
+
+def query_store(conn, filters=None, bucketer=None):
+    """Rebuild a UsageStore from the rollup tables.
+
+    ``filters`` (see make_filters()) become the WHERE clause, and buckets
+    are relabelled by ``bucketer`` (a TimeBucketer; UTC days by default).
+    The daily rollup answers day-level reports in UTC; hour bounds, hourly
+    buckets and other time zones need the hourly one, whose UTC hours are
+    converted (hours of half-hour zones land on their starting hour).
+    Records with an unparseable timestamp are only included when neither
+    bound is given.
+    """
+    filters = filters or {}
+    bucketer = bucketer or get_bucketer()
+    shifted = bucketer.tz is not timezone.utc
+    since = filters.get("since")
+    until = filters.get("until")
+    bounds = [bound for bound in (since, until) if bound]
+    if shifted or bucketer.granularity == "hour" or any(len(b) > 10 for b in bounds):
+        table, column = "hourly", "hour"
+    else:
+        table, column = "daily", "date"
+
+    where = ["messages != 0"]
+    params = []
+    if bounds:
+        where.append(f"{column} != 'unknown'")
+    if shifted:
+        # Stored hours are UTC: narrow by day in SQL, then check exactly
+        # once converted
+        if since:
+            where.append(f"{column} >= ?")
+            params.append(str(date.fromisoformat(since[:10]) - timedelta(days=1)))
+        if until:
+            where.append(f"substr({column}, 1, 10) <= ?")
+            params.append(str(date.fromisoformat(until[:10]) + timedelta(days=1)))
+    else:
+        if since:
+            where.append(f"{column} >= ?")
+            params.append(since)
+        if until:
+            # Prefix comparison, so a day bound covers every hour of the day
+            where.append(f"substr({column}, 1, ?) <= ?")
+            params.extend((len(until), until))
+    for dim in ("model", "project"):
+        if filters.get(dim):
+            where.append(f"instr(lower({dim}), ?) > 0")
+            params.append(filters[dim])
+
+    store = UsageStore()
+    for row in conn.execute(
+        f"SELECT {column}, model, project, session, branch, cwd, input, output, "
+        f"cache_write, cache_read, messages FROM {table} "
+        f"WHERE {' AND '.join(where)}",
+        params,
+    ):
+        bucket, model, project, *dims = row[:6]
+        counters = row[6:]
+        if bucket == "unknown":
+            label = bucket
+        elif column == "hour":
+            hour = bucketer.utc_hour(bucket)
+            if shifted and bounds and not in_bounds(filters, hour):
+                continue
+            label = bucketer.label(hour)
+        else:
+            label = bucketer.label(f"{bucket}T00")
+        store.add(
+            store.row(label, model, project, *(value or None for value in dims)),
+            *counters,
+        )
+    return store
+
+
+def ingest_command(args):
+    """Run the ``ingest`` subcommand."""
+    db_path = Path(args.db) if args.db else default_db_path()
+    try:
+        conn = open_db(db_path, args.dedup)
+    except (OSError, ValueError, sqlite3.Error) as e:
+        print(f"Cannot use database {db_path}: {e}", file=sys.stderr)
+        return 1
+
+    claude_dir = resolve_claude_dir(args.claude_dir)
+    timer = args.timer
+    jsonl_files = []
+    sessions = None
+    if "claude" in args.sources:
+        print("Scanning Claude conversation logs...", file=sys.stderr)
+        jsonl_files = timer.iterate(scan_claude_projects(claude_dir), "discover")
+    if "opencode" in args.sources:
+        print("Scanning opencode sessions...", file=sys.stderr)
+        sessions = timer.iterate(opencode_sessions(args.opencode_dir), "discover")
+
+    jobs = args.jobs if args.jobs > 0 else os.cpu_count() or 1
+    options = {
+        "decoder": args.decoder,
+        "reader": args.reader,
+        "policy": args.dedup,
+        "profile": timer.enabled,
+    }
+    started = time.perf_counter()
+    try:
+        summary = ingest_files(
+            conn,
+            jsonl_files,
+            jobs=jobs,
+            options=options,
+            claude_dir=claude_dir,
+            timer=timer,
+            sessions=sessions,
+        )
+    finally:
+        conn.close()
+
+    print_scan_rate(
+        summary["scan"],
+        time.perf_counter() - started,
+        f"{args.decoder}, {args.reader} reader",
+    )
+    if "claude" in args.sources:
+        print(f"Found {summary['files']} conversation files.", file=sys.stderr)
+    if "opencode" in args.sources:
+        print(f"Found {summary['sessions']} opencode sessions.", file=sys.stderr)
+    print(
+        f"Ingested {format_number(summary['requests'])} new requests from "
+        f"{format_number(summary['scan']['files'])} files "
+        f"({format_number(summary['unchanged'])} unchanged, "
+        f"{format_number(summary['duplicates'])} duplicates, "
+        f"{format_number(summary['replaced'])} replaced) into {db_path}",
+        file=sys.stderr,
+    )
+    if args.stats:
+        print_pipeline_stats(
+            timer,
+            {
+                "scan": summary["scan"],
+                "dedup": {
+                    "requests": summary["requests"],
+                    "duplicates": summary["duplicates"],
+                    "replaced": summary["replaced"],
+                },
+            },
+        )
+    return 0
+
+
+def query_command(args):
+    """Run the ``query`` subcommand; return the aggregate or None on error."""
+    db_path = Path(args.db) if args.db else default_db_path()
+    if not db_path.exists():
+        print(f"Database not found: {db_path} (run ingest first)", file=sys.stderr)
+        return None
+    started = time.perf_counter()
+    try:
+        conn = open_db(db_path, readonly=True)
+        try:
+            with args.timer.phase("query"):
+                bucketer = get_bucketer(args.tz, args.cell_granularity)
+                store = query_store(conn, args.filters, bucketer)
+                if args.sessions:
+                    spans = query_spans(conn, args.filters, bucketer)
+                if args.windows:
+                    recent = query_recent(conn, args.filters, bucketer)
+        finally:
+            conn.close()
+    except (ValueError, sqlite3.Error) as e:
+        print(f"Cannot use database {db_path}: {e}", file=sys.stderr)
+        return None
+    with args.timer.phase("rollup"):
+        aggregated = rollup_store(store, args.date_label)
+    if args.sessions:
+        aggregated["spans"] = spans
+    if args.windows:
+        aggregated["recent"] = recent
+    print(
+        f"Loaded {format_number(len(store))} rollup cells from {db_path} in "
+        f"{(time.perf_counter() - started) * 1000:.1f} ms",
+        file=sys.stderr,
+    )
+    return aggregated
@@ -0,0 +1,92 @@
+"""inotify(7) bindings for following the logs on Linux."""
+
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+from pathlib import Path
+
+from .core import LOG_SUFFIXES
+
+
+# inotify(7) event bits
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_Q_OVERFLOW = 0x00004000
+IN_ISDIR = 0x40000000
+INOTIFY_MASK = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE
+INOTIFY_EVENT = struct.Struct("iIII")
+
+
+class InotifyWatcher:
+    """Report log files written under a directory tree, using Linux inotify.
+
+    inotify is reached through ctypes, so there is no extra dependency; on
+    other platforms the constructor raises OSError and --watch polls instead.
+    """
+
+    def __init__(self, root):
+        libc_name = ctypes.util.find_library("c")
+        self._libc = ctypes.CDLL(libc_name, use_errno=True)
+        if not hasattr(self._libc, "inotify_init1"):
+            raise OSError("inotify is not available")
+        self.fd = self._libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self.dirs = {}
+        self._add_tree(Path(root))
+
+    def _add_tree(self, root):
+        """Watch ``root`` and every directory below it; return the logs found."""
+        found = []
+        for dir_path, _, file_names in os.walk(root):
+            wd = self._libc.inotify_add_watch(
+                self.fd, os.fsencode(dir_path), INOTIFY_MASK
+            )
+            if wd >= 0:
+                self.dirs[wd] = Path(dir_path)
+            found.extend(
+                Path(dir_path) / name
+                for name in file_names
+                if name.endswith(LOG_SUFFIXES)
+            )
+        return found
+
+    def wait(self, timeout):
+        """Wait up to ``timeout`` seconds and return the set of changed logs.
+
+        Returns None when the kernel queue overflowed and events were lost,
+        in which case the caller has to check every file.
+        """
+        changed = set()
+        if not select.select([self.fd], [], [], timeout)[0]:
+            return changed
+        while True:
+            try:
+                buffer = os.read(self.fd, 65536)
+            except BlockingIOError:
+                return changed
+            position = 0
+            while position < len(buffer):
+                wd, mask, _, length = INOTIFY_EVENT.unpack_from(buffer, position)
+                position += INOTIFY_EVENT.size
+                name = buffer[position : position + length].rstrip(b"\0")
+                position += length
+                if mask & IN_Q_OVERFLOW:
+                    return None
+                parent = self.dirs.get(wd)
+                if parent is None or not name:
+                    continue
+                path = parent / os.fsdecode(name)
+                if mask & IN_ISDIR:
+                    # A new directory may already hold logs
+                    if mask & (IN_CREATE | IN_MOVED_TO):
+                        changed.update(self._add_tree(path))
+                elif path.name.endswith(LOG_SUFFIXES):
+                    changed.add(path)
+
+    def close(self):
+        os.close(self.fd)
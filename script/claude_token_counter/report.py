@@ -0,0 +1,507 @@
+"""Text and JSON reports of aggregated usage."""
+
+import json
+import sys
+from datetime import date, datetime, timezone
+
+from .core import (
+    BURN_WINDOW,
+    USAGE_COLUMNS,
+    get_timezone,
+    group_table,
+    session_table,
+)
+
+
+def format_number(num):
+    """Format large numbers with commas."""
+    return f"{num:,}"
+
+
+def print_stats(stats, pricing=None):
+    """Print formatted statistics."""
+    print_summary(stats, pricing)
+
+    # By model
+    if stats["by_model"]:
+        print("-" * 70)
+        print("Usage by Model")
+        print("-" * 70)
+
+        if pricing:
+            print(
+                f"{'Model':<30} {'Input':>9} {'Output':>9} {'CWrite':>9} {'CRead':>9} {'Tokens':>9} {'Cost':>10} {'Msgs':>5}"
+            )
+        else:
+            print(
+                f"{'Model':<30} {'Input':>10} {'Output':>10} {'CWrite':>10} {'CRead':>10} {'Total':>12} {'Msgs':>5}"
+            )
+        print("-" * 70)
+
+        sorted_models = sorted(
+            stats["by_model"].items(),
+            key=lambda x: x[1]["input"]
+            + x[1]["output"]
+            + x[1]["cache_write"]
+            + x[1]["cache_read"],
+            reverse=True,
+        )
+
+        for model, data in sorted_models:
+            model_cache = data["cache_write"] + data["cache_read"]
+            model_total = data["input"] + data["output"] + model_cache
+
+            if pricing:
+                cost = data.get("cost", 0.0)
+                print(
+                    f"{model[:30]:<30} "
+                    f"{format_number(data['input']):>9} "
+                    f"{format_number(data['output']):>9} "
+                    f"{format_number(data['cache_write']):>9} "
+                    f"{format_number(data['cache_read']):>9} "
+                    f"{format_number(model_total):>9} "
+                    f"${cost:>9.2f} "
+                    f"{data['messages']:>5}"
+                )
+            else:
+                print(
+                    f"{model[:30]:<30} "
+                    f"{format_number(data['input']):>10} "
+                    f"{format_number(data['output']):>10} "
+                    f"{format_number(data['cache_write']):>10} "
+                    f"{format_number(data['cache_read']):>10} "
+                    f"{format_number(model_total):>12} "
+                    f"{data['messages']:>5}"
+                )
+        print()
+
+    # By date
+    if stats["by_date"]:
+        print("-" * 70)
+        period = stats.get("granularity", "day")
+        print("Usage by " + ("Date" if period == "day" else period.title()))
+        print("-" * 70)
+        # Hourly labels are one character wider than dates
+        width = max([12] + [len(key) + 1 for key in stats["by_date"]])
+
+        if pricing:
+            print(
+                f"{'Date':<{width}} {'Input':>10} {'Output':>10} {'CWrite':>10} {'CRead':>10} {'Total':>10} {'Cost':>10} {'Msgs':>5}"
+            )
+        else:
+            print(
+                f"{'Date':<{width}} {'Input':>10} {'Output':>10} {'CWrite':>10} {'CRead':>10} {'Total':>12} {'Msgs':>5}"
+            )
+        print("-" * 70)
+
+        sorted_dates = sorted(stats["by_date"].items(), key=lambda x: x[0])
+
+        for date, data in sorted_dates:
+            date_cache = data["cache_write"] + data["cache_read"]
+            date_total = data["input"] + data["output"] + date_cache
+
+            if pricing:
+                cost = data.get("cost", 0.0)
+                print(
+                    f"{date:<{width}} "
+                    f"{format_number(data['input']):>10} "
+                    f"{format_number(data['output']):>10} "
+                    f"{format_number(data['cache_write']):>10} "
+                    f"{format_number(data['cache_read']):>10} "
+                    f"{format_number(date_total):>10} "
+                    f"${cost:>9.2f} "
+                    f"{data['messages']:>5}"
+                )
+            else:
+                print(
+                    f"{date:<{width}} "
+                    f"{format_number(data['input']):>10} "
+                    f"{format_number(data['output']):>10} "
+                    f"{format_number(data['cache_write']):>10} "
+                    f"{format_number(data['cache_read']):>10} "
+                    f"{format_number(date_total):>12} "
+                    f"{data['messages']:>5}"
+                )
+        print()
+
+
+def print_summary(stats, pricing=None):
+    """Print the report header and overall totals."""
+    total = stats["total"]
+    total_cache = total["cache_write"] + total["cache_read"]
+    total_tokens = total["input"] + total["output"] + total_cache
+
+    print("=" * 70)
+    print("Claude Token Usage Summary")
+    print("=" * 70)
+    print()
+
+    # Overall summary
+    if "approx" in stats:
+        print(f"Total Sessions: ~{format_number(stats['approx']['sessions'])}")
+    else:
+        print(f"Total Sessions: {format_number(len(stats['sessions']))}")
+    print(f"Total Messages: {format_number(total['messages'])}")
+    print()
+    print(f"Input Tokens:     {format_number(total['input']):>12}")
+    print(f"Output Tokens:    {format_number(total['output']):>12}")
+    print(f"Cache Write:      {format_number(total['cache_write']):>12}")
+    print(f"Cache Read:       {format_number(total['cache_read']):>12}")
+    print(f"Total Cache:      {format_number(total_cache):>12}")
+    print(f"Total Tokens:     {format_number(total_tokens):>12}")
+
+    if pricing:
+        total_cost = total.get("cost", 0.0)
+        print(f"Total Cost:        ${total_cost:>10.2f}")
+        if stats.get("unpriced"):
+            print(f"Unpriced models (counted at $0): {', '.join(stats['unpriced'])}")
+    print()
+
+
+# Widest a --group-by key column is printed
+GROUP_COLUMN_WIDTH = 30
+
+
+def print_group_table(table, dims, pricing=None):
+    """Print the rows of group_table() as a "Usage by ..." section."""
+    titles = [{"cwd": "Directory"}.get(dim, dim.title()) for dim in dims]
+    keys = [["-" if value is None else str(value) for value in key] for key, _ in table]
+    widths = [
+        min(GROUP_COLUMN_WIDTH, max([len(title)] + [len(key[i]) for key in keys]))
+        for i, title in enumerate(titles)
+    ]
+
+    print("-" * 70)
+    print("Usage by " + " and ".join(titles))
+    print("-" * 70)
+    header = " ".join(f"{title:<{width}}" for title, width in zip(titles, widths))
+    if pricing:
+        print(
+            f"{header} {'Input':>10} {'Output':>10} {'CWrite':>10} {'CRead':>10} {'Total':>12} {'Cost':>10} {'Msgs':>5}"
+        )
+    else:
+        print(
+            f"{header} {'Input':>10} {'Output':>10} {'CWrite':>10} {'CRead':>10} {'Total':>12} {'Msgs':>5}"
+        )
+    print("-" * 70)
+
+    for key, (_, data) in zip(keys, table):
+        group_total = (
+            data["input"] + data["output"] + data["cache_write"] + data["cache_read"]
+        )
+        line = " ".join(
+            f"{value[:width]:<{width}}" for value, width in zip(key, widths)
+        )
+        line += (
+            f" {format_number(data['input']):>10}"
+            f" {format_number(data['output']):>10}"
+            f" {format_number(data['cache_write']):>10}"
+            f" {format_number(data['cache_read']):>10}"
+            f" {format_number(group_total):>12}"
+        )
+        if pricing:
+            line += f" ${data['cost']:>9.2f}"
+        print(f"{line} {data['messages']:>5}")
+    print()
+
+
+def format_duration(seconds):
+    """Format a duration in seconds as ``45s``, ``12m``, ``3h05m`` or ``2d04h``."""
+    seconds = int(seconds)
+    if seconds < 60:
+        return f"{seconds}s"
+    minutes = seconds // 60
+    if minutes < 60:
+        return f"{minutes}m"
+    hours, minutes = divmod(minutes, 60)
+    if hours < 24:
+        return f"{hours}h{minutes:02d}m"
+    days, hours = divmod(hours, 24)
+    return f"{days}d{hours:02d}h"
+
+
+# Models named in the mix column of --sessions before the rest are counted
+SESSION_MODELS = 2
+
+
+def print_session_table(table, pricing=None, tz="UTC"):
+    """Print the rows of session_table(), with start times in ``tz``."""
+    zone = get_timezone(tz)
+    print("-" * 70)
+    print("Usage by Session")
+    print("-" * 70)
+    if pricing:
+        print(
+            f"{'Session':<36} {'Project':<20} {'Start':<16} {'Length':>7} {'Msgs':>5} {'Tokens':>13} {'Cost':>10} {'Hit':>4}  Models"
+        )
+    else:
+        print(
+            f"{'Session':<36} {'Project':<20} {'Start':<16} {'Length':>7} {'Msgs':>5} {'Tokens':>13} {'Hit':>4}  Models"
+        )
+    print("-" * 70)
+
+    for row in table:
+        start = "-"
+        if row["start"] is not None:
+            moment = datetime.strptime(row["start"], "%Y-%m-%dT%H:%M:%S.%fZ")
+            start = (
+                f"{moment.replace(tzinfo=timezone.utc).astimezone(zone):%Y-%m-%d %H:%M}"
+            )
+        length = "-" if row["duration"] is None else format_duration(row["duration"])
+        hit = row["cache_hit_ratio"]
+        hit = "-" if hit is None else f"{hit:.0%}"
+        mix = [
+            f"{model} {tokens / row['tokens']:.0%}" if row["tokens"] else str(model)
+            for model, tokens in list(row["models"].items())[:SESSION_MODELS]
+        ]
+        if len(row["models"]) > SESSION_MODELS:
+            mix.append(f"+{len(row['models']) - SESSION_MODELS}")
+
+        line = (
+            f"{row['session'][:36]:<36} "
+            f"{str(row['project'])[:20]:<20} "
+            f"{start:<16} "
+            f"{length:>7} "
+            f"{row['messages']:>5} "
+            f"{format_number(row['tokens']):>13} "
+        )
+        if pricing:
+            line += f"${row['cost']:>9.2f} "
+        print(f"{line}{hit:>4}  {', '.join(mix)}")
+    print()
+
+
+def window_summary(window):
+    """Return the windows and burn rate of a UsageWindow for reporting."""
+    return {
+        "now": datetime.fromtimestamp(window.now, timezone.utc).isoformat(),
+        "windows": {name: window.window(name) for name in window.windows},
+        "burn_rate": window.burn_rate(),
+    }
+
+
+def print_windows(summary, pricing=None, tz="UTC"):
+    """Print a window_summary(), with the time in ``tz``."""
+    now = datetime.fromisoformat(summary["now"]).astimezone(get_timezone(tz))
+    print("-" * 70)
+    print(f"Rolling Windows at {now:%Y-%m-%d %H:%M}")
+    print("-" * 70)
+    if pricing:
+        print(
+            f"{'Window':<8} {'Tokens':>15} {'Cost':>10} {'Msgs':>7}  Oldest expires in"
+        )
+    else:
+        print(f"{'Window':<8} {'Tokens':>15} {'Msgs':>7}  Oldest expires in")
+    print("-" * 70)
+    for name, window in summary["windows"].items():
+        expires = window["expires_in"]
+        expires = "-" if expires is None else format_duration(expires)
+        line = f"{name:<8} {format_number(window['tokens']):>15} "
+        if pricing:
+            line += f"${window['cost']:>9.2f} "
+        print(f"{line}{window['messages']:>7}  {expires}")
+    burn = summary["burn_rate"]
+    rate = f"{format_number(round(burn['tokens_per_hour']))} tokens/h"
+    if pricing:
+        rate += f", ${burn['cost_per_hour']:.2f}/h"
+    print()
+    print(f"Burn rate (last {BURN_WINDOW}): {rate}")
+    print()
+
+
+def approx_intervals(aggregated):
+    """Return the 95% interval of every --approx total as ``{name: [low, high]}``.
+
+    The intervals are centred on the reported totals.
+    """
+    total = aggregated["total"]
+    totals = {
+        "tokens": sum(total[column] for column in USAGE_COLUMNS[:4]),
+        "messages": total["messages"],
+        "cost": total.get("cost", 0.0),
+    }
+    return {
+        quantity: [totals[quantity] * (1 - margin), totals[quantity] * (1 + margin)]
+        for quantity, margin in aggregated["approx"]["margins"].items()
+    }
+
+
+def print_approx(aggregated, pricing=None):
+    """Print how an --approx report was sampled and how precise it is."""
+    approx = aggregated["approx"]
+    margins = approx["margins"]
+    intervals = approx_intervals(aggregated)
+    print("-" * 70)
+    print(f"Estimated from a Sample ({approx['confidence']:.0%} confidence)")
+    print("-" * 70)
+    share = approx["sampled_bytes"] / max(approx["total_bytes"], 1)
+    print(
+        f"Sampled {format_number(approx['blocks'])} of "
+        f"{format_number(approx['population'])} blocks "
+        f"({share:.1%} of {approx['total_bytes'] / 1_000_000:.1f} MB)"
+    )
+    if approx["whole_files"]:
+        print(f"Read in full: {approx['whole_files']} compressed logs")
+    for quantity, label in (("tokens", "Total Tokens"), ("messages", "Total Messages")):
+        low, high = intervals[quantity]
+        print(
+            f"{label + ':':<17} ±{margins[quantity]:.1%} "
+            f"({format_number(round(low))} - {format_number(round(high))})"
+        )
+    if pricing and "cost" in margins:
+        low, high = intervals["cost"]
+        print(f"{'Total Cost:':<17} ±{margins['cost']:.1%} (${low:.2f} - ${high:.2f})")
+    print()
+
+
+def print_dedup_summary(dedup):
+    """Report how many duplicate requests were collapsed on stderr."""
+    message = (
+        f"Deduplicated {format_number(dedup['duplicates'])} duplicate records "
+        f"across {format_number(dedup['requests'])} requests "
+        f"(policy: {dedup['policy']}"
+    )
+    if dedup["policy"] != "first":
+        message += f", {format_number(dedup['replaced'])} replaced across files"
+    if dedup["spilled"]:
+        message += f", {format_number(dedup['spilled'])} spilled to disk"
+    print(message + ")", file=sys.stderr)
+
+
+def print_pipeline_stats(timer, aggregated=None):
+    """Report the --stats summary on stderr."""
+    summary = timer.summary(aggregated)
+    print("\n" + "=" * 60, file=sys.stderr)
+    print("Pipeline Statistics", file=sys.stderr)
+    print("=" * 60, file=sys.stderr)
+    print(f"{'Phase':<24} {'Wall (s)':>10} {'CPU (s)':>10}", file=sys.stderr)
+    print("-" * 60, file=sys.stderr)
+    for phase, times in summary["phases"].items():
+        parent, _, child = phase.partition(".")
+        name = f"  {child}" if child else parent
+        cpu = f"{times['cpu']:>10.3f}" if "cpu" in times else ""
+        print(f"{name:<24} {times['wall']:>10.3f} {cpu}".rstrip(), file=sys.stderr)
+    print("-" * 60, file=sys.stderr)
+    print(
+        f"{'total':<24} {summary['wall']:>10.3f} {summary['cpu']:>10.3f}",
+        file=sys.stderr,
+    )
+
+    counters = summary.get("counters")
+    if counters:
+        print("", file=sys.stderr)
+        for name, value in counters.items():
+            label = name.replace("_", " ").capitalize()
+            print(f"{label:<24} {format_number(value):>16}", file=sys.stderr)
+
+    if summary["slowest_files"]:
+        print("\nSlowest files:", file=sys.stderr)
+        for entry in summary["slowest_files"]:
+            print(
+                f"  {entry['seconds']:>8.3f}s {entry['bytes'] / 1_000_000:>8.1f} MB"
+                f"  {entry['path']}",
+                file=sys.stderr,
+            )
+
+
+def print_scan_rate(scan, elapsed, label):
+    """Report parsing throughput on stderr."""
+    elapsed = max(elapsed, 1e-9)
+    print(
+        f"Parsed {format_number(scan['lines'])} lines "
+        f"({format_number(scan['decoded'])} decoded, "
+        f"{scan['bytes'] / 1_000_000:.1f} MB) in {elapsed:.2f}s: "
+        f"{scan['lines'] / elapsed:,.0f} lines/s, "
+        f"{scan['bytes'] / 1_000_000 / elapsed:.1f} MB/s [{label}]",
+        file=sys.stderr,
+    )
+    if scan.get("malformed"):
+        print(
+            f"{format_number(scan['malformed'])} records had a malformed "
+            "timestamp and are counted under 'unknown'",
+            file=sys.stderr,
+        )
+
+
+def json_report(args, aggregated, pricing):
+    """Return the --json output for a priced aggregate."""
+    # Convert defaultdicts to regular dicts for JSON serialization
+    output = {
+        "by_model": dict(aggregated["by_model"]),
+        "by_date": dict(aggregated["by_date"]),
+        "by_project": dict(aggregated.get("by_project", {})),
+        "total": aggregated["total"],
+        "sessions_count": len(aggregated["sessions"]),
+    }
+    if "unpriced" in aggregated:
+        output["unpriced_models"] = aggregated["unpriced"]
+    if args.group_by:
+        output["groups"] = {
+            "dims": list(args.group_by),
+            "sort": args.sort,
+            "top": args.top,
+            "rows": [
+                {**dict(zip(args.group_by, key)), **totals}
+                for key, totals in group_table(
+                    aggregated, args.group_by, pricing, args.top, args.sort
+                )
+            ],
+        }
+    if args.sessions:
+        output["sessions"] = session_table(
+            aggregated, pricing, args.top, args.sort or args.session_sort
+        )
+    if args.windows:
+        output["windows"] = window_summary(aggregated["window"])
+    if args.approx is not None:
+        output["sessions_count"] = aggregated["approx"]["sessions"]
+        output["approx"] = {
+            **aggregated["approx"],
+            "intervals": approx_intervals(aggregated),
+        }
+    if args.stats:
+        output["stats"] = args.timer.summary(aggregated)
+    return output
+
+
+def report(args, aggregated, pricing):
+    """Print a priced aggregate."""
+    # Filters were applied while parsing, so every section agrees
+    if args.filters is not None and not aggregated["by_model"]:
+        print("No records match the given filters.", file=sys.stderr)
+        return 0
+
+    # Output results
+    if args.json:
+        output = json_report(args, aggregated, pricing)
+        print(json.dumps(output, indent=2, default=str))
+    elif args.group_by:
+        pricing = pricing if not args.no_cost else None
+        print_summary(aggregated, pricing)
+        print_group_table(
+            group_table(aggregated, args.group_by, pricing, args.top, args.sort),
+            args.group_by,
+            pricing,
+        )
+    elif args.sessions:
+        pricing = pricing if not args.no_cost else None
+        print_summary(aggregated, pricing)
+        print_session_table(
+            session_table(
+                aggregated, pricing, args.top, args.sort or args.session_sort
+            ),
+            pricing,
+            args.tz,
+        )
+    else:
+        print_stats(aggregated, pricing if not args.no_cost else None)
+    if args.windows and not args.json:
+        print_windows(
+            window_summary(aggregated["window"]),
+            pricing if not args.no_cost else None,
+            args.tz,
+        )
+    if args.approx is not None and not args.json:
+        print_approx(aggregated, pricing if not args.no_cost else None)
+
+    return 0
@@ -0,0 +1,171 @@
+"""HTTP server of Prometheus metrics and JSON reports (serve)."""
+
+import json
+import signal
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from .core import BURN_WINDOW, USAGE_COLUMNS, add_grouping
+from .report import json_report, window_summary
+from .watch import watch_logs
+
+
+# Default port of the serve command's HTTP endpoint
+SERVE_PORT = 9464
+
+# Prefix of the metric names served at /metrics
+METRIC_PREFIX = "claude_usage"
+
+# Grouping of the usage served at /metrics, kept in the aggregate by serve
+METRIC_GROUP = "by_model_date_and_project"
+METRIC_DIMS = ("model", "date", "project")
+
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def prometheus_label(value):
+    """Escape a label value for the Prometheus text format."""
+    if value is None:
+        return ""
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def render_metrics(aggregated, pricing=None, updated=None):
+    """Render a priced aggregate in the Prometheus text exposition format.
+
+    Usage is exported per (model, date, project) group, tokens with a
+    ``type`` label per USAGE_COLUMNS entry, from the METRIC_GROUP grouping
+    serve_command() keeps resident (see add_grouping()), so a refresh does
+    not price the store again.  With --windows the trailing windows and
+    burn rate are added.  ``updated`` is the epoch time of the refresh
+    that rendered the page.
+    """
+    lines = []
+
+    def family(name, help_text):
+        lines.append(f"# HELP {METRIC_PREFIX}_{name} {help_text}")
+        lines.append(f"# TYPE {METRIC_PREFIX}_{name} gauge")
+
+    # Keys may mix None (a missing project) with strings
+    def key_order(item):
+        return tuple("" if value is None else str(value) for value in item[0])
+
+    groups = [
+        (
+            f'model="{prometheus_label(model)}",date="{prometheus_label(date_key)}",'
+            f'project="{prometheus_label(project)}"',
+            totals,
+        )
+        for (model, date_key, project), totals in sorted(
+            aggregated[METRIC_GROUP].items(), key=key_order
+        )
+    ]
+    family("tokens", "Tokens used, by token type.")
+    for labels, totals in groups:
+        for column in USAGE_COLUMNS[:4]:
+            lines.append(
+                f'{METRIC_PREFIX}_tokens{{{labels},type="{column}"}} {totals[column]}'
+            )
+    family("messages", "Deduplicated requests counted.")
+    for labels, totals in groups:
+        lines.append(f"{METRIC_PREFIX}_messages{{{labels}}} {totals['messages']}")
+    if pricing:
+        family("cost_dollars", "Cost in US dollars.")
+        for labels, totals in groups:
+            lines.append(f"{METRIC_PREFIX}_cost_dollars{{{labels}}} {totals['cost']!r}")
+
+    family("sessions", "Sessions seen.")
+    lines.append(f"{METRIC_PREFIX}_sessions {len(aggregated['sessions'])}")
+    window = aggregated.get("window")
+    if window is not None:
+        summary = window_summary(window)
+        family("window_tokens", "Tokens used in the trailing window.")
+        for name, totals in summary["windows"].items():
+            lines.append(
+                f'{METRIC_PREFIX}_window_tokens{{window="{name}"}} {totals["tokens"]}'
+            )
+        if pricing:
+            family("window_cost_dollars", "Cost of the trailing window.")
+            for name, totals in summary["windows"].items():
+                lines.append(
+                    f'{METRIC_PREFIX}_window_cost_dollars{{window="{name}"}} '
+                    f"{totals['cost']!r}"
+                )
+        family("burn_rate_tokens_per_hour", f"Tokens per hour over {BURN_WINDOW}.")
+        lines.append(
+            f"{METRIC_PREFIX}_burn_rate_tokens_per_hour "
+            f"{summary['burn_rate']['tokens_per_hour']!r}"
+        )
+    if updated is not None:
+        family("last_refresh_timestamp_seconds", "When the metrics were refreshed.")
+        lines.append(f"{METRIC_PREFIX}_last_refresh_timestamp_seconds {updated!r}")
+    return ("\n".join(lines) + "\n").encode("utf-8")
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    """Answer requests from the pages pre-rendered in ``server.pages``.
+
+    ``pages`` maps paths to ``(content_type, body)`` and is replaced as a
+    whole on every refresh, so a request never sees a half-updated page.
+    """
+
+    def do_GET(self):
+        page = self.server.pages.get(self.path.split("?", 1)[0])
+        if page is None:
+            self.send_error(404, "Try /metrics or /json")
+            return
+        content_type, body = page
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # Scrapes every few seconds would flood stderr
+        pass
+
+
+def serve_command(args, aggregated, dedup, offsets, pricing):
+    """Serve an aggregate over HTTP and keep it up to date; return the exit status.
+
+    ``/metrics`` (Prometheus text format) and ``/json`` (the --json report)
+    are rendered once per refresh and answered from memory on a background
+    thread, while the logs are followed as in --watch (see watch_logs()).
+    """
+    try:
+        server = ThreadingHTTPServer((args.bind, args.port), MetricsHandler)
+    except OSError as e:
+        print(f"Cannot listen on {args.bind}:{args.port}: {e}", file=sys.stderr)
+        return 1
+    server.daemon_threads = True
+
+    def publish(aggregated):
+        updated = time.time()
+        output = json_report(args, aggregated, pricing)
+        server.pages = {
+            "/metrics": (
+                PROMETHEUS_CONTENT_TYPE,
+                render_metrics(aggregated, pricing, updated),
+            ),
+            "/json": (
+                "application/json",
+                json.dumps(output, default=str).encode("utf-8"),
+            ),
+        }
+
+    add_grouping(aggregated, METRIC_GROUP, METRIC_DIMS, pricing)
+    publish(aggregated)
+    # Service managers stop daemons with SIGTERM; exit through the finally
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    host, port = server.server_address[:2]
+    print(f"Serving http://{host}:{port}/metrics and /json", file=sys.stderr)
+    try:
+        return watch_logs(args, aggregated, dedup, offsets, pricing, publish)
+    finally:
+        server.shutdown()
+        server.server_close()
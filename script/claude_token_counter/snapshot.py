@@ -0,0 +1,269 @@
+"""Aggregate snapshots for combining hosts (export-snapshot, merge)."""
+
+import gzip
+import json
+import os
+import sys
+import time
+from datetime import datetime, timezone
+
+from .core import (
+    CELL_DIMS,
+    SCAN_COUNTERS,
+    UsageStore,
+    aggregate_stats,
+    analyze_files,
+    analyze_opencode,
+    cell_matches,
+    get_bucketer,
+    merge_partial,
+    new_file_stats,
+    opencode_sessions,
+    partial_record,
+    resolve_claude_dir,
+    scan_claude_projects,
+)
+from .report import (
+    format_number,
+    print_dedup_summary,
+    print_pipeline_stats,
+    print_scan_rate,
+)
+
+
+# Version of the export-snapshot format; merge skips other versions
+SNAPSHOT_VERSION = 1
+
+# Name suffix of snapshots, by which merge finds them in directories
+SNAPSHOT_SUFFIX = ".snapshot.json.gz"
+
+
+def write_snapshot(snapshot_path, snapshot):
+    """Write a snapshot as gzip-compressed JSON, atomically; return its size in bytes."""
+    temp_path = f"{snapshot_path}.{os.getpid()}.tmp"
+    try:
+        with gzip.open(temp_path, "wt", encoding="utf-8") as f:
+            json.dump(snapshot, f, separators=(",", ":"))
+        os.replace(temp_path, snapshot_path)
+    except BaseException:
+        try:
+            os.remove(temp_path)
+        except OSError:
+            pass
+        raise
+    return os.path.getsize(snapshot_path)
+
+
+def export_command(args):
+    """Run the ``export-snapshot`` subcommand.
+
+    The logs of every selected source are parsed into UTC hourly cells and
+    deduplicated into one partial aggregate (see merge_partial()), which is
+    written with the requestId hash and contribution of every counted
+    request.  Records without a requestId are keyed by their position, as
+    for ingest, so that merge can filter every request with its cell.
+    """
+    claude_dir = resolve_claude_dir(args.claude_dir)
+    jobs = args.jobs if args.jobs > 0 else os.cpu_count() or 1
+    timer = args.timer
+    options = {
+        "decoder": args.decoder,
+        "reader": args.reader,
+        "policy": args.dedup,
+        "timestamps": True,
+        # merge relabels the cells to its own --tz and --granularity
+        "tz": "UTC",
+        "granularity": "hour",
+    }
+
+    def partials():
+        if "claude" in args.sources:
+            print("Scanning Claude conversation logs...", file=sys.stderr)
+            jsonl_files = timer.iterate(scan_claude_projects(claude_dir), "discover")
+            yield from analyze_files(
+                jsonl_files, jobs=jobs, options=options, claude_dir=claude_dir
+            )
+        if "opencode" in args.sources:
+            print("Scanning opencode sessions...", file=sys.stderr)
+            sessions = timer.iterate(opencode_sessions(args.opencode_dir), "discover")
+            for _, stats in analyze_opencode(sessions, options=options):
+                yield stats
+
+    started = time.perf_counter()
+    merged = new_file_stats()
+    files = 0
+    for stats in partials():
+        files += 1
+        with timer.phase("dedup"):
+            merge_partial(merged, stats, args.dedup)
+    print_scan_rate(
+        merged,
+        time.perf_counter() - started,
+        f"{args.decoder}, {args.reader} reader",
+    )
+
+    snapshot = {
+        "version": SNAPSHOT_VERSION,
+        "host": args.host,
+        "created": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "policy": args.dedup,
+        "sources": list(args.sources),
+        "files": files,
+        "scan": {counter: merged[counter] for counter in SCAN_COUNTERS},
+        **partial_record(merged),
+    }
+    snapshot_path = args.output or f"usage-{args.host}{SNAPSHOT_SUFFIX}"
+    try:
+        with timer.phase("write"):
+            size = write_snapshot(snapshot_path, snapshot)
+    except OSError as e:
+        print(f"Cannot write snapshot {snapshot_path}: {e}", file=sys.stderr)
+        return 1
+    print(
+        f"Wrote {format_number(len(merged['requests']))} requests in "
+        f"{format_number(len(merged['store']))} cells from {files} files to "
+        f"{snapshot_path} ({size / 1_000_000:.2f} MB)",
+        file=sys.stderr,
+    )
+    if args.stats:
+        print_pipeline_stats(timer)
+    return 0
+
+
+def snapshot_paths(paths):
+    """Yield the snapshots named by ``paths``; directories give their *SNAPSHOT_SUFFIX files."""
+    for path in paths:
+        if os.path.isdir(path):
+            try:
+                names = sorted(os.listdir(path))
+            except OSError as e:
+                print(f"Cannot list {path}: {e}", file=sys.stderr)
+                continue
+            for name in names:
+                if name.endswith(SNAPSHOT_SUFFIX):
+                    yield os.path.join(path, name)
+        else:
+            yield path
+
+
+def load_snapshot(snapshot_path, policy="first"):
+    """Read a snapshot written by export_command().
+
+    Raises ValueError for a snapshot of another version, or one whose
+    requests were deduplicated by another ``policy`` than the merge's.
+    """
+    with gzip.open(snapshot_path, "rt", encoding="utf-8") as f:
+        snapshot = json.load(f)
+    if not isinstance(snapshot, dict) or snapshot.get("version") != SNAPSHOT_VERSION:
+        raise ValueError("not a snapshot of a supported version")
+    if snapshot["policy"] != policy:
+        raise ValueError(
+            f"snapshot was exported with --dedup {snapshot['policy']}, not {policy}"
+        )
+    return snapshot
+
+
+def partial_from_snapshot(snapshot, filters=None, bucketer=None):
+    """Rebuild the partial aggregate of a snapshot for merging.
+
+    Its UTC hourly cells are converted to the hours of ``bucketer``'s time
+    zone (see TimeBucketer.utc_hour()).  Requests are filtered only once
+    they are deduplicated (see relabel_store()), as for query, but the
+    recent requests of cells that do not match ``filters`` are left out, so
+    the windows follow the same choice.  The scan counters are the
+    exporting host's.
+    """
+    bucketer = bucketer or get_bucketer()
+    stats = new_file_stats()
+    store = stats["store"]
+    width = len(CELL_DIMS)
+    hours = {}
+    row_map = []
+    excluded = set()
+    for row, cell in enumerate(snapshot["cells"]):
+        hour = hours.get(cell[0])
+        if hour is None:
+            hour = hours[cell[0]] = bucketer.utc_hour(cell[0])
+        new_row = store.row(hour, *cell[1:width])
+        store.add(new_row, *cell[width:])
+        row_map.append(new_row)
+        if filters and not cell_matches(filters, cell[1], cell[2], hour):
+            excluded.add(row)
+
+    requests = stats["requests"]
+    for key, row, *tokens in snapshot["requests"]:
+        requests[key] = (row_map[row], *tokens)
+    stats["recent"] = {key: tuple(entry) for key, *entry in snapshot["recent"]}
+    if excluded:
+        # Every request is keyed in a snapshot, so its recent copy has its row
+        rows = {key: row for key, row, *_ in snapshot["requests"]}
+        for key in list(stats["recent"]):
+            if rows.get(key) in excluded:
+                del stats["recent"][key]
+    stats["spans"] = snapshot["spans"]
+    stats["duplicates"] = snapshot["duplicates"]
+    stats["malformed"] = snapshot["malformed"]
+    for counter in SCAN_COUNTERS:
+        stats[counter] = snapshot["scan"][counter]
+    return stats
+
+
+def relabel_store(store, filters=None, bucketer=None):
+    """Return the cells of an hourly UsageStore that match ``filters``, relabelled by ``bucketer``."""
+    bucketer = bucketer or get_bucketer()
+    relabelled = UsageStore()
+    for row in store.live_rows():
+        hour, model, project, *dims = store.key(row)
+        if cell_matches(filters, model, project, hour):
+            relabelled.add(
+                relabelled.row(bucketer.label(hour), model, project, *dims),
+                *(column[row] for column in store.columns),
+            )
+    return relabelled
+
+
+def merge_command(args, dedup):
+    """Run the ``merge`` subcommand; return the aggregate, or None on error.
+
+    Snapshots are read one at a time and folded in through ``dedup`` (a
+    DedupIndex), so a request exported by several hosts is counted once and
+    memory holds only the merged cells and the request hashes, which
+    --dedup-spill moves to disk.  Cells stay hourly until every snapshot is
+    merged, and are then filtered and relabelled (see relabel_store()).
+    """
+    hourly = get_bucketer(args.tz, "hour")
+    bucketer = get_bucketer(args.tz, args.cell_granularity)
+    hosts = set()
+    merged = []
+
+    def partials():
+        for snapshot_path in snapshot_paths(args.snapshots):
+            try:
+                with args.timer.phase("load"):
+                    snapshot = load_snapshot(snapshot_path, args.dedup)
+                    partial = partial_from_snapshot(snapshot, args.filters, hourly)
+            except (OSError, EOFError, ValueError, KeyError) as e:
+                print(f"Skipping {snapshot_path}: {e}", file=sys.stderr)
+                continue
+            hosts.add(snapshot["host"])
+            merged.append(snapshot_path)
+            yield partial
+
+    started = time.perf_counter()
+    aggregated = aggregate_stats(
+        partials(),
+        dedup,
+        args.timer,
+        args.date_label,
+        lambda store: relabel_store(store, args.filters, bucketer),
+    )
+    if not merged:
+        print("No snapshots could be merged.", file=sys.stderr)
+        return None
+    print(
+        f"Merged {len(merged)} snapshots from {len(hosts)} hosts in "
+        f"{time.perf_counter() - started:.2f}s",
+        file=sys.stderr,
+    )
+    print_dedup_summary(aggregated["dedup"])
+    return aggregated
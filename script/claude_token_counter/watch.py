@@ -0,0 +1,137 @@
+"""Live view of the usage, updated as the logs grow."""
+
+import os
+import sys
+import time
+from datetime import datetime
+
+from .core import (
+    UsageStore,
+    analyze_jsonl_file,
+    apply_delta,
+    fold_partial,
+    get_bucketer,
+    log_opener,
+    merge_recent,
+    merge_spans,
+    project_name,
+    relabel_partial,
+    resolve_claude_dir,
+    scan_claude_projects,
+)
+from .inotify import InotifyWatcher
+from .report import report
+
+
+# Seconds between checks for new log lines in --watch mode
+WATCH_INTERVAL = 2.0
+
+
+def watch_logs(args, aggregated, dedup, offsets, pricing, redraw=None):
+    """Tail the logs after a full scan and redraw the report as they grow.
+
+    ``offsets`` maps each scanned file to ``(inode, offset)``.  Only files
+    reported by inotify, or found grown or new when polling every
+    ``args.interval`` seconds, are parsed, from their last offset, and just
+    the changed cells are folded into ``aggregated`` (see apply_delta()).  A
+    rotated or truncated file is read again from the start; its requests are
+    recognised by the dedup index, and records without a requestId are told
+    apart from those once at the same offsets (see position_key()).  New
+    lines are parsed into hourly cells, then relabelled and filtered as a
+    scan does (see relabel_partial()).  The scan index is left as it was, and
+    picks the new lines up on the next normal run.  With --windows the
+    report is also redrawn once a minute, as usage leaves the windows.
+    ``redraw(aggregated)``, when given, replaces printing the report.
+    """
+    claude_dir = resolve_claude_dir(args.claude_dir)
+    filters = args.filters
+    options = {
+        "decoder": args.decoder,
+        "reader": args.reader,
+        "policy": args.dedup,
+        "filters": filters,
+        "tz": args.tz,
+        "granularity": "hour",
+    }
+    bucketer = get_bucketer(args.tz, args.cell_granularity)
+    # Directory listings reused across polls (see walk_jsonl_files())
+    listings = {}
+    try:
+        watcher = InotifyWatcher(claude_dir)
+    except OSError as e:
+        print(f"inotify unavailable ({e}); polling instead", file=sys.stderr)
+        watcher = None
+
+    try:
+        while True:
+            if watcher is not None:
+                candidates = watcher.wait(args.interval)
+                if candidates is None:
+                    candidates = scan_claude_projects(
+                        claude_dir, filters, listings, args.dedup
+                    )
+            else:
+                time.sleep(args.interval)
+                candidates = scan_claude_projects(
+                    claude_dir, filters, listings, args.dedup
+                )
+
+            started = time.perf_counter()
+            delta = UsageStore()
+            updated = 0
+            for file_path in candidates:
+                project = project_name(file_path, claude_dir)
+                try:
+                    st = os.stat(file_path)
+                except OSError:
+                    continue
+                inode, offset = offsets.get(str(file_path), (None, 0))
+                # Offsets into compressed logs count decompressed bytes, and
+                # such logs are written once rather than appended to
+                compressed = log_opener(file_path) is not open
+                if inode != st.st_ino or (not compressed and st.st_size < offset):
+                    offset = 0
+                elif compressed or st.st_size == offset:
+                    continue
+                stats = analyze_jsonl_file(
+                    file_path, offset, project=project, **options
+                )
+                offsets[str(file_path)] = (st.st_ino, stats["offset"])
+                stats = relabel_partial(stats, filters, bucketer, project)
+                rejected = fold_partial(aggregated["store"], stats, dedup, delta)
+                merge_spans(aggregated["spans"], stats["spans"])
+                merge_recent(
+                    aggregated["recent"],
+                    stats,
+                    rejected,
+                    aggregated.get("window"),
+                    pricing,
+                )
+                updated += 1
+            window = aggregated.get("window")
+            if not any(any(column) for column in delta.columns):
+                # The windows move with the clock even when the logs do not
+                if window is None or int(time.time() // 60) == window.minute:
+                    continue
+            if window is not None:
+                window.advance()
+
+            apply_delta(aggregated, delta, pricing)
+            if redraw is not None:
+                redraw(aggregated)
+            else:
+                if sys.stdout.isatty() and not args.json:
+                    # Clear the screen and home the cursor before redrawing
+                    print("\033[H\033[2J", end="")
+                report(args, aggregated, pricing)
+                sys.stdout.flush()
+            print(
+                f"Updated {updated} files at {datetime.now():%H:%M:%S} in "
+                f"{(time.perf_counter() - started) * 1000:.1f} ms",
+                file=sys.stderr,
+            )
+    except KeyboardInterrupt:
+        return 0
+    finally:
+        if watcher is not None:
+            watcher.close()
@@ -0,0 +1,1404 @@
+"""Tests for claude-token-counter.py on logs generated by claude-token-bench.py.
+
+Run with ``python3 -m unittest test_claude_token_counter`` from this directory,
+where the claude_token_counter package can be imported.
+"""
+
+import importlib.util
+import json
+import os
+import random
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+import unittest
+import urllib.request
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from decimal import Decimal
+from pathlib import Path
+from unittest import mock
+
+from claude_token_counter import core, inotify
+
+SCRIPT_DIR = Path(__file__).parent
+COUNTER = SCRIPT_DIR / "claude-token-counter.py"
+
+# A tree of about 120 one-block logs, small enough to read in full quickly
+TREE_CONFIG = {
+    "files": 120,
+    "lines": 400,
+    "projects": 8,
+    "assistant_ratio": 0.5,
+    "duplicate_rate": 0.3,
+    "payload": 600,
+    "seed": 0,
+}
+
+# A tree of 800 small logs, over which --approx 0.1 reads a small sample
+SAMPLED_TREE_CONFIG = dict(TREE_CONFIG, files=800, lines=100, payload=200)
+
+# Fewest times fewer lines --approx 0.1 parses than an exact scan of it
+APPROX_SPEEDUP = 10
+
+# Seconds to wait for a server to start, or for it or a watcher to see a change
+SERVE_TIMEOUT = 30
+
+# Name suffix merge finds snapshots in directories by
+SNAPSHOT_SUFFIX = ".snapshot.json.gz"
+
+# Samples drawn to check that about 95% of the --approx intervals hold
+APPROX_SEEDS = 40
+
+
+def load_script(name):
+    """Import one of the scripts, whose names are not importable."""
+    path = SCRIPT_DIR / name
+    spec = importlib.util.spec_from_file_location(path.stem.replace("-", "_"), path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def totals(report):
+    """Return the ``(tokens, messages, cost)`` totals of a --json report."""
+    total = report["total"]
+    tokens = sum(
+        total[column] for column in ("input", "output", "cache_write", "cache_read")
+    )
+    return {"tokens": tokens, "messages": total["messages"], "cost": total["cost"]}
+
+
+def metric_totals(text):
+    """Return the ``(tokens, messages, cost)`` totals of a /metrics page."""
+    sums = {"tokens": 0, "messages": 0, "cost": 0.0}
+    names = {"tokens": "tokens", "messages": "messages", "cost": "cost_dollars"}
+    for line in text.splitlines():
+        name, _, value = line.partition("{")
+        for quantity, metric in names.items():
+            if name == f"claude_usage_{metric}":
+                sums[quantity] += float(value.rsplit(" ", 1)[1])
+    return sums
+
+
+class GeneratedTreeTest(unittest.TestCase):
+    """Base class generating ``config`` once for the tests of a class."""
+
+    config = TREE_CONFIG
+
+    @classmethod
+    def setUpClass(cls):
+        bench = load_script("claude-token-bench.py")
+        cls.tree = tempfile.TemporaryDirectory()
+        config = dict(cls.config, models=bench.parse_models(bench.DEFAULT_MODELS))
+        bench.generate_tree(cls.tree.name, config)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.tree.cleanup()
+
+    def invoke(self, *args, cache=None, claude_dir=None):
+        """Run the counter on the tree, with the scan index at ``cache`` if given.
+
+        ``claude_dir`` reads another tree, such as a copy of this one.
+        """
+        index = ["--cache", cache] if cache else ["--no-cache"]
+        claude_dir = claude_dir or self.tree.name
+        return subprocess.run(
+            [sys.executable, COUNTER, "--claude-dir", claude_dir, *index]
+            + list(args),
+            capture_output=True,
+            text=True,
+            check=True,
+        )
+
+    def run_counter(self, *args, cache=None, claude_dir=None):
+        """Run the counter on the tree and return its standard output."""
+        return self.invoke(*args, cache=cache, claude_dir=claude_dir).stdout
+
+    def report(self, *args, cache=None, claude_dir=None):
+        return json.loads(
+            self.run_counter("--json", *args, cache=cache, claude_dir=claude_dir)
+        )
+
+    def copy_tree(self):
+        """Return a copy of the tree that a test may change."""
+        scratch = tempfile.TemporaryDirectory()
+        self.addCleanup(scratch.cleanup)
+        return shutil.copytree(self.tree.name, Path(scratch.name, "projects"))
+
+
+class ApproxTest(GeneratedTreeTest):
+    def test_intervals_cover_exact_totals(self):
+        exact = totals(self.report())
+        for error in ("0.1", "0.05"):
+            intervals = self.report("--approx", error)["approx"]["intervals"]
+            for quantity, (low, high) in intervals.items():
+                with self.subTest(error=error, quantity=quantity):
+                    self.assertLessEqual(low, exact[quantity])
+                    self.assertLessEqual(exact[quantity], high)
+
+    def test_intervals_cover_exact_totals_across_seeds(self):
+        exact = totals(self.report())
+
+        def covered(seed):
+            report = self.report("--approx", "--approx-seed", str(seed))
+            estimate = totals(report)
+            return {
+                quantity: abs(estimate[quantity] - exact[quantity])
+                <= margin * estimate[quantity]
+                for quantity, margin in report["approx"]["margins"].items()
+            }
+
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            runs = list(executor.map(covered, range(APPROX_SEEDS)))
+        for quantity in runs[0]:
+            with self.subTest(quantity=quantity):
+                coverage = sum(run[quantity] for run in runs) / len(runs)
+                self.assertGreaterEqual(coverage, 0.9)
+
+    def test_smaller_error_reads_more_blocks(self):
+        loose = self.report("--approx", "0.1")["approx"]
+        tight = self.report("--approx", "0.05")["approx"]
+        self.assertLess(loose["blocks"], tight["blocks"])
+        self.assertLessEqual(tight["margins"]["tokens"], 0.05)
+
+    def test_reading_every_block_is_exact(self):
+        exact = totals(self.report())
+        estimate = totals(self.report("--approx", "0"))
+        self.assertEqual(estimate["tokens"], exact["tokens"])
+        self.assertEqual(estimate["messages"], exact["messages"])
+        self.assertAlmostEqual(estimate["cost"], exact["cost"], places=6)
+
+
+class ApproxSpeedupTest(GeneratedTreeTest):
+    config = SAMPLED_TREE_CONFIG
+
+    def parsed(self, *args):
+        """Return the lines a run parses and its --json report."""
+        run = self.invoke("--json", *args)
+        lines = re.search(r"Parsed ([\d,]+) lines", run.stderr).group(1)
+        return int(lines.replace(",", "")), json.loads(run.stdout)
+
+    def test_samples_parse_a_fraction_of_the_lines(self):
+        exact_lines, report = self.parsed()
+        exact = totals(report)
+        for seed in range(3):
+            lines, report = self.parsed("--approx", "0.1", "--approx-seed", str(seed))
+            with self.subTest(seed=seed):
+                self.assertGreaterEqual(exact_lines / lines, APPROX_SPEEDUP)
+                for quantity, (low, high) in report["approx"]["intervals"].items():
+                    self.assertLessEqual(low, exact[quantity])
+                    self.assertLessEqual(exact[quantity], high)
+
+
+class IndexTest(GeneratedTreeTest):
+    def assertCachedRunMatches(self, tree, cache, parsed):
+        """Check that a run with the index parses ``parsed`` lines and reports
+        what a full scan does.
+        """
+        warm = self.invoke("--json", cache=cache, claude_dir=tree)
+        self.assertIn(f"Parsed {parsed:,} lines", warm.stderr)
+        self.assertEqual(json.loads(warm.stdout), self.report(claude_dir=tree))
+
+    def test_index_follows_appends_torn_lines_and_truncation(self):
+        tree = self.copy_tree()
+        logs = sorted(tree.glob("*/*.jsonl"))
+        lines = logs[1].read_text().splitlines(keepends=True)
+        with tempfile.TemporaryDirectory() as cache_dir:
+            cache = str(Path(cache_dir) / "index.json")
+            self.invoke(cache=cache, claude_dir=tree)
+            self.assertCachedRunMatches(tree, cache, 0)
+
+            with self.subTest("append"):
+                with open(logs[0], "a") as f:
+                    f.writelines(lines[:50])
+                self.assertCachedRunMatches(tree, cache, 50)
+
+            with self.subTest("torn line"):
+                # A line still being written is left for the run that sees it end
+                torn = next(line for line in lines[50:] if '"usage"' in line)
+                with open(logs[0], "a") as f:
+                    f.write(torn[: len(torn) // 2])
+                self.assertCachedRunMatches(tree, cache, 1)
+                with open(logs[0], "a") as f:
+                    f.write(torn[len(torn) // 2 :])
+                self.assertCachedRunMatches(tree, cache, 1)
+
+            with self.subTest("truncate"):
+                kept = logs[2].read_text().splitlines(keepends=True)[:10]
+                logs[2].write_text("".join(kept))
+                self.assertCachedRunMatches(tree, cache, len(kept))
+
+
+class JobsTest(GeneratedTreeTest):
+    def test_parallel_runs_match_serial_ones(self):
+        for policy in ("first", "last", "max"):
+            with self.subTest(policy=policy):
+                serial = self.report("--jobs", "1", "--dedup", policy)
+                self.assertEqual(self.report("--jobs", "3", "--dedup", policy), serial)
+
+    def test_split_files_match_serial_runs(self):
+        # Every log in one, large enough to be parsed as several byte ranges
+        with tempfile.TemporaryDirectory() as tree:
+            project = Path(tree, "-home-user-all")
+            project.mkdir()
+            log_path = project / "all.jsonl"
+            with open(log_path, "wb") as out:
+                for log in sorted(Path(self.tree.name).glob("**/*.jsonl")):
+                    out.write(log.read_bytes())
+            self.assertGreater(log_path.stat().st_size, 32 * 1024 * 1024)
+            for policy in ("first", "max"):
+                with self.subTest(policy=policy):
+                    args = ("--dedup", policy)
+                    self.assertEqual(
+                        self.report("--jobs", "3", *args, claude_dir=tree),
+                        self.report("--jobs", "1", *args, claude_dir=tree),
+                    )
+
+
+class IngestTest(GeneratedTreeTest):
+    def test_queries_match_scans(self):
+        tree = self.copy_tree()
+        with tempfile.TemporaryDirectory() as db_dir:
+            db = str(Path(db_dir) / "usage.sqlite")
+
+            def query(*args):
+                return json.loads(
+                    self.run_counter("--json", *args, "query", "--db", db)
+                )
+
+            self.invoke("ingest", "--db", db, claude_dir=tree)
+            for filters in (
+                (),
+                ("--since=2025-10-10", "--until=2025-10-20"),
+                ("--project=proj3", "--model=haiku"),
+            ):
+                with self.subTest(filters=filters):
+                    self.assertEqual(
+                        query(*filters), self.report(*filters, claude_dir=tree)
+                    )
+
+            with self.subTest("ingest again"):
+                logs = sorted(tree.glob("*/*.jsonl"))
+                with open(logs[0], "a") as f:
+                    f.writelines(logs[1].read_text().splitlines(keepends=True)[:50])
+                self.invoke("ingest", "--db", db, claude_dir=tree)
+                self.assertEqual(query(), self.report(claude_dir=tree))
+
+
+class FilterTest(GeneratedTreeTest):
+    def test_project_reports_add_up(self):
+        # Requests are copied across projects, so each must be counted only
+        # under the project of the copy deduplication keeps
+        for policy in ("first", "last", "max"):
+            report = self.report("--dedup", policy)
+            parts = [
+                totals(self.report("--dedup", policy, f"--project={project}"))
+                for project in report["by_project"]
+            ]
+            with self.subTest(policy=policy):
+                exact = totals(report)
+                self.assertEqual(sum(part["tokens"] for part in parts), exact["tokens"])
+                self.assertEqual(
+                    sum(part["messages"] for part in parts), exact["messages"]
+                )
+
+    def test_project_exports_split_the_export(self):
+        for policy in ("first", "last", "max"):
+            rows = self.run_counter(
+                "--export", "ndjson", "--dedup", policy
+            ).splitlines()
+            projects = {json.loads(row)["project"] for row in rows}
+            parts = []
+            for project in projects:
+                parts += self.run_counter(
+                    "--export", "ndjson", "--dedup", policy, f"--project={project}"
+                ).splitlines()
+            with self.subTest(policy=policy):
+                # Counts rather than the rows, whose diff would take minutes
+                extra = Counter(parts) - Counter(rows)
+                missing = Counter(rows) - Counter(parts)
+                self.assertEqual((sum(extra.values()), sum(missing.values())), (0, 0))
+
+    def test_filtered_runs_use_the_index(self):
+        with tempfile.TemporaryDirectory() as cache_dir:
+            cache = str(Path(cache_dir) / "index.json")
+            self.invoke("--dedup", "max", cache=cache)
+            for filters in (
+                ("--project=proj3",),
+                ("--model=opus", "--since=2025-10-10"),
+                ("--until=2025-10-20T05", "--group-by=hour"),
+                ("--granularity=week", "--model=sonnet"),
+            ):
+                with self.subTest(filters=filters):
+                    args = ("--json", "--dedup", "max", *filters)
+                    warm = self.invoke(*args, cache=cache)
+                    self.assertIn("Parsed 0 lines", warm.stderr)
+                    self.assertEqual(
+                        totals(json.loads(warm.stdout)), totals(self.report(*args[1:]))
+                    )
+
+    def test_filtered_cold_runs_decode_fewer_lines(self):
+        def decoded(run):
+            count = re.search(r"\(([\d,]+) decoded", run.stderr).group(1)
+            return int(count.replace(",", ""))
+
+        # Under max, keyed copies are only counted undecoded by the stdlib json
+        for policy, decoder in (("first", "auto"), ("last", "auto"), ("max", "json")):
+            with tempfile.TemporaryDirectory() as cache_dir:
+                cache = str(Path(cache_dir) / "index.json")
+                args = ("--json", "--dedup", policy, "--decoder", decoder)
+                args += ("--model=opus",)
+                cold = self.invoke(*args, "--since=2025-10-10", cache=cache)
+                uncached = self.invoke(*args, "--since=2025-10-10")
+                unfiltered = self.invoke(*args[:-1], cache=cache)
+            with self.subTest(policy=policy):
+                self.assertLess(decoded(cold), decoded(unfiltered))
+                self.assertLess(decoded(uncached), decoded(unfiltered))
+                self.assertEqual(
+                    totals(json.loads(cold.stdout)), totals(json.loads(uncached.stdout))
+                )
+
+    def test_rejected_copies_are_weighed_under_max(self):
+        # The opus copy of r1 has more output, so max keeps it and a sonnet
+        # report must not count r1, even though that copy is never matched
+        with tempfile.TemporaryDirectory() as scratch:
+            tree = Path(scratch, "projects")
+            for project, model, output in (
+                ("-home-user-a", "claude-opus-4-1", 50),
+                ("-home-user-b", "claude-sonnet-4-5", 10),
+            ):
+                (tree / project).mkdir(parents=True)
+                (tree / project / "session.jsonl").write_text(
+                    usage_line("r1", output, model=model)
+                )
+            for decoder in ("auto", "json"):
+                with self.subTest(decoder=decoder):
+                    args = ("--dedup", "max", "--decoder", decoder)
+                    run = self.invoke(
+                        "--json", *args, "--model=sonnet", claude_dir=str(tree)
+                    )
+                    self.assertIn("No records match", run.stderr)
+                    report = self.report(*args, "--model=opus", claude_dir=str(tree))
+                    self.assertEqual(report["total"]["output"], 50)
+
+
+class TimeBucketerTest(unittest.TestCase):
+    # Zones with and without daylight saving, some not a whole hour from UTC
+    ZONES = ("UTC", "America/New_York", "Australia/Lord_Howe", "+05:30", "-09:30")
+
+    # UTC spans over a year end, spring and autumn DST changes, and a month
+    # end that falls mid-week
+    SPANS = (
+        ("2024-12-30T00:00", "2025-01-02T00:00"),
+        ("2025-03-08T00:00", "2025-03-10T00:00"),
+        ("2025-04-05T00:00", "2025-04-07T00:00"),
+        ("2025-10-04T00:00", "2025-10-06T00:00"),
+        ("2025-10-31T00:00", "2025-11-03T00:00"),
+    )
+
+    def moments(self):
+        """Return UTC moments every 7 minutes over SPANS."""
+        for start, end in self.SPANS:
+            moment = datetime.fromisoformat(start).replace(tzinfo=timezone.utc)
+            end = datetime.fromisoformat(end).replace(tzinfo=timezone.utc)
+            while moment < end:
+                yield moment
+                moment += timedelta(minutes=7)
+
+    def test_labels_match_datetime(self):
+        formats = {"hour": "%Y-%m-%dT%H", "day": "%Y-%m-%d", "month": "%Y-%m"}
+        for zone in self.ZONES:
+            tz = core.get_timezone(zone)
+            for granularity in ("hour", "day", "week", "month"):
+                bucketer = core.TimeBucketer(zone, granularity)
+                with self.subTest(zone=zone, granularity=granularity):
+                    # Twice, so the second pass reads the memos
+                    for moment in [*self.moments(), *self.moments()]:
+                        local = moment.astimezone(tz)
+                        if granularity == "week":
+                            year, week, _ = local.isocalendar()
+                            expected = f"{year}-W{week:02d}"
+                            start = local.date() - timedelta(days=local.weekday())
+                        else:
+                            expected = local.strftime(formats[granularity])
+                            start = local.date()
+                            if granularity == "month":
+                                start = start.replace(day=1)
+                        logged = moment.strftime("%Y-%m-%dT%H:%M:%S.000Z")
+                        # Log timestamps, and another ISO form of the same moment
+                        offset = moment.astimezone(timezone(timedelta(hours=2)))
+                        for timestamp in (logged, offset.isoformat()):
+                            hour = bucketer.hour(timestamp)
+                            self.assertEqual(hour, local.strftime("%Y-%m-%dT%H"))
+                            self.assertEqual(bucketer.label(hour), expected)
+                        self.assertEqual(core.label_day(expected), str(start))
+                        # A UTC hour maps to where it starts
+                        utc_hour = moment.replace(minute=0)
+                        self.assertEqual(
+                            bucketer.utc_hour(utc_hour.strftime("%Y-%m-%dT%H")),
+                            utc_hour.astimezone(tz).strftime("%Y-%m-%dT%H"),
+                        )
+
+    def test_unparsable_timestamps(self):
+        bucketer = core.TimeBucketer("America/New_York")
+        for timestamp in (None, 1759320000, "", "yesterday", "2025-13-01T00:00:00Z"):
+            with self.subTest(timestamp=timestamp):
+                self.assertIsNone(bucketer.hour(timestamp))
+        self.assertEqual(bucketer.label(None), "unknown")
+
+
+def settle(tree):
+    """Backdate the directories under ``tree`` so their listings are cached."""
+    old = time.time() - 60
+    for directory in [tree, *(path for path in tree.rglob("*") if path.is_dir())]:
+        os.utime(directory, (old, old))
+
+
+class WalkTest(unittest.TestCase):
+    def setUp(self):
+        scratch = tempfile.TemporaryDirectory()
+        self.addCleanup(scratch.cleanup)
+        self.tree = Path(scratch.name, "projects")
+        self.write("-home-user-a/one.jsonl", "r1")
+        self.write("-home-user-a/one/subagents/agent-1.jsonl", "r2")
+        self.write("-home-user-b/two.jsonl", "r3")
+        settle(self.tree)
+
+    def write(self, name, request_id):
+        path = self.tree / name
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(usage_line(request_id, 10))
+
+    def test_listings_skip_unchanged_directories(self):
+        listings = {}
+
+        def walk():
+            """Return the logs found and the directories listed."""
+            with mock.patch.object(core.os, "scandir", wraps=os.scandir) as listed:
+                found = list(core.walk_jsonl_files(self.tree, listings))
+            return tuple(
+                [Path(path).relative_to(self.tree).as_posix() for path in paths]
+                for paths in (found, [call.args[0] for call in listed.call_args_list])
+            )
+
+        found, listed = walk()
+        self.assertEqual(len(found), 3)
+        self.assertEqual(len(listed), 5)
+        self.assertEqual(walk(), (found, []))
+
+        # Only the changed directories are listed again
+        self.write("-home-user-a/three.jsonl", "r4")
+        self.write("-home-user-b/two/subagents/agent-2.jsonl", "r5")
+        self.write("-home-user-a/one/subagents/agent-3.jsonl", "r6")
+        found, listed = walk()
+        self.assertEqual(
+            sorted(found),
+            [
+                "-home-user-a/one.jsonl",
+                "-home-user-a/one/subagents/agent-1.jsonl",
+                "-home-user-a/one/subagents/agent-3.jsonl",
+                "-home-user-a/three.jsonl",
+                "-home-user-b/two.jsonl",
+                "-home-user-b/two/subagents/agent-2.jsonl",
+            ],
+        )
+        self.assertEqual(
+            sorted(listed),
+            [
+                "-home-user-a",
+                "-home-user-a/one/subagents",
+                "-home-user-b",
+                "-home-user-b/two",
+                "-home-user-b/two/subagents",
+            ],
+        )
+        # Listings younger than DIR_CACHE_SETTLE_NS are not trusted yet
+        self.assertEqual(walk()[0], found)
+
+    def test_cached_runs_find_new_logs(self):
+        with tempfile.TemporaryDirectory() as cache_dir:
+            cache = Path(cache_dir, "index.json")
+
+            def messages():
+                output = subprocess.run(
+                    [sys.executable, COUNTER, "--claude-dir", str(self.tree)]
+                    + ["--cache", str(cache), "--json"],
+                    capture_output=True,
+                    text=True,
+                    check=True,
+                ).stdout
+                return json.loads(output)["total"]["messages"]
+
+            self.assertEqual(messages(), 3)
+            listings = json.loads(cache.read_text())["dirs"]
+            self.assertIn(str(self.tree / "-home-user-b"), listings)
+
+            self.write("-home-user-a/three.jsonl", "r4")
+            self.write("-home-user-b/two/subagents/agent-2.jsonl", "r5")
+            self.assertEqual(messages(), 5)
+            settle(self.tree)
+            self.write("-home-user-a/one/subagents/agent-3.jsonl", "r6")
+            self.assertEqual(messages(), 6)
+
+
+class AggregateMemoryTest(unittest.TestCase):
+    def aggregate(self, copies, requests=10):
+        """Aggregate two logs of ``copies`` copies of ``requests`` requests.
+
+        Returns the aggregate and the peak memory traced while building it.
+        """
+        scratch = tempfile.TemporaryDirectory()
+        self.addCleanup(scratch.cleanup)
+        logs = []
+        for project in ("-home-user-a", "-home-user-b"):
+            log = Path(scratch.name, project, "session.jsonl")
+            log.parent.mkdir()
+            with open(log, "w") as f:
+                for copy in range(copies):
+                    timestamp = f"2025-10-01T12:{copy % 60:02d}:00.000Z"
+                    for number in range(requests):
+                        f.write(usage_line(f"r{number}", 10, timestamp=timestamp))
+            logs.append(log)
+        tracemalloc.start()
+        try:
+            aggregated = core.aggregate_stats(
+                core.analyze_jsonl_file(str(log), project=log.parent.name)
+                for log in logs
+            )
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+        return aggregated, peak
+
+    def test_memory_does_not_grow_with_duplicates(self):
+        few, few_peak = self.aggregate(10)
+        many, many_peak = self.aggregate(1000)
+        self.assertEqual(many["total"]["messages"], 10)
+        self.assertEqual(many["dedup"]["duplicates"], 2 * 1000 * 10 - 10)
+        self.assertEqual(len(many["store"]), len(few["store"]))
+        self.assertLess(many_peak, few_peak + 256 * 1024)
+
+    def test_store_rows_follow_cells_not_requests(self):
+        # Every request of a project falls in the same hourly cell
+        aggregated, _ = self.aggregate(1, requests=2000)
+        self.assertEqual(aggregated["total"]["messages"], 2000)
+        self.assertEqual(len(aggregated["store"]), 2)
+
+
+class UsageStoreTest(unittest.TestCase):
+    def setUp(self):
+        scratch = tempfile.TemporaryDirectory()
+        self.addCleanup(scratch.cleanup)
+        pricing = Path(scratch.name, "prices.csv")
+        pricing.write_text(
+            "model,input_price_per_1m,output_price_per_1m,cache_read_price_per_1m,"
+            "cache_write_price_per_1m,effective_from\n"
+            "alpha,3,15,0.3,3.75,\n"
+            "alpha,2.5,12.5,0.25,3.125,2025-10-03\n"
+            "beta,0.8,4,0.08,1,\n"
+        )
+        self.pricing = core.load_pricing(pricing)
+        # Cells over three models (one unpriced) and six days
+        rng = random.Random(0)
+        self.store = core.UsageStore()
+        self.cells = {}
+        for _ in range(500):
+            key = (
+                f"2025-10-0{rng.randrange(1, 7)}",
+                rng.choice(("alpha", "beta", "gamma")),
+                "-home-user-a",
+                f"s{rng.randrange(20)}",
+                None,
+                None,
+            )
+            tokens = [rng.randrange(10**6) for _ in range(4)]
+            self.store.add(self.store.row(*key), *tokens)
+            totals = self.cells.setdefault(key, [0, 0, 0, 0, 0])
+            for position, count in enumerate([*tokens, 1]):
+                totals[position] += count
+
+    def test_cells_are_interned(self):
+        store = self.store
+        self.assertEqual(len(store), len(self.cells))
+        self.assertEqual(dict(store.cells()), self.cells)
+        model_position = core.CELL_DIMS.index("model")
+        models = store.values[model_position]
+        self.assertEqual(sorted(models), ["alpha", "beta", "gamma"])
+        rebuilt = core.UsageStore.from_rows(store.to_rows())
+        self.assertEqual(rebuilt.to_rows(), store.to_rows())
+
+    def expected_costs(self):
+        """Price each cell on its own, in 1/COST_SCALE dollars."""
+        costs = []
+        for row in range(len(self.store)):
+            day, model, *_ = self.store.key(row)
+            prices = self.pricing.prices(model, day)
+            tokens = [column[row] for column in self.store.columns[:4]]
+            costs.append(sum(count * price for count, price in zip(tokens, prices)))
+        return costs
+
+    def add_large_cell(self):
+        """Add a cell large enough to overflow an int64 multiply."""
+        row = self.store.row("2025-10-05", "alpha", "-home-user-a", "s0", None, None)
+        self.store.add(row, 10**13, 0, 0, 0)
+
+    def test_costs_without_numpy(self):
+        self.add_large_cell()
+        with mock.patch.object(core, "np", None):
+            costs = core.price_cells(self.store, self.pricing)
+        self.assertEqual(costs, self.expected_costs())
+
+    def test_costs_with_numpy(self):
+        if core.np is None:
+            self.skipTest("NumPy is not installed")
+        costs = core.price_cells(self.store, self.pricing)
+        self.assertEqual(costs, self.expected_costs())
+        # Falls back to Python integers rather than overflow
+        self.add_large_cell()
+        costs = core.price_cells(self.store, self.pricing)
+        self.assertEqual(costs, self.expected_costs())
+
+class DedupIndexTest(unittest.TestCase):
+    def assertOffersReturn(self, index, requests, expected):
+        """Offer ``requests`` to ``index`` and check what the offers return."""
+        for number, ((key, contribution), result) in enumerate(
+            zip(requests, expected)
+        ):
+            # Stop at the first difference rather than diffing every offer
+            self.assertEqual(index.offer(key, contribution), result, number)
+
+    def test_spilled_index_matches_the_in_memory_one(self):
+        rng = random.Random(0)
+        keys = [rng.getrandbits(64) - (1 << 63) for _ in range(3000)]
+        requests = [
+            (
+                rng.choice(keys),
+                (row, *(rng.randrange(100) for _ in range(4))),
+            )
+            for row in range(10000)
+        ]
+        for policy in ("first", "last", "max"):
+            with self.subTest(policy=policy):
+                # A dict of the counted contributions, as the index should be
+                counted = {}
+                expected = []
+                for key, contribution in requests:
+                    old = counted.get(key)
+                    if old is None or core.replaces(policy, old, contribution):
+                        counted[key] = contribution
+                        expected.append((True, old))
+                    else:
+                        expected.append((False, None))
+
+                in_memory = core.DedupIndex(policy)
+                self.assertOffersReturn(in_memory, requests, expected)
+                # Compacting every 64 insertions exercises the sorted keys and
+                # the bitmap, and a limit of 100 keys the on-disk table
+                with tempfile.TemporaryDirectory() as spill_dir, mock.patch.object(
+                    core, "DEDUP_BUFFER", 64
+                ):
+                    spilled = core.DedupIndex(policy, 100, spill_dir)
+                    try:
+                        self.assertOffersReturn(spilled, requests, expected)
+                        self.assertGreater(spilled.spilled, len(keys) // 2)
+                        self.assertLessEqual(len(spilled.keys), 100)
+                    finally:
+                        spilled.close()
+                for index in (in_memory, spilled):
+                    self.assertEqual(len(index), len(counted))
+                    self.assertEqual(
+                        index.duplicates, len(requests) - len(counted)
+                    )
+
+
+class InotifyWatcherTest(unittest.TestCase):
+    def test_reports_written_logs(self):
+        with tempfile.TemporaryDirectory() as tree:
+            project = Path(tree, "-home-user-a")
+            project.mkdir()
+            log = project / "session.jsonl"
+            log.write_text("")
+            try:
+                watcher = inotify.InotifyWatcher(tree)
+            except OSError:
+                self.skipTest("inotify is not available")
+            self.addCleanup(watcher.close)
+
+            def changed_after(change):
+                change()
+                changed = set()
+                deadline = time.monotonic() + SERVE_TIMEOUT
+                while time.monotonic() < deadline:
+                    events = watcher.wait(0.2)
+                    self.assertIsNotNone(events)
+                    if not events and changed:
+                        break
+                    changed |= events
+                return changed
+
+            def append():
+                with open(log, "a") as f:
+                    f.write(usage_line("r1", 10))
+
+            self.assertEqual(changed_after(append), {log})
+
+            def add_project():
+                other = Path(tree, "-home-user-b", "session", "subagents")
+                other.mkdir(parents=True)
+                (other / "agent.jsonl").write_text(usage_line("r2", 10))
+                (other / "notes.txt").write_text("not a log")
+
+            self.assertEqual(
+                changed_after(add_project),
+                {Path(tree, "-home-user-b", "session", "subagents", "agent.jsonl")},
+            )
+
+
+class MergeTest(GeneratedTreeTest):
+    def test_merged_snapshots_match_a_scan(self):
+        # One snapshot per project, numbered in the order a scan walks them,
+        # so requests copied across projects are exported several times
+        projects = [entry.name for entry in os.scandir(self.tree.name)]
+        with tempfile.TemporaryDirectory() as scratch:
+            for policy in ("first", "last", "max"):
+                snapshots = Path(scratch, policy)
+                snapshots.mkdir()
+                for number, project in enumerate(projects):
+                    tree = Path(scratch, "trees", policy, project)
+                    shutil.copytree(Path(self.tree.name, project), tree / project)
+                    self.invoke(
+                        "--dedup",
+                        policy,
+                        "export-snapshot",
+                        f"--host=host{number}",
+                        f"--output={snapshots / f'{number:02}{SNAPSHOT_SUFFIX}'}",
+                        claude_dir=tree,
+                    )
+                paths = sorted(str(path) for path in snapshots.iterdir())
+                with self.subTest(policy=policy):
+                    merged = json.loads(
+                        self.run_counter("--json", "--dedup", policy, "merge", *paths)
+                    )
+                    self.assertEqual(merged, self.report("--dedup", policy))
+                if policy != "last":
+                    with self.subTest(policy=policy, snapshots="repeated"):
+                        again = self.run_counter(
+                            "--json", "--dedup", policy, "merge", str(snapshots), *paths
+                        )
+                        self.assertEqual(json.loads(again), merged)
+
+
+class ServeTest(GeneratedTreeTest):
+    def assertTotals(self, served, exact):
+        self.assertEqual(served["tokens"], exact["tokens"])
+        self.assertEqual(served["messages"], exact["messages"])
+        self.assertAlmostEqual(served["cost"], exact["cost"], places=6)
+
+    def wait_for(self, condition):
+        deadline = time.monotonic() + SERVE_TIMEOUT
+        while not condition():
+            if time.monotonic() > deadline:
+                self.fail("timed out waiting for the server")
+            time.sleep(0.2)
+
+    def test_metrics_follow_appends(self):
+        with tempfile.TemporaryFile("w+") as log:
+            server = subprocess.Popen(
+                [sys.executable, COUNTER, "--claude-dir", self.tree.name]
+                + ["--no-cache", "--interval", "0.5", "serve", "--port", "0"],
+                stderr=log,
+                text=True,
+            )
+            self.addCleanup(server.wait)
+            self.addCleanup(server.terminate)
+
+            def address():
+                log.seek(0)
+                return re.search(r"Serving (http://\S+/metrics)", log.read())
+
+            self.wait_for(address)
+            url = address().group(1)
+
+            def page():
+                with urllib.request.urlopen(url) as response:
+                    return response.read().decode("utf-8")
+
+            def metrics():
+                return metric_totals(page())
+
+            def refreshed():
+                line = re.search(
+                    r"^claude_usage_last_refresh_timestamp_seconds (\S+)$",
+                    page(),
+                    re.MULTILINE,
+                )
+                return float(line.group(1))
+
+            initial = totals(self.report())
+            self.assertTotals(metrics(), initial)
+            first_refresh = refreshed()
+            # New requests from one log's lines, appended to another
+            logs = sorted(Path(self.tree.name).glob("*/*.jsonl"))
+            lines = logs[1].read_text().splitlines(keepends=True)[:60]
+            with open(logs[0], "a") as f:
+                for line in lines:
+                    f.write(re.sub(r'("requestId": ?")', r"\1appended-", line))
+            exact = totals(self.report())
+            self.assertGreater(exact["messages"], initial["messages"])
+            self.wait_for(lambda: metrics()["messages"] == exact["messages"])
+            self.assertTotals(metrics(), exact)
+            self.assertGreater(refreshed(), first_refresh)
+
+
+def usage_line(
+    request_id,
+    output_tokens,
+    session="session",
+    model="claude-sonnet-4-5",
+    timestamp="2025-10-01T12:00:00.000Z",
+    input_tokens=1,
+    cache_read_tokens=0,
+):
+    """Return one assistant log line of ``request_id`` with ``output_tokens``."""
+    usage = {"input_tokens": input_tokens, "output_tokens": output_tokens}
+    if cache_read_tokens:
+        usage["cache_read_input_tokens"] = cache_read_tokens
+    record = {
+        "type": "assistant",
+        "requestId": request_id,
+        "sessionId": session,
+        "timestamp": timestamp,
+        "message": {
+            "model": model,
+            "usage": usage,
+        },
+    }
+    return json.dumps(record) + "\n"
+
+
+class ReportTest(unittest.TestCase):
+    """Report sections checked against totals worked out from RECORDS."""
+
+    PRICING = (
+        "model,input_price_per_1m,output_price_per_1m,cache_read_price_per_1m,"
+        "cache_write_price_per_1m\n"
+        "alpha,1,10,0.5,0\n"
+        "beta,4,40,2,0\n"
+    )
+
+    # Dollars per token of input, output and cache reads
+    PRICES = {"alpha": (1e-6, 10e-6, 0.5e-6), "beta": (4e-6, 40e-6, 2e-6)}
+
+    # (project, session, model, timestamp, requestId, input, output, cache read)
+    RECORDS = (
+        ("-home-user-a", "s1", "alpha", "2025-10-01T10:05", "r1", 1000, 100, 4000),
+        ("-home-user-a", "s1", "beta", "2025-10-01T11:30", "r2", 2000, 300, 0),
+        ("-home-user-a", "s2", "alpha", "2025-10-02T09:00", "r3", 500, 50, 1500),
+        ("-home-user-b", "s3", "beta", "2025-10-02T09:10", "r4", 3000, 10, 6000),
+        ("-home-user-b", "s3", "alpha", "2025-10-03T23:59", "r5", 10, 1, 0),
+    )
+
+    def setUp(self):
+        scratch = tempfile.TemporaryDirectory()
+        self.addCleanup(scratch.cleanup)
+        self.pricing = Path(scratch.name, "prices.csv")
+        self.pricing.write_text(self.PRICING)
+        self.tree = Path(scratch.name, "projects")
+        for project, session, model, minute, request_id, *tokens in self.RECORDS:
+            log = self.tree / project / f"{session}.jsonl"
+            log.parent.mkdir(parents=True, exist_ok=True)
+            line = self.line(request_id, session, model, f"{minute}:00.000Z", *tokens)
+            with open(log, "a") as f:
+                # r4 is logged twice and counted once
+                f.write(line * (2 if request_id == "r4" else 1))
+
+    def line(self, request_id, session, model, timestamp, input, output, cache_read):
+        return usage_line(
+            request_id,
+            output,
+            session=session,
+            model=model,
+            timestamp=timestamp,
+            input_tokens=input,
+            cache_read_tokens=cache_read,
+        )
+
+    def report(self, *args):
+        output = subprocess.run(
+            [sys.executable, COUNTER, "--claude-dir", str(self.tree), "--no-cache"]
+            + ["--json", "--pricing", str(self.pricing), *args],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout
+        return json.loads(output)
+
+    def expected_groups(self, key_of):
+        """Return ``{key: [tokens, messages, cost]}`` of RECORDS grouped by key_of."""
+        groups = {}
+        for record in self.RECORDS:
+            _, _, model, _, _, input, output, cache_read = record
+            group = groups.setdefault(key_of(record), [0, 0, 0.0])
+            group[0] += input + output + cache_read
+            group[1] += 1
+            prices = self.PRICES[model]
+            tokens = (input, output, cache_read)
+            group[2] += sum(count * price for count, price in zip(tokens, prices))
+        return groups
+
+    def assertRows(self, rows, dims, expected):
+        """Check --group-by rows against ``[(key, [tokens, messages, cost])]``."""
+        self.assertEqual(
+            [tuple(row[dim] for dim in dims) for row in rows],
+            [key for key, _ in expected],
+        )
+        for row, (key, (tokens, messages, cost)) in zip(rows, expected):
+            with self.subTest(key=key):
+                columns = ("input", "output", "cache_write", "cache_read")
+                self.assertEqual(sum(row[column] for column in columns), tokens)
+                self.assertEqual(row["messages"], messages)
+                self.assertAlmostEqual(row["cost"], cost)
+
+    def test_group_by_top_and_sort(self):
+        def check(args, dims, expected):
+            with self.subTest(args=args):
+                rows = self.report("--group-by", ",".join(dims), *args)["groups"]
+                self.assertRows(rows["rows"], dims, expected)
+
+        by_project_model = self.expected_groups(lambda record: (record[0], record[2]))
+        by_date = self.expected_groups(lambda record: (record[3][:10],))
+        by_hour = self.expected_groups(lambda record: (record[3][:13],))
+        # Key order by default, otherwise largest first by the metric
+        check((), ("project", "model"), sorted(by_project_model.items()))
+        check(
+            ("--sort", "cost"),
+            ("date",),
+            sorted(by_date.items(), key=lambda item: -item[1][2]),
+        )
+        # --top sorts by tokens unless told otherwise
+        check(
+            ("--top", "2"),
+            ("hour",),
+            sorted(by_hour.items(), key=lambda item: -item[1][0])[:2],
+        )
+        check(
+            ("--top", "1", "--sort", "messages"),
+            ("date",),
+            [(("2025-10-02",), by_date[("2025-10-02",)])],
+        )
+    def test_sessions(self):
+        by_session = self.expected_groups(lambda record: record[1])
+        by_session_model = self.expected_groups(lambda record: (record[1], record[2]))
+        rows = {row["session"]: row for row in self.report("--sessions")["sessions"]}
+        # Largest cost first by default
+        self.assertEqual(
+            list(rows), sorted(by_session, key=lambda session: -by_session[session][2])
+        )
+        spans = {
+            "s1": ("-home-user-a", "2025-10-01T10:05", "2025-10-01T11:30", 85 * 60),
+            "s2": ("-home-user-a", "2025-10-02T09:00", "2025-10-02T09:00", 0),
+            "s3": ("-home-user-b", "2025-10-02T09:10", "2025-10-03T23:59", 2329 * 60),
+        }
+        for session, (project, start, end, duration) in spans.items():
+            row = rows[session]
+            tokens, messages, cost = by_session[session]
+            with self.subTest(session=session):
+                self.assertEqual(row["project"], project)
+                self.assertEqual(row["start"], f"{start}:00.000Z")
+                self.assertEqual(row["end"], f"{end}:00.000Z")
+                self.assertEqual(row["duration"], duration)
+                self.assertEqual(row["tokens"], tokens)
+                self.assertEqual(row["messages"], messages)
+                self.assertAlmostEqual(row["cost"], cost)
+                self.assertEqual(
+                    row["models"],
+                    {
+                        model: totals[0]
+                        for (name, model), totals in by_session_model.items()
+                        if name == session
+                    },
+                )
+        # Cache reads over the prompt: s1 reads 4,000 of 7,000 tokens
+        self.assertAlmostEqual(rows["s1"]["cache_hit_ratio"], 4000 / 7000)
+        self.assertAlmostEqual(rows["s3"]["cache_hit_ratio"], 6000 / 9010)
+
+        top = self.report("--sessions", "--top", "1", "--sort", "tokens")["sessions"]
+        self.assertEqual([row["session"] for row in top], ["s3"])
+
+    def test_windows(self):
+        # A clock 30 minutes behind the newest record, which moves it forward
+        now = int(time.time())
+        ages = {"r10": -30, "r11": 10, "r12": 2 * 60, "r13": 3 * 24 * 60}
+        ages["r14"] = 8 * 24 * 60
+        tokens = {}
+        log = self.tree / "-home-user-c" / "recent.jsonl"
+        log.parent.mkdir()
+        with open(log, "w") as f:
+            for number, (request_id, age) in enumerate(ages.items()):
+                moment = datetime.fromtimestamp(now - age * 60, timezone.utc)
+                timestamp = moment.strftime("%Y-%m-%dT%H:%M:%S.000Z")
+                usage = tokens[request_id] = (100 * (number + 1), 10 * (number + 1), 0)
+                f.write(self.line(request_id, "s4", "beta", timestamp, *usage))
+
+        summary = self.report("--windows")["windows"]
+        newest = datetime.fromtimestamp((now + 30 * 60) // 60 * 60, timezone.utc)
+        self.assertEqual(summary["now"], newest.isoformat())
+        for name, minutes in (("1h", 60), ("5h", 5 * 60), ("7d", 7 * 24 * 60)):
+            inside = [request_id for request_id, age in ages.items() if age < minutes]
+            window = summary["windows"][name]
+            with self.subTest(window=name):
+                self.assertEqual(window["messages"], len(inside))
+                self.assertEqual(
+                    window["tokens"],
+                    sum(sum(tokens[request_id]) for request_id in inside),
+                )
+                self.assertAlmostEqual(
+                    window["cost"],
+                    sum(
+                        4e-6 * tokens[request_id][0] + 40e-6 * tokens[request_id][1]
+                        for request_id in inside
+                    ),
+                )
+        # The oldest usage of the last hour is r11, 40 minutes before the clock
+        self.assertEqual(summary["windows"]["1h"]["expires_in"], 20 * 60)
+        burn = summary["burn_rate"]
+        self.assertAlmostEqual(burn["tokens_per_hour"], (110 + 220) * 60 / 40)
+
+    def test_window_ring_matches_a_list_of_requests(self):
+        lengths = {"short": 3, "long": 7}
+        rng = random.Random(0)
+        now = 1_760_000_000.5
+        window = core.UsageWindow(now, lengths)
+        # Requests in the ring, as (minute, tokens)
+        held = []
+        for step in range(2000):
+            choice = rng.random()
+            if choice < 0.3:
+                # Sometimes far enough to empty the whole ring
+                now += rng.choice((rng.randrange(0, 240), 10 * 60))
+                window.advance(now)
+            elif choice < 0.8 or not held:
+                # Up to two minutes ahead of the clock, or before the ring
+                minute = int(now // 60) - rng.randrange(-2, 10)
+                moment = datetime.fromtimestamp(minute * 60, timezone.utc)
+                timestamp = moment.strftime("%Y-%m-%dT%H:%M:%S.000Z")
+                size = rng.randrange(1, 100)
+                window.add((timestamp, size, 0, 0, 0, "model"))
+                now = max(now, minute * 60)
+                if int(now // 60) - minute < 7:
+                    held.append((minute, size, timestamp))
+            else:
+                minute, size, timestamp = held.pop(rng.randrange(len(held)))
+                window.add((timestamp, size, 0, 0, 0, "model"), sign=-1)
+
+            current = int(now // 60)
+            self.assertEqual(window.now, now)
+            for name, length in lengths.items():
+                inside = [entry for entry in held if entry[0] > current - length]
+                expires_in = None
+                if inside:
+                    oldest = min(minute for minute, _, _ in inside)
+                    expires_in = (oldest + length) * 60 - now
+                self.assertEqual(
+                    window.window(name),
+                    {
+                        "minutes": length,
+                        "tokens": sum(size for _, size, _ in inside),
+                        "cost": 0,
+                        "messages": len(inside),
+                        "expires_in": expires_in,
+                    },
+                    (step, name),
+                )
+
+
+class PricingTest(unittest.TestCase):
+    def test_globs_aliases_and_effective_dates(self):
+        pricing = (
+            "model,input_price_per_1m,output_price_per_1m,cache_read_price_per_1m,"
+            "cache_write_price_per_1m,effective_from,alias_of\n"
+            "base,1,0,0,0,,\n"
+            "base,10,0,0,0,2025-10-15,\n"
+            "family-*,,,,,,base\n"
+            "pinned,,,,,,family-x\n"
+        )
+        # (model, day, dollars per million input tokens)
+        records = [
+            ("base", "2025-10-01", 1),
+            ("base", "2025-10-20", 10),
+            ("family-small", "2025-10-01", 1),
+            ("anthropic/family-large[1m]", "2025-10-20", 10),
+            ("pinned", "2025-10-14", 1),
+            ("unknown", "2025-10-20", 0),
+        ]
+        with tempfile.TemporaryDirectory() as scratch:
+            pricing_path = Path(scratch, "prices.csv")
+            pricing_path.write_text(pricing)
+            tree = Path(scratch, "projects")
+            project = tree / "-home-user-a"
+            project.mkdir(parents=True)
+            (project / "session.jsonl").write_text(
+                "".join(
+                    usage_line(
+                        f"r{number}",
+                        0,
+                        model=model,
+                        timestamp=f"{day}T12:00:00.000Z",
+                        input_tokens=1_000_000,
+                    )
+                    for number, (model, day, _) in enumerate(records)
+                )
+            )
+            output = subprocess.run(
+                [sys.executable, COUNTER, "--claude-dir", str(tree), "--no-cache"]
+                + ["--json", "--pricing", str(pricing_path)],
+                capture_output=True,
+                text=True,
+                check=True,
+            ).stdout
+        report = json.loads(output)
+        costs = Counter()
+        for model, _, dollars in records:
+            costs[model] += dollars
+        for model, dollars in costs.items():
+            with self.subTest(model=model):
+                self.assertAlmostEqual(report["by_model"][model]["cost"], dollars)
+        self.assertEqual(report["unpriced_models"], ["unknown"])
+        self.assertAlmostEqual(report["by_date"]["2025-10-20"]["cost"], 20)
+
+
+class CostTest(unittest.TestCase):
+    def test_costs_are_exact(self):
+        # Prices per million input, output and cache read tokens
+        prices = {
+            "claude-sonnet-4-5-20250929": ("3.00", "15.00", "0.30"),
+            "claude-haiku-4-5-20251001": ("0.80", "4.00", "0.08"),
+        }
+        rng = random.Random(0)
+        records = [
+            (
+                rng.choice(sorted(prices)),
+                f"2025-10-{rng.randrange(1, 29):02d}",
+                [rng.randrange(1, 50_000) for _ in range(3)],
+            )
+            for _ in range(1000)
+        ]
+        with tempfile.TemporaryDirectory() as scratch:
+            log = Path(scratch, "projects", "-home-user-a", "session.jsonl")
+            log.parent.mkdir(parents=True)
+            log.write_text(
+                "".join(
+                    usage_line(
+                        f"r{number}",
+                        output,
+                        model=model,
+                        timestamp=f"{day}T12:00:00.000Z",
+                        input_tokens=input,
+                        cache_read_tokens=cache_read,
+                    )
+                    for number, (model, day, (input, output, cache_read)) in (
+                        enumerate(records)
+                    )
+                )
+            )
+            pricing = SCRIPT_DIR / "model-cost.csv"
+            output = subprocess.run(
+                [sys.executable, COUNTER, "--claude-dir", str(log.parents[1])]
+                + ["--no-cache", "--json", "--pricing", str(pricing)],
+                capture_output=True,
+                text=True,
+                check=True,
+            ).stdout
+        report = json.loads(output)
+
+        exact = {"total": Decimal(0)}
+        floats = {"total": 0.0}
+        for model, day, tokens in records:
+            for group in ("total", model, day):
+                exact.setdefault(group, Decimal(0))
+                floats.setdefault(group, 0.0)
+                for count, price in zip(tokens, prices[model]):
+                    exact[group] += count * Decimal(price) / 1_000_000
+                    floats[group] += count * float(price) / 1_000_000
+        reported = {"total": report["total"], **report["by_model"], **report["by_date"]}
+        for group, cost in exact.items():
+            with self.subTest(group=group):
+                # Exact to the nearest float, where float sums only come close
+                self.assertEqual(reported[group]["cost"], float(cost))
+                self.assertAlmostEqual(reported[group]["cost"], floats[group], places=6)
+
+
+class OpencodeTest(unittest.TestCase):
+    def setUp(self):
+        scratch = tempfile.TemporaryDirectory()
+        self.addCleanup(scratch.cleanup)
+        self.scratch = Path(scratch.name)
+        self.storage = self.scratch / "storage"
+
+    def write_message(self, session, name, role="assistant", output=10, **path):
+        message = {
+            "id": name,
+            "sessionID": session,
+            "role": role,
+            "modelID": "glm-4.6",
+            "time": {"created": 1_759_320_000_000},
+            "path": path or {"cwd": "/home/user/repo/src", "root": "/home/user/repo"},
+            "tokens": {
+                "input": 100,
+                "output": output,
+                "reasoning": 5,
+                "cache": {"read": 1000, "write": 0},
+            },
+        }
+        message_path = self.storage / "message" / session / f"{name}.json"
+        message_path.parent.mkdir(parents=True, exist_ok=True)
+        message_path.write_text(json.dumps(message))
+        return message_path
+
+    def report(self, *args, cache=None):
+        index = ["--cache", cache] if cache else ["--no-cache"]
+        output = subprocess.run(
+            [sys.executable, COUNTER, "--opencode-dir", str(self.storage), *index]
+            + ["--json", *args],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout
+        return json.loads(output)
+
+    def test_sessions_are_reported(self):
+        self.write_message("ses_1", "msg_1")
+        self.write_message("ses_1", "msg_2", role="user")
+        self.write_message("ses_2", "msg_3", output=20, cwd="/tmp/scratch", root="/")
+        report = self.report("--source", "opencode")
+        self.assertEqual(report["total"]["messages"], 2)
+        # Reasoning tokens are billed as output
+        self.assertEqual(report["total"]["output"], 40)
+        self.assertEqual(report["total"]["cache_read"], 2000)
+        self.assertEqual(report["sessions_count"], 2)
+        self.assertEqual(
+            sorted(report["by_project"]), ["-home-user-repo", "-tmp-scratch"]
+        )
+        self.assertEqual(report["by_date"]["2025-10-01"]["messages"], 2)
+
+    def test_rewritten_and_deleted_messages_are_counted_once(self):
+        self.write_message("ses_1", "msg_1")
+        deleted = self.write_message("ses_1", "msg_2")
+        cache = str(self.scratch / "index.json")
+        self.report("--source", "opencode", cache=cache)
+
+        rewritten = self.write_message("ses_1", "msg_1", output=50)
+        os.utime(rewritten, ns=(0, 1_000_000_000))
+        deleted.unlink()
+        report = self.report("--source", "opencode", cache=cache)
+        self.assertEqual(report, self.report("--source", "opencode"))
+        self.assertEqual(report["total"]["messages"], 1)
+        self.assertEqual(report["total"]["output"], 55)
+
+    def test_all_sources_add_up(self):
+        self.write_message("ses_1", "msg_1")
+        tree = self.scratch / "projects"
+        (tree / "-home-user-a").mkdir(parents=True)
+        (tree / "-home-user-a" / "session.jsonl").write_text(usage_line("r1", 10))
+        both = self.report("--source", "all", "--claude-dir", str(tree))
+        opencode = self.report("--source", "opencode")
+        claude = self.report("--source", "claude", "--claude-dir", str(tree))
+        for column in ("input", "output", "messages"):
+            with self.subTest(column=column):
+                self.assertEqual(
+                    both["total"][column],
+                    opencode["total"][column] + claude["total"][column],
+                )
+
+
+class ArchiveTest(unittest.TestCase):
+    def setUp(self):
+        scratch = tempfile.TemporaryDirectory()
+        self.addCleanup(scratch.cleanup)
+        self.scratch = Path(scratch.name)
+        self.tree = self.scratch / "projects"
+        # One request logged three times with different usage, twice in one
+        # directory and once in another
+        self.logs = {
+            "-home-user-a/1.jsonl": usage_line("r1", 10) + usage_line("r2", 5),
+            "-home-user-a/2.jsonl": usage_line("r1", 50),
+            "-home-user-b/3.jsonl": usage_line("r1", 30, "other"),
+        }
+        for name, text in self.logs.items():
+            path = self.tree / name
+            path.parent.mkdir(parents=True, exist_ok=True)
+            path.write_text(text)
+            os.utime(path, (0, 0))
+
+    def archive(self, *args, check=True):
+        return subprocess.run(
+            [sys.executable, COUNTER, "--claude-dir", self.tree, "archive", *args],
+            capture_output=True,
+            text=True,
+            check=check,
+        )
+
+    def assertArchived(self):
+        """Check that only the summaries are left in the tree."""
+        remaining = sorted(path.name for path in self.tree.glob("*/*"))
+        self.assertEqual(len(remaining), 2)
+        for name in remaining:
+            self.assertTrue(name.startswith("usage-archive-"), name)
+
+    def test_reports_match_under_every_policy(self):
+        def report(policy):
+            output = subprocess.run(
+                [sys.executable, COUNTER, "--claude-dir", self.tree, "--no-cache"]
+                + ["--json", "--dedup", policy],
+                capture_output=True,
+                text=True,
+                check=True,
+            ).stdout
+            parsed = json.loads(output)
+            groups = ("total", "by_project", "by_model")
+            return {group: parsed[group] for group in groups}
+
+        policies = ("first", "last", "max")
+        before = {policy: report(policy) for policy in policies}
+        self.archive()
+        self.assertArchived()
+        for policy in policies:
+            with self.subTest(policy=policy):
+                self.assertEqual(report(policy), before[policy])
+
+    def test_originals_are_kept(self):
+        self.assertIn("moved to", self.archive().stderr)
+        self.assertArchived()
+        for name, text in self.logs.items():
+            with self.subTest(name=name):
+                kept = self.scratch / "archived-logs" / name
+                self.assertEqual(kept.read_text(), text)
+
+        log = self.tree / "-home-user-c" / "4.jsonl"
+        log.parent.mkdir()
+        log.write_text(usage_line("r3", 1))
+        os.utime(log, (0, 0))
+        self.archive("--keep-dir", str(self.scratch / "elsewhere"))
+        kept = self.scratch / "elsewhere" / "-home-user-c" / "4.jsonl"
+        self.assertEqual(kept.read_text(), usage_line("r3", 1))
+
+    def test_delete(self):
+        self.assertIn("deleted", self.archive("--delete").stderr)
+        self.assertArchived()
+        self.assertFalse((self.scratch / "archived-logs").exists())
+
+    def test_keep_dir_inside_the_tree_is_refused(self):
+        run = self.archive("--keep-dir", str(self.tree / "old"), check=False)
+        self.assertEqual(run.returncode, 1)
+        left = [path.relative_to(self.tree) for path in self.tree.glob("*/*")]
+        self.assertEqual(sorted(path.as_posix() for path in left), sorted(self.logs))
+
+if __name__ == "__main__":
+    unittest.main()